@@ -0,0 +1,174 @@
+"""
+Benchmarks of the frozen emissions functions on synthetic CEDS data
+
+The suites follow the airspeed velocity (asv) conventions: each class' setup()
+is called with its parameters, then its time_* methods are timed. They are run
+with run_benchmarks.py, or with asv if it is installed. The synthetic data is
+read from the directory given by the FROZEN_BENCH_DIR environment variable,
+or generated once per process at the scale given by FROZEN_BENCH_SCALE
+(default 'small', see synthetic_data.SCALES).
+"""
+import os
+import tempfile
+
+import synthetic_data
+
+import ceds_io
+import config
+import driver
+import emission_factor_file
+import outlier_detection
+import z_stats
+
+# Species of the synthetic data. SO2 has a mass-balance correction, BC does not
+BENCH_SPECIES = ['BC', 'SO2']
+
+# Synthetic data directory generated by get_data_dir()
+_DATA_DIR = None
+
+
+def get_data_dir():
+    """
+    Get the synthetic data directory, generating it if needed.
+
+    Return
+    -------
+    str
+    """
+    global _DATA_DIR
+    if (os.environ.get('FROZEN_BENCH_DIR')):
+        _DATA_DIR = os.environ['FROZEN_BENCH_DIR']
+    if (_DATA_DIR is None or not os.path.isfile(os.path.join(_DATA_DIR, 'config.yml'))):
+        if (_DATA_DIR is None):
+            _DATA_DIR = tempfile.mkdtemp(prefix='frozen-bench-')
+        scale = os.environ.get('FROZEN_BENCH_SCALE', 'small')
+        synthetic_data.main([_DATA_DIR, '--scale', scale, '--species', ','.join(BENCH_SPECIES)])
+    return _DATA_DIR
+
+
+def init_config(backend='dataframe'):
+    """
+    Initialize the global CONFIG object for the synthetic data.
+
+    Parameters
+    -----------
+    backend : str, optional
+        EF backend. Default is 'dataframe'
+
+    Return
+    -------
+    config.ConfigObj
+    """
+    cfg = synthetic_data.init_config(get_data_dir())
+    cfg.freeze_backend = backend
+    return cfg
+
+
+class TimeEmissionFactorFile:
+    """
+    Reading, constructing, outlier detection, & freezing of a single species'
+    emissions factors
+    """
+    params = ['dataframe', 'array']
+    param_names = ['backend']
+
+    def setup(self, backend):
+        init_config(backend)
+        self.year_strs = ['X{}'.format(yr) for yr in range(config.CONFIG.freeze_year,
+                                                           config.CONFIG.ceds_meta['year_last'] + 1)]
+        self.f_path = ceds_io.get_file_for_species(config.CONFIG.dirs['cmip6'], 'BC', 'ef')
+        self.ef_df = ceds_io.read_ceds_file(self.f_path)
+        self.ef_obj = emission_factor_file.init_ef_obj('BC', self.f_path, ef_df=self.ef_df)
+
+    def time_read_ef_file(self, backend):
+        ceds_io.read_ceds_file(self.f_path)
+
+    def time_init(self, backend):
+        emission_factor_file.init_ef_obj('BC', self.f_path, ef_df=self.ef_df)
+
+    def time_ef_median(self, backend):
+        z_stats.get_ef_median(self.ef_obj)
+
+    def time_outliers_zscore_grouped(self, backend):
+        # Outlier detection as run by the driver, incl. the grouping of the EFs
+        outlier_detection.detect(outlier_detection.EFGroups.from_ef_obj(self.ef_obj))
+
+    def time_freeze(self, backend):
+        # Freezing is idempotent, so re-freezing the same object is representative
+        self.ef_obj.freeze_emissions(self.year_strs, in_place=True)
+
+    def time_all_factors(self, backend):
+        self.ef_obj.all_factors
+
+
+class TimeOutlierDetection:
+    """
+    Outlier detection methods on shared per-group precomputation
+    """
+    params = sorted(outlier_detection.DETECTORS.keys())
+    param_names = ['method']
+
+    def setup(self, method):
+        init_config()
+        f_path = ceds_io.get_file_for_species(config.CONFIG.dirs['cmip6'], 'BC', 'ef')
+        self.ef_obj = emission_factor_file.init_ef_obj('BC', f_path)
+        self.groups = outlier_detection.EFGroups.from_ef_obj(self.ef_obj)
+
+    def time_precompute(self, method):
+        outlier_detection.EFGroups.from_ef_obj(self.ef_obj)
+
+    def time_detect(self, method):
+        # Statistics cached by an earlier run are dropped so each run starts
+        # from the shared precomputation
+        self.groups._cache.clear()
+        outlier_detection.detect(self.groups, method)
+
+
+class TimeCalc:
+    """
+    Calculation of the frozen total emissions
+    """
+
+    def setup(self):
+        init_config()
+        self.frozen_df = driver.freeze_species('BC', write=True)
+        activity_file = ceds_io.get_file_for_species(config.CONFIG.dirs['cmip6'], 'BC',
+                                                     'activity')
+        self.act_df = ceds_io.read_ceds_file(activity_file)
+
+    def time_calc_species_in_memory(self):
+        driver.calc_species('BC', ef_df=self.frozen_df, act_df=self.act_df)
+
+    def time_calc_species_from_file(self):
+        driver.calc_species('BC')
+
+    def time_freeze_calc_emissions(self):
+        driver.freeze_calc_emissions()
+
+
+class TimeWrite:
+    """
+    Writing a total emissions file
+    """
+    params = [None, 'gzip']
+    param_names = ['compression']
+
+    def setup(self, compression):
+        init_config()
+        config.CONFIG.output['compression'] = compression
+        f_path = ceds_io.get_file_for_species(config.CONFIG.dirs['cmip6'], 'BC', 'activity')
+        self.df = ceds_io.read_ceds_file(f_path)
+        self.out_path = os.path.join(config.CONFIG.dirs['output'], 'bench_write.csv')
+
+    def teardown(self, compression):
+        out_path = ceds_io.get_output_path(self.out_path)
+        if (os.path.isfile(out_path)):
+            os.remove(out_path)
+
+    def time_write_ceds_file(self, compression):
+        ceds_io.write_ceds_file(self.df, self.out_path)
+
+    def time_to_csv(self, compression):
+        # Baseline of the CEDS writer
+        self.df.to_csv(ceds_io.get_output_path(self.out_path), index=False,
+                       compression=compression)
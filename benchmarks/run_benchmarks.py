@@ -0,0 +1,152 @@
+"""
+Run the benchmark suites in benchmarks.py without asv
+
+Each benchmark is run 'repeat' times after its suite's setup() and the min,
+median, & max wall times are printed and, optionally, written to a csv file.
+
+Usage, from the benchmarks/ directory:
+
+    python run_benchmarks.py --scale medium --repeat 5 -k outliers -o results.csv
+"""
+import argparse
+import contextlib
+import csv
+import inspect
+import itertools
+import logging
+import os
+import re
+import statistics
+import timeit
+
+import synthetic_data
+
+
+def get_suites(bench_module):
+    """
+    Get the benchmark suites of a module, i.e. its classes named 'Time*'.
+
+    Parameters
+    -----------
+    bench_module : module
+
+    Return
+    -------
+    list of class
+    """
+    return [obj for name, obj in inspect.getmembers(bench_module, inspect.isclass)
+            if name.startswith('Time') and obj.__module__ == bench_module.__name__]
+
+
+def get_param_sets(suite):
+    """
+    Get every combination of a suite's parameters.
+
+    Parameters
+    -----------
+    suite : class
+
+    Return
+    -------
+    list of tuple
+    """
+    params = getattr(suite, 'params', None)
+    if (params is None):
+        return [()]
+    if (not getattr(suite, 'param_names', None) or len(suite.param_names) == 1):
+        return [(param,) for param in params]
+    return list(itertools.product(*params))
+
+
+def run_suite(suite, pattern, repeat):
+    """
+    Run the matching benchmarks of a suite for every parameter combination.
+
+    Parameters
+    -----------
+    suite : class
+    pattern : compiled regex
+        Only benchmarks whose '<suite>.<method>' name matches are run
+    repeat : int
+        Number of times each benchmark is run
+
+    Return
+    -------
+    list of dict with keys 'benchmark', 'params', 'min_s', 'median_s', & 'max_s'
+    """
+    names = ['{}.{}'.format(suite.__name__, name) for name in sorted(dir(suite))
+             if name.startswith('time_')]
+    names = [name for name in names if pattern.search(name)]
+    if (not names):
+        return []
+    results = []
+    for params in get_param_sets(suite):
+        bench = suite()
+        if (hasattr(bench, 'setup')):
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                bench.setup(*params)
+        for name in names:
+            method = getattr(bench, name.split('.')[1])
+            # Keep the driver's progress messages out of the results table
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                times = timeit.repeat(lambda: method(*params), repeat=repeat, number=1)
+            result = {'benchmark' : name,
+                      'params'    : ','.join(str(param) for param in params),
+                      'min_s'     : round(min(times), 4),
+                      'median_s'  : round(statistics.median(times), 4),
+                      'max_s'     : round(max(times), 4)}
+            print('{benchmark:<52} {params:<12} {min_s:>9.4f} {median_s:>9.4f} '
+                  '{max_s:>9.4f}'.format(**result))
+            results.append(result)
+        if (hasattr(bench, 'teardown')):
+            bench.teardown(*params)
+    return results
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+
+    Return
+    -------
+    argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scale', default='small', choices=sorted(synthetic_data.SCALES.keys()),
+                        help='Named scale of the synthetic data. Default is small')
+    parser.add_argument('--data-dir', default=None,
+                        help='Synthetic data directory. Re-used if it exists, otherwise '
+                             'generated. Default is a temporary directory')
+    parser.add_argument('-k', '--filter', default='',
+                        help='Only run benchmarks whose name matches this regex')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of runs of each benchmark. Default is 3')
+    parser.add_argument('-o', '--output', default=None, help='Results csv file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if (args.data_dir):
+        os.environ['FROZEN_BENCH_DIR'] = os.path.abspath(args.data_dir)
+    os.environ['FROZEN_BENCH_SCALE'] = args.scale
+    # Keep the driver's logging out of the timings
+    logging.getLogger('main').setLevel(logging.ERROR)
+
+    import benchmarks
+    benchmarks.get_data_dir()
+    pattern = re.compile(args.filter)
+    print('{:<52} {:<12} {:>9} {:>9} {:>9}'.format('benchmark', 'params', 'min', 'median', 'max'))
+    results = []
+    for suite in get_suites(benchmarks):
+        results.extend(run_suite(suite, pattern, args.repeat))
+    if (args.output):
+        with open(args.output, 'w', newline='') as fh:
+            writer = csv.DictWriter(fh, fieldnames=['benchmark', 'params', 'min_s',
+                                                    'median_s', 'max_s'])
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+Generate synthetic CMIP6 emissions factors & activity files with the CEDS
+schema for benchmarking
+
+The files have the columns 'iso', 'sector', 'fuel', 'units', & X<year_first>
+through X<year_last>, with a row for every combustion fuel of every combustion
+sector and a 'process' row for every other sector (sectors from
+input/master_sector.csv) of every ISO (from input/ceds_isos.csv). Emissions
+factors are log-normal with a small share of zeros & outliers, so outlier
+detection has something to find. The data is random, so the files are only
+useful for timing, not for checking results.
+
+Usage, from the benchmarks/ directory:
+
+    python synthetic_data.py <output dir> --scale medium --species BC,SO2
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Insert src directory to Python path for importing
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(1, SRC_DIR)
+
+import config
+
+# Number of ISOs of each named scale. 'full' is every ISO in input/ceds_isos.csv,
+# which produces files the size of the CMIP6 files (~63,000 rows)
+SCALES = {'tiny'   : 5,
+          'small'  : 25,
+          'medium' : 100,
+          'full'   : None}
+
+# CEDS combustion fuels. Non-combustion sectors only have the 'process' fuel
+COMB_FUELS = ['biomass', 'brown_coal', 'coal_coke', 'diesel_oil', 'hard_coal',
+              'heavy_oil', 'light_oil', 'natural_gas']
+
+# Reference total emissions file read by the default mass-balance corrections
+CORRECTION_FILE = config.DEFAULT_CORRECTIONS['SO2']['file']
+
+INPUT_DIR = os.path.join(os.path.dirname(SRC_DIR), 'input')
+
+
+def get_isos(n_isos=None):
+    """
+    Get the first 'n_isos' CEDS ISOs.
+
+    Parameters
+    -----------
+    n_isos : int, optional
+        Number of ISOs. Default is None, which returns every ISO. If greater
+        than the number of CEDS ISOs, synthetic ISOs are appended.
+
+    Return
+    -------
+    list of str
+    """
+    isos = pd.read_csv(os.path.join(INPUT_DIR, 'ceds_isos.csv'),
+                       encoding='utf-8-sig')['iso'].tolist()
+    if (n_isos is None):
+        return isos
+    if (n_isos > len(isos)):
+        isos += ['x{:03d}'.format(i) for i in range(n_isos - len(isos))]
+    return isos[:n_isos]
+
+
+def get_sectors():
+    """
+    Get the CEDS sectors & whether each is combustion-related.
+
+    Return
+    -------
+    list of tuple of (str, bool)
+    """
+    sector_df = pd.read_csv(os.path.join(INPUT_DIR, 'master_sector.csv'), encoding='utf-8-sig')
+    return list(zip(sector_df['sector'], sector_df['type'] == 'comb'))
+
+
+def make_meta(n_isos=None):
+    """
+    Make the meta columns of a synthetic CEDS file.
+
+    Parameters
+    -----------
+    n_isos : int, optional
+        Number of ISOs. Default is None, i.e. every CEDS ISO.
+
+    Return
+    -------
+    Pandas DataFrame with columns 'iso', 'sector', 'fuel', & 'units'
+    """
+    rows = []
+    sectors = get_sectors()
+    for iso in get_isos(n_isos):
+        for sector, is_comb in sectors:
+            fuels = COMB_FUELS if is_comb else ['process']
+            rows.extend((iso, sector, fuel, 'kt') for fuel in fuels)
+    return pd.DataFrame(rows, columns=['iso', 'sector', 'fuel', 'units'])
+
+
+def make_ceds_frame(meta, year_first, year_last, f_type, rng):
+    """
+    Make a synthetic emissions factors or activity DataFrame.
+
+    Parameters
+    -----------
+    meta : Pandas DataFrame
+        Meta columns, see make_meta()
+    year_first : int
+        First year column
+    year_last : int
+        Last year column
+    f_type : str
+        'ef' for log-normal emissions factors with ~5% zero rows & ~2% outlier
+        rows, 'activity' for uniform activity values
+    rng : numpy.random.Generator
+        Random number generator
+
+    Return
+    -------
+    Pandas DataFrame
+    """
+    years = ['X{}'.format(yr) for yr in range(year_first, year_last + 1)]
+    shape = (meta.shape[0], len(years))
+    if (f_type == 'ef'):
+        vals = rng.lognormal(0, 1, shape)
+        vals[rng.random(shape[0]) < 0.02] *= 100
+        vals[rng.random(shape[0]) < 0.05] = 0
+    elif (f_type == 'activity'):
+        vals = rng.random(shape) * 1000
+    else:
+        raise ValueError('Invalid file type: {}'.format(f_type))
+    return pd.concat([meta, pd.DataFrame(vals, columns=years)], axis=1)
+
+
+def write_cmip6_dir(dir_path, species, n_isos=None, year_first=1750, year_last=2014, seed=0):
+    """
+    Write synthetic CMIP6 emissions factors & activity files for a list of
+    species, and the reference total emissions file of the default
+    mass-balance corrections.
+
+    Parameters
+    -----------
+    dir_path : str
+        Path of the synthetic CMIP6 directory
+    species : list of str
+        Emission species
+    n_isos : int, optional
+        Number of ISOs. Default is None, i.e. every CEDS ISO.
+    year_first : int, optional
+        First year column. Default is 1750
+    year_last : int, optional
+        Last year column. Default is 2014
+    seed : int, optional
+        Random seed. Default is 0
+
+    Return
+    -------
+    int : Number of rows of each file
+    """
+    rng = np.random.default_rng(seed)
+    meta = make_meta(n_isos)
+    os.makedirs(os.path.join(dir_path, os.path.dirname(CORRECTION_FILE)), exist_ok=True)
+    for spec in species:
+        ef_df = make_ceds_frame(meta, year_first, year_last, 'ef', rng)
+        ef_df.to_csv(os.path.join(dir_path, 'H.{}_total_EFs_extended.csv'.format(spec)),
+                     index=False)
+        act_df = make_ceds_frame(meta, year_first, year_last, 'activity', rng)
+        act_df.to_csv(os.path.join(dir_path, 'H.{}_total_activity_extended.csv'.format(spec)),
+                      index=False)
+    ref_df = make_ceds_frame(meta, year_first, year_last, 'activity', rng)
+    ref_df.to_csv(os.path.join(dir_path, CORRECTION_FILE), index=False)
+    return meta.shape[0]
+
+
+def write_config(yaml_path, species, freeze_year=1970, year_first=1750, year_last=2014,
+                 backend='dataframe'):
+    """
+    Write a config YAML file for the synthetic files.
+
+    Parameters
+    -----------
+    yaml_path : str
+        Path of the YAML file
+    species : list of str
+        Emission species
+    freeze_year : int, optional
+        Default is 1970
+    year_first : int, optional
+        Default is 1750
+    year_last : int, optional
+        Default is 2014
+    backend : str, optional
+        EF backend, 'dataframe' or 'array'. Default is 'dataframe'
+
+    Return
+    -------
+    None
+    """
+    with open(yaml_path, 'w') as fh:
+        fh.write('---\n')
+        fh.write('freeze:\n')
+        fh.write('  year: {}\n'.format(freeze_year))
+        fh.write('  isos: all\n')
+        fh.write('  species: [{}]\n'.format(', '.join(species)))
+        fh.write('  backend: {}\n'.format(backend))
+        fh.write('ceds:\n')
+        fh.write('  year_first: {}\n'.format(year_first))
+        fh.write('  year_last: {}\n'.format(year_last))
+        fh.write('cache:\n')
+        fh.write('  enabled: false\n')
+        fh.write('instrument:\n')
+        fh.write('  enabled: false\n')
+        fh.write('diagnostics:\n')
+        fh.write('  policy: \'off\'\n')
+        fh.write('build:\n')
+        fh.write('  incremental: false\n')
+
+
+def init_config(data_dir, yaml_path=None):
+    """
+    Initialize the global CONFIG object for a synthetic data directory written
+    by main(), with every output written under it.
+
+    Parameters
+    -----------
+    data_dir : str
+        Path of the synthetic data directory
+    yaml_path : str, optional
+        Config YAML file. Default is None, i.e. <data_dir>/config.yml
+
+    Return
+    -------
+    config.ConfigObj
+    """
+    if (yaml_path is None):
+        yaml_path = os.path.join(data_dir, 'config.yml')
+    config.CONFIG = config.ConfigObj(yaml_path)
+    config.CONFIG.dirs['root']   = data_dir
+    config.CONFIG.dirs['cmip6']  = os.path.join(data_dir, 'cmip')
+    config.CONFIG.dirs['output'] = os.path.join(data_dir, 'output')
+    for sub_dir in [config.CONFIG.dirs['output'], os.path.join(data_dir, 'src')]:
+        os.makedirs(sub_dir, exist_ok=True)
+    return config.CONFIG
+
+
+def parse_args(argv=None):
+    """
+    Parse command line arguments.
+
+    Return
+    -------
+    argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('data_dir', help='Output directory of the synthetic data')
+    parser.add_argument('--scale', default='small', choices=sorted(SCALES.keys()),
+                        help='Named number of ISOs. Default is small')
+    parser.add_argument('--isos', type=int, default=None,
+                        help='Number of ISOs, overrides --scale')
+    parser.add_argument('--species', default='BC,SO2',
+                        help='Comma-separated emission species. Default is BC,SO2')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. Default is 0')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    n_isos = args.isos if args.isos is not None else SCALES[args.scale]
+    species = args.species.split(',')
+    n_rows = write_cmip6_dir(os.path.join(args.data_dir, 'cmip'), species, n_isos=n_isos,
+                             seed=args.seed)
+    write_config(os.path.join(args.data_dir, 'config.yml'), species)
+    print('Wrote {} rows per file for {} to {}'.format(n_rows, ', '.join(species),
+                                                      args.data_dir))
+
+
+if __name__ == '__main__':
+    main()
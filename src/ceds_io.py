@@ -5,15 +5,678 @@ Matt Nicholson
 7 Feb 2020
 """
 import re
+import contextlib
+import gzip
+import hashlib
 import logging
+import os
+import queue
+import threading
+import numpy as np
 import pandas as pd
 from os.path import isfile, join
 from os import listdir, getcwd
 
 import config
+import instrument
 
 logger = logging.getLogger('main')
 
+# Column header format of the CEDS year columns, i.e. 'X1970'
+YEAR_COL_PATTERN = re.compile(r'^X\d{4}$')
+
+# Columns that uniquely identify a row of a CEDS file
+CEDS_KEY_COLS = ['iso', 'sector', 'fuel']
+
+# Number of rows formatted & written at a time by write_ceds_frame()
+WRITE_BLOCK_ROWS = 5000
+
+# Name patterns of the CEDS files indexed by DirectoryIndex, keyed by kind.
+# Group 1 is the species, group 2 the optional '.gz' extension
+FILE_PATTERNS = {'ef'        : re.compile(r'^H\.(\w{1,7})_total_EFs_extended\.csv(\.gz)?$'),
+                 'activity'  : re.compile(r'^H\.(\w{1,7})_total_activity_extended\.csv(\.gz)?$'),
+                 'emissions' : re.compile(r'^(\w{1,7})_total_CEDS_emissions\.csv(\.gz)?$')}
+
+# Uncompressed file name of each kind of CEDS file
+FILE_NAMES = {'ef'        : 'H.{}_total_EFs_extended.csv',
+              'activity'  : 'H.{}_total_activity_extended.csv',
+              'emissions' : '{}_total_CEDS_emissions.csv'}
+
+# Sub-directory of the CMIP6 directory holding the final emissions files
+EMISSIONS_SUB_DIR = 'final-emissions'
+
+# DirectoryIndex of each indexed directory keyed by absolute path
+_DIR_INDEXES = {}
+
+# CedsIndex of each indexed file keyed by (absolute path, size, mtime_ns)
+_FILE_INDEXES = {}
+
+
+def _get_csv_engine():
+    """
+    Get the fastest pandas CSV parsing engine available. The pyarrow engine
+    requires pyarrow & pandas >= 1.4, otherwise the C engine is used.
+    
+    Returns
+    -------
+    str : 'pyarrow' or 'c'
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        return 'c'
+    pd_version = tuple(int(x) for x in pd.__version__.split('.')[:2])
+    if (pd_version < (1, 4)):
+        return 'c'
+    return 'pyarrow'
+
+
+CSV_ENGINE = _get_csv_engine()
+
+
+def get_year_dtype():
+    """
+    Get the dtype of the CEDS year columns from the global CONFIG object.
+    
+    Returns
+    -------
+    str : 'float64' (default) or 'float32'
+    """
+    if (config.CONFIG is None):
+        return 'float64'
+    return config.CONFIG.ceds_meta.get('dtype', 'float64')
+
+
+def read_ceds_file(abs_path, year_dtype=None, engine=None):
+    """
+    Read a CEDS wide-format csv (EF, activity, or total emissions file) into a
+    Pandas DataFrame using pinned dtypes.
+    
+    Year columns ('X1750', ..., 'X2014') are read as floats and all other
+    columns ('iso', 'sector', 'fuel', 'units') are read as categoricals, so
+    pandas doesn't have to infer the dtype of every column on every load.
+    
+    Parameters
+    -----------
+    abs_path : str
+        Absolute path of the CEDS file
+    year_dtype : str, optional
+        dtype of the year columns, 'float64' or 'float32'. Default is None,
+        in which case the dtype is taken from config.CONFIG.ceds_meta['dtype'],
+        or 'float64' if not given.
+    engine : str, optional
+        pandas CSV parsing engine. Default is None, in which case the pyarrow
+        engine is used if available, otherwise the C engine.
+    
+    Returns
+    -------
+    Pandas DataFrame
+        Column headers: ['iso', 'sector', 'fuel', 'units', 'X1750', 'X1751',
+                         ...,   'X2013', 'X2014']
+    """
+    if (year_dtype is None):
+        year_dtype = get_year_dtype()
+    if (engine is None):
+        engine = CSV_ENGINE
+    # Only the header is needed to construct the dtype mapping
+    columns = pd.read_csv(abs_path, sep=',', header=0, nrows=0).columns
+    dtypes = {col : (year_dtype if YEAR_COL_PATTERN.match(col) else 'category')
+              for col in columns}
+    df = pd.read_csv(abs_path, sep=',', header=0, dtype=dtypes, engine=engine)
+    return df
+
+
+def read_ceds_file_chunks(abs_path, chunksize, year_dtype=None):
+    """
+    Read a CEDS wide-format csv in chunks of rows. The year columns are read as
+    floats, like read_ceds_file(), but the other columns are read as objects
+    since categoricals of different chunks would have different categories.
+    
+    Parameters
+    -----------
+    abs_path : str
+        Absolute path of the CEDS file
+    chunksize : int
+        Number of rows per chunk
+    year_dtype : str, optional
+        dtype of the year columns. Default is None, see read_ceds_file().
+    
+    Returns
+    -------
+    Iterator of Pandas DataFrames. The index of each chunk continues from the
+    previous chunk, so chunk indices match the row indices of the whole file.
+    """
+    if (year_dtype is None):
+        year_dtype = get_year_dtype()
+    columns = pd.read_csv(abs_path, sep=',', header=0, nrows=0).columns
+    dtypes = {col : (year_dtype if YEAR_COL_PATTERN.match(col) else 'object')
+              for col in columns}
+    # The pyarrow engine does not support chunked reads
+    return pd.read_csv(abs_path, sep=',', header=0, dtype=dtypes, engine='c',
+                       chunksize=chunksize)
+
+
+def _get_cache_format():
+    """
+    Get the file format of the columnar input file cache. Feather requires
+    pyarrow, otherwise pickle is used.
+    
+    Returns
+    -------
+    str : 'feather' or 'pkl'
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        return 'pkl'
+    return 'feather'
+
+
+CACHE_FORMAT = _get_cache_format()
+
+
+def get_cache_dir():
+    """
+    Get the directory holding the cached binary copies of the CMIP6 input files.
+    
+    Returns
+    -------
+    str : config.CONFIG.cache['dir'] if given, otherwise <cmip6 dir>/.cache
+    """
+    cache_dir = config.CONFIG.cache['dir']
+    if (cache_dir is None):
+        cache_dir = join(config.CONFIG.dirs['cmip6'], '.cache')
+    return cache_dir
+
+
+def read_ceds_file_cached(abs_path, cache_dir=None, year_dtype=None):
+    """
+    Read a CEDS wide-format csv into a Pandas DataFrame, using a columnar binary
+    (Feather, or pickle if pyarrow is unavailable) copy of the file when a valid
+    one exists.
+    
+    Cached copies are keyed by the csv's path, size, & modification time, as well
+    as the year column dtype. A stale copy is replaced the next time the csv is
+    read. If caching is disabled in the global CONFIG, the csv is always parsed.
+    
+    Parameters
+    -----------
+    abs_path : str
+        Absolute path of the CEDS file
+    cache_dir : str, optional
+        Directory holding the cached copies. Default is None, in which case
+        get_cache_dir() is used.
+    year_dtype : str, optional
+        dtype of the year columns. Default is None, see read_ceds_file().
+    
+    Returns
+    -------
+    Pandas DataFrame
+    """
+    if (year_dtype is None):
+        year_dtype = get_year_dtype()
+    if (not config.CONFIG.cache['enabled']):
+        return read_ceds_file(abs_path, year_dtype=year_dtype)
+    if (cache_dir is None):
+        cache_dir = get_cache_dir()
+    
+    abs_path = os.path.abspath(abs_path)
+    f_stat = os.stat(abs_path)
+    path_key = hashlib.sha1(abs_path.encode('utf-8')).hexdigest()[:8]
+    state_str = '{}|{}|{}'.format(f_stat.st_size, f_stat.st_mtime_ns, year_dtype)
+    state_key = hashlib.sha1(state_str.encode('utf-8')).hexdigest()[:8]
+    cache_prefix = '{}.{}.'.format(os.path.basename(abs_path), path_key)
+    cache_path = join(cache_dir, '{}{}.{}'.format(cache_prefix, state_key, CACHE_FORMAT))
+    
+    if (isfile(cache_path)):
+        logger.debug('Reading cached copy of {} from {}'.format(abs_path, cache_path))
+        try:
+            if (CACHE_FORMAT == 'feather'):
+                return pd.read_feather(cache_path)
+            return pd.read_pickle(cache_path)
+        except Exception as err:
+            logger.warning('Unable to read cache file {}: {}'.format(cache_path, err))
+    
+    df = read_ceds_file(abs_path, year_dtype=year_dtype)
+    
+    if (not os.path.isdir(cache_dir)):
+        logger.debug('Creating cache directory {}'.format(cache_dir))
+        os.makedirs(cache_dir, exist_ok=True)
+    # Remove stale copies of the file
+    for f_name in listdir(cache_dir):
+        if (f_name.startswith(cache_prefix) and join(cache_dir, f_name) != cache_path):
+            logger.debug('Removing stale cache file {}'.format(f_name))
+            try:
+                os.remove(join(cache_dir, f_name))
+            except OSError:
+                pass
+    # Write to a temporary file first so concurrent readers never see a partial file
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    logger.debug('Writing cached copy of {} to {}'.format(abs_path, cache_path))
+    if (CACHE_FORMAT == 'feather'):
+        df.to_feather(tmp_path)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_path)
+    return df
+
+
+def get_output_options():
+    """
+    Get the output file options from the global CONFIG object.
+    
+    Returns
+    -------
+    dict with keys 'precision', 'compression', & 'max_pending'
+    """
+    if (config.CONFIG is None):
+        return {'precision' : None, 'compression' : None, 'max_pending' : 0}
+    return config.CONFIG.output
+
+
+def get_output_path(abs_path):
+    """
+    Get the path an output file is written to, which has a '.gz' extension if
+    output compression is enabled.
+    
+    Parameters
+    -----------
+    abs_path : str
+        Path of the uncompressed output file
+    
+    Returns
+    -------
+    str
+    """
+    if (get_output_options()['compression'] == 'gzip'):
+        return abs_path + '.gz'
+    return abs_path
+
+
+def open_output(abs_path):
+    """
+    Open an output file for writing, gzip-compressed if its path ends in '.gz'.
+    
+    Parameters
+    -----------
+    abs_path : str
+        Path of the output file, see get_output_path()
+    
+    Returns
+    -------
+    Writable text file object
+    """
+    if (abs_path.endswith('.gz')):
+        # Level 6 compresses nearly as well as the default of 9 in a fraction of the time
+        return gzip.open(abs_path, 'wt', newline='', compresslevel=6)
+    return open(abs_path, 'w', newline='')
+
+
+def _quote_csv(value):
+    """
+    Format a non-numeric value for a csv the same way DataFrame.to_csv() does,
+    i.e., missing values are empty & values containing a separator, quote, or
+    line break are quoted.
+    """
+    if (value is None or (isinstance(value, float) and value != value)):
+        return ''
+    value = str(value)
+    if (any(char in value for char in ',"\r\n')):
+        return '"{}"'.format(value.replace('"', '""'))
+    return value
+
+
+def _format_float_block(vals, precision=None):
+    """
+    Format a 2-D float array as lists of strings, one list per row.
+    
+    Without a precision, float64 values are formatted with repr() & float32 values
+    with their NumPy str(), which is what DataFrame.to_csv() writes. NaN values are
+    empty strings.
+    """
+    if (precision is None and vals.dtype == np.float64):
+        fmt = float.__repr__
+    elif (precision is None):
+        str_vals = vals.astype(str)
+        str_vals[np.isnan(vals)] = ''
+        return str_vals.tolist()
+    else:
+        fmt = '%.{}g'.format(precision).__mod__
+    nan_rows = np.isnan(vals).any(axis=1).tolist()
+    rows = []
+    for row, has_nan in zip(vals.tolist(), nan_rows):
+        if (has_nan):
+            rows.append(['' if val != val else fmt(val) for val in row])
+        else:
+            rows.append(list(map(fmt, row)))
+    return rows
+
+
+def write_ceds_frame(df, fh, header=True, precision=None, block_rows=None):
+    """
+    Write a CEDS DataFrame to an open csv file.
+    
+    The leading non-float columns ('iso', 'sector', 'fuel', 'units') are formatted
+    per unique value, the remaining float columns in blocks of rows, and each
+    block is written with a single call. The output is identical to that of
+    DataFrame.to_csv(fh, index=False) unless a precision is given. DataFrames
+    with non-float columns after the leading ones are written with to_csv().
+    
+    Parameters
+    -----------
+    df : Pandas DataFrame
+        CEDS DataFrame to write
+    fh : file object
+        Writable text file object, see open_output()
+    header : bool, optional
+        Whether or not to write the column headers. Default is True
+    precision : int, optional
+        Number of significant digits of the float columns. Default is None,
+        in which case floats are written at full precision
+    block_rows : int, optional
+        Number of rows per block. Default is None, in which case WRITE_BLOCK_ROWS
+        is used
+    
+    Returns
+    -------
+    None
+    """
+    if (block_rows is None):
+        block_rows = WRITE_BLOCK_ROWS
+    is_float = [pd.api.types.is_float_dtype(dtype) for dtype in df.dtypes]
+    n_meta = is_float.index(True) if True in is_float else len(is_float)
+    if (not all(is_float[n_meta:])):
+        if (precision is None):
+            df.to_csv(fh, sep=',', header=header, index=False)
+        else:
+            df.to_csv(fh, sep=',', header=header, index=False,
+                      float_format='%.{}g'.format(precision))
+        return
+    
+    if (header):
+        fh.write(','.join(_quote_csv(col) for col in df.columns) + '\n')
+    meta_strs = []
+    for col in df.columns[:n_meta]:
+        values = df[col].to_numpy(dtype=object)
+        formatted = {val : _quote_csv(val) for val in pd.unique(values)}
+        meta_strs.append([formatted[val] for val in values])
+    meta_rows = [','.join(row) for row in zip(*meta_strs)] if n_meta else None
+    vals = df.iloc[:, n_meta:].to_numpy()
+    
+    for start in range(0, len(df), block_rows):
+        stop = min(start + block_rows, len(df))
+        val_rows = _format_float_block(vals[start:stop], precision=precision)
+        if (meta_rows is None):
+            lines = [','.join(row) for row in val_rows]
+        elif (vals.shape[1] == 0):
+            lines = meta_rows[start:stop]
+        else:
+            lines = [meta + ',' + ','.join(row) for meta, row in zip(meta_rows[start:stop], val_rows)]
+        fh.write('\n'.join(lines) + '\n')
+
+
+def write_ceds_file(df, abs_path, precision=None, compression=None, fsync=False):
+    """
+    Write a CEDS DataFrame to a csv file using write_ceds_frame().
+    
+    Parameters
+    -----------
+    df : Pandas DataFrame
+        CEDS DataFrame to write
+    abs_path : str
+        Path of the uncompressed output file. '.gz' is appended if the output
+        is compressed
+    precision : int, optional
+        Number of significant digits of the float columns. Default is None, in
+        which case config.CONFIG.output['precision'] is used
+    compression : str, optional
+        'gzip' or None. Default is None, in which case
+        config.CONFIG.output['compression'] is used
+    fsync : bool, optional
+        Whether or not to flush the file to disk before returning. Default is False
+    
+    Returns
+    -------
+    str : Path of the written file
+    """
+    options = get_output_options()
+    if (precision is None):
+        precision = options['precision']
+    if (compression is None):
+        compression = options['compression']
+    if (compression == 'gzip' and not abs_path.endswith('.gz')):
+        abs_path = abs_path + '.gz'
+    with open_output(abs_path) as fh:
+        write_ceds_frame(df, fh, header=True, precision=precision)
+    if (fsync):
+        fd = os.open(abs_path, os.O_RDWR)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    remove_stale_copy(abs_path)
+    index_file(abs_path)
+    return abs_path
+
+
+def remove_stale_copy(abs_path):
+    """
+    Remove the copy of a newly-written output file in the other format, i.e.
+    the uncompressed file of a '.gz' file & vice versa. Such a copy is left by
+    a previous run with different output compression, & would otherwise be
+    mistaken for the current file.
+    
+    Parameters
+    -----------
+    abs_path : str
+        Path of the written file
+    
+    Returns
+    -------
+    None
+    """
+    stale_path = abs_path[:-3] if abs_path.endswith('.gz') else abs_path + '.gz'
+    if (os.path.isfile(stale_path)):
+        logger.debug('Removing stale copy {}'.format(stale_path))
+        os.remove(stale_path)
+        unindex_file(stale_path)
+
+
+class BackgroundWriter:
+    """
+    Write CEDS DataFrames in a background thread, so that the next species can
+    be read & processed while the previous one is written.
+    
+    Writes & callbacks are run in the order they are submitted. The queue is
+    bounded, so submit() blocks while 'max_pending' frames are waiting to be
+    written, which caps the memory held by pending frames.
+    """
+    
+    def __init__(self, max_pending=2, fsync=True):
+        """
+        Parameters
+        -----------
+        max_pending : int, optional
+            Maximum number of queued writes & callbacks. Default is 2
+        fsync : bool, optional
+            Whether or not to flush each file to disk once written. Default is True
+        """
+        self.queue   = queue.Queue(maxsize=max_pending)
+        self.fsync   = fsync
+        self.written = []
+        self.failed  = []
+        self.thread  = threading.Thread(target=self._run, name='ceds-writer', daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        """
+        Write queued DataFrames & run queued callbacks until None is dequeued.
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if (item is None):
+                    return
+                if (item[0] == 'write'):
+                    _, df, abs_path, label, stage = item
+                    try:
+                        with instrument.stage(stage, label):
+                            write_ceds_file(df, abs_path, fsync=self.fsync)
+                        self.written.append(abs_path)
+                    except Exception as err:
+                        logger.error('Writing {} failed: {}'.format(abs_path, err))
+                        self.failed.append((label, abs_path, err))
+                else:
+                    _, callback, paths = item
+                    failed_paths = [f[1] for f in self.failed]
+                    if (not any(f_path in failed_paths for f_path in paths)):
+                        try:
+                            callback()
+                        except Exception as err:
+                            logger.error('Post-write callback failed: {}'.format(err))
+            finally:
+                self.queue.task_done()
+    
+    def submit(self, df, abs_path, label=None, stage='write'):
+        """
+        Queue a DataFrame to be written with write_ceds_file(). The DataFrame
+        must not be modified afterwards.
+        
+        Params
+        -------
+        df : Pandas DataFrame
+            CEDS DataFrame to write
+        abs_path : str
+            Path of the output file, see get_output_path()
+        label : str, optional
+            Label of the write, i.e. its species, used to report failures
+        stage : str, optional
+            Instrument stage name of the write. Default is 'write'
+        """
+        self.queue.put(('write', df, abs_path, label, stage))
+    
+    def after_writes(self, callback, paths):
+        """
+        Queue a callback that runs once all previously submitted writes are done,
+        unless writing any of the given paths failed.
+        
+        Params
+        -------
+        callback : callable
+            Function taking no arguments
+        paths : list of str
+            Paths the callback depends on
+        """
+        self.queue.put(('callback', callback, list(paths)))
+    
+    def flush(self):
+        """
+        Block until every queued write & callback is done.
+        
+        Return
+        -------
+        list of (label, path, exception) tuples of the failed writes
+        """
+        self.queue.join()
+        return self.failed
+    
+    def close(self):
+        """
+        Flush the queue & stop the background thread.
+        """
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+    
+    def __repr__(self):
+        return "<BackgroundWriter object {} pending>".format(self.queue.qsize())
+
+
+# BackgroundWriter of the active background_writes() context, if any
+_WRITER = None
+
+
+@contextlib.contextmanager
+def background_writes(max_pending=None):
+    """
+    Context manager within which submit_write() hands DataFrames to a
+    BackgroundWriter. On exit, all pending writes are flushed to disk.
+    
+    Parameters
+    -----------
+    max_pending : int, optional
+        Maximum number of queued writes. Default is None, in which case
+        config.CONFIG.output['max_pending'] is used. If 0, writes are synchronous
+    
+    Yields
+    ------
+    BackgroundWriter, or None if writes are synchronous
+    """
+    global _WRITER
+    if (max_pending is None):
+        max_pending = get_output_options().get('max_pending', 0)
+    if (not max_pending or _WRITER is not None):
+        # Nested contexts share the outer writer
+        yield _WRITER
+        return
+    _WRITER = BackgroundWriter(max_pending=max_pending)
+    try:
+        yield _WRITER
+    finally:
+        writer, _WRITER = _WRITER, None
+        writer.close()
+
+
+def submit_write(df, abs_path, label=None, stage='write'):
+    """
+    Write a CEDS DataFrame in the background if within a background_writes()
+    context, otherwise write it immediately.
+    
+    Parameters
+    -----------
+    df : Pandas DataFrame
+        CEDS DataFrame to write. It must not be modified afterwards
+    abs_path : str
+        Path of the output file, see get_output_path()
+    label : str, optional
+        Label of the write, i.e. its species, used to report failures
+    stage : str, optional
+        Instrument stage name of the write. Default is 'write'
+    
+    Returns
+    -------
+    None
+    """
+    if (_WRITER is None):
+        with instrument.stage(stage, label):
+            write_ceds_file(df, abs_path)
+    else:
+        _WRITER.submit(df, abs_path, label=label, stage=stage)
+
+
+def after_writes(callback, paths):
+    """
+    Run a callback once the given output files are written, see
+    BackgroundWriter.after_writes(). Without a background writer the files are
+    already written, so the callback is run immediately.
+    
+    Parameters
+    -----------
+    callback : callable
+        Function taking no arguments
+    paths : list of str
+        Paths the callback depends on
+    
+    Returns
+    -------
+    None
+    """
+    if (_WRITER is None):
+        callback()
+    else:
+        _WRITER.after_writes(callback, paths)
+
+
 def read_ef_file(abs_path):
     """
     Read the Emission Factor csv into a Pandas DataFrame
@@ -31,11 +694,259 @@ def read_ef_file(abs_path):
         Column headers: ['iso', 'sector', 'fuel', 'units', 'X1750', 'X1751',
                          ...,   'X2013', 'X2014']
     """
-    ef_df = pd.read_csv(abs_path, sep=',', header=0)
+    ef_df = read_ceds_file(abs_path)
     
     return ef_df
 
 
+class DirectoryIndex:
+    """
+    Index of the CEDS files of a single directory, i.e. input/cmip or output,
+    built from a single scan of the directory & its 'final-emissions'
+    sub-directory. Each file is classified by species & kind ('ef',
+    'activity', or 'emissions') with precompiled patterns, so lookups do not
+    touch the file system.
+    """
+    
+    def __init__(self, dir_path):
+        """
+        Parameters
+        -----------
+        dir_path : str
+            Path of the directory to index
+        
+        Attributes
+        -----------
+        dir_path : str
+            Absolute path of the indexed directory
+        files : dict of {(str, str) : str}
+            Absolute file path keyed by (species, kind). If both an uncompressed
+            & a '.gz' copy exist, the one matching the output compression takes
+            precedence
+        names : list of tuple of (str, str, str)
+            (file name, species, kind) of every indexed file, in scan order
+        """
+        self.dir_path = os.path.abspath(dir_path)
+        self.files = {}
+        self.names = []
+        self._name_set = set()
+        self.scan()
+    
+    def scan(self):
+        """
+        (Re-)scan the directory & its 'final-emissions' sub-directory.
+        
+        Returns
+        -------
+        None
+        """
+        self.files = {}
+        self.names = []
+        self._name_set = set()
+        for sub_dir in ['', EMISSIONS_SUB_DIR]:
+            scan_path = join(self.dir_path, sub_dir) if sub_dir else self.dir_path
+            try:
+                entries = list(os.scandir(scan_path))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if (entry.is_file()):
+                    self.add(entry.path)
+        logger.debug('Indexed {} CEDS files in {}'.format(len(self.names), self.dir_path))
+    
+    def add(self, abs_path):
+        """
+        Add a file to the index, i.e. one written after the directory was scanned.
+        Files whose names do not match a FILE_PATTERNS pattern are ignored.
+        
+        Parameters
+        -----------
+        abs_path : str
+            Path of the file
+        
+        Returns
+        -------
+        bool : Whether or not the file was indexed
+        """
+        f_name = os.path.basename(abs_path)
+        for kind, pattern in FILE_PATTERNS.items():
+            match = pattern.match(f_name)
+            if (match):
+                break
+        else:
+            return False
+        species = match.group(1)
+        key = (species, kind)
+        if ((f_name, species, kind) not in self._name_set):
+            self._name_set.add((f_name, species, kind))
+            self.names.append((f_name, species, kind))
+        # If a file has both an uncompressed & a '.gz' copy, the copy matching
+        # the output compression takes precedence, as it is the one written last
+        prefer_gz = get_output_options()['compression'] == 'gzip'
+        if (key not in self.files or bool(match.group(2)) == prefer_gz or
+                self.files[key] == os.path.abspath(abs_path)):
+            self.files[key] = os.path.abspath(abs_path)
+        return True
+    
+    def discard(self, abs_path):
+        """
+        Remove a file from the index, i.e. one deleted after the directory was
+        scanned. If the file was the indexed copy of its species & kind, its
+        other indexed copy (if any) takes its place.
+        
+        Parameters
+        -----------
+        abs_path : str
+            Path of the file
+        
+        Returns
+        -------
+        None
+        """
+        abs_path = os.path.abspath(abs_path)
+        f_name = os.path.basename(abs_path)
+        removed = [name for name in self.names if name[0] == f_name]
+        if (not removed):
+            return
+        self.names = [name for name in self.names if name[0] != f_name]
+        self._name_set.difference_update(removed)
+        for _, species, kind in removed:
+            key = (species, kind)
+            if (self.files.get(key, None) != abs_path):
+                continue
+            del self.files[key]
+            other_path = abs_path[:-3] if abs_path.endswith('.gz') else abs_path + '.gz'
+            if (os.path.basename(other_path) in (name[0] for name in self.names)):
+                self.files[key] = other_path
+    
+    def get(self, species, kind):
+        """
+        Get the path of a species' file.
+        
+        Parameters
+        -----------
+        species : str
+            Emission species
+        kind : str
+            'ef', 'activity', or 'emissions'
+        
+        Returns
+        -------
+        str : Absolute path of the file
+        
+        Raises
+        -------
+        FileNotFoundError if the species has no such file
+        """
+        try:
+            return self.files[(species, kind)]
+        except KeyError:
+            raise FileNotFoundError("No such file or directory: {}".format(
+                join(self.dir_path, FILE_NAMES[kind].format(species))))
+    
+    def get_species(self, kind='ef'):
+        """
+        Get the species that have a file of a given kind, in scan order.
+        
+        Parameters
+        -----------
+        kind : str, optional
+            Default is 'ef'
+        
+        Returns
+        -------
+        list of str
+        """
+        species = []
+        for _, spec, f_kind in self.names:
+            if (f_kind == kind and spec not in species):
+                species.append(spec)
+        return species
+    
+    def __repr__(self):
+        return "<DirectoryIndex object {}: {} files>".format(self.dir_path, len(self.names))
+
+
+def get_dir_index(dir_path, refresh=False):
+    """
+    Get the DirectoryIndex of a directory, scanning it only on first use.
+    
+    Parameters
+    ----------
+    dir_path : str
+        Path of the directory
+    refresh : bool, optional
+        Whether or not to re-scan the directory. Default is False
+    
+    Returns
+    -------
+    DirectoryIndex
+    """
+    abs_path = os.path.abspath(dir_path)
+    if (abs_path not in _DIR_INDEXES):
+        _DIR_INDEXES[abs_path] = DirectoryIndex(abs_path)
+    elif (refresh):
+        _DIR_INDEXES[abs_path].scan()
+    return _DIR_INDEXES[abs_path]
+
+
+def _get_index_dir(abs_path):
+    """
+    Get the indexed directory a file belongs to, i.e. its parent directory, or
+    the parent of its 'final-emissions' sub-directory.
+    """
+    dir_path = os.path.dirname(os.path.abspath(abs_path))
+    if (os.path.basename(dir_path) == EMISSIONS_SUB_DIR):
+        dir_path = os.path.dirname(dir_path)
+    return dir_path
+
+
+def index_file(abs_path):
+    """
+    Add a newly-written file to the index of its directory, if the directory
+    has been indexed.
+    
+    Parameters
+    ----------
+    abs_path : str
+        Path of the file
+    
+    Returns
+    -------
+    None
+    """
+    dir_index = _DIR_INDEXES.get(_get_index_dir(abs_path), None)
+    if (dir_index is not None):
+        dir_index.add(abs_path)
+
+
+def unindex_file(abs_path):
+    """
+    Remove a deleted file from the index of its directory, if the directory
+    has been indexed.
+    
+    Parameters
+    ----------
+    abs_path : str
+        Path of the file
+    
+    Returns
+    -------
+    None
+    """
+    dir_index = _DIR_INDEXES.get(_get_index_dir(abs_path), None)
+    if (dir_index is not None):
+        dir_index.discard(abs_path)
+
+
+def clear_dir_indexes():
+    """
+    Remove every directory index, so that directories are re-scanned on
+    their next lookup.
+    """
+    _DIR_INDEXES.clear()
+
+
 def fetch_ef_files(dir_path):
     """
     Get the names of all emission factor files in a given directory
@@ -50,10 +961,9 @@ def fetch_ef_files(dir_path):
     f_names : list of str
         Names of the emission factor files found within the specified directory
     """
-    patterns = {"base" : r'(^H\.(\w{1,7})_total_EFs_extended.csv$)'}   
-    re_pat = patterns["base"]
-    f_names = [f for f in listdir(dir_path) if (isfile(join(dir_path, f)) and re.match(re_pat, f))
-               and re.match(re_pat, f).group(2) in config.CONFIG.freeze_species]
+    dir_index = get_dir_index(dir_path)
+    f_names = [f for f, species, kind in dir_index.names if (kind == 'ef' and
+               not f.endswith('.gz') and species in config.CONFIG.freeze_species)]
     return f_names
 
 
@@ -71,9 +981,9 @@ def fetch_activity_files(dir_path):
     f_names : list of str
         Names of the activity files found within the specified directory
     """
-    patterns = {"base" : r'(^H\.\w{1,7}_total_activity_extended.csv$)'}          
-    re_pat = patterns["base"]
-    f_names = [f for f in listdir(dir_path) if (isfile(join(dir_path, f)) and re.match(re_pat, f))]
+    dir_index = get_dir_index(dir_path)
+    f_names = [f for f, _, kind in dir_index.names if (kind == 'activity' and
+               not f.endswith('.gz'))]
     return f_names
 
 
@@ -82,6 +992,9 @@ def get_file_for_species(dir_path, species, f_type):
     Get an output file (i.e., EF, total activity, etc.) for a given species
     of emission
     
+    The directory is scanned once & indexed, see DirectoryIndex. If the file
+    is not in the index, the directory is re-scanned once before giving up.
+    
     Parameters
     ----------
     dir_path : str
@@ -89,27 +1002,22 @@ def get_file_for_species(dir_path, species, f_type):
     species : str
         Emissions species
     f_type : str
-        Type of file (EF, total activity, etc.)
+        Type of file: 'ef', 'activity', or 'emissions'
         
     Returns
     -------
     f_name : str
-        Name of the file found in the directory
+        Absolute path of the file. If both an uncompressed & a compressed copy
+        exist, the one matching the output compression is returned
     """
-    bases = {
-            "ef" : "H.{}_total_EFs_extended.csv",
-            "activity": "H.{}_total_activity_extended.csv"
-            }
-            
-    f_name = bases[f_type].format(species)
-    f_abs = join(dir_path, f_name)
-    
-    logger.debug("Searching for file '{}'".format(f_abs))
-    
-    if (not isfile(f_abs)):
-        raise FileNotFoundError("No such file or directory: {}".format(f_abs))
-    else:
-        return f_abs
+    dir_index = get_dir_index(dir_path)
+    try:
+        f_abs = dir_index.get(species, f_type)
+    except FileNotFoundError:
+        # The file may have been created since the directory was indexed
+        f_abs = get_dir_index(dir_path, refresh=True).get(species, f_type)
+    logger.debug("Found file '{}'".format(f_abs))
+    return f_abs
     
 
 def get_avail_species(dir_path):
@@ -126,9 +1034,7 @@ def get_avail_species(dir_path):
     species : list of str
         List containing the emission species found in the directory
     """
-    pattern = r'^H\.(\w{1,7})_total_EFs_extended.csv$'
-    species = [re.match(pattern, f).group(1) for f in listdir(dir_path) if (re.match(pattern, f))]
-    return species
+    return get_dir_index(dir_path).get_species('ef')
 
 
 def get_species_from_fname(f_name):
@@ -141,17 +1047,7 @@ def get_species_from_fname(f_name):
 
 
 def get_species(dir_path):
-    species = []
-    pattern = r'^H\.(\w{1,7})_total_EFs_extended.csv$'
-    
-    for f in listdir(dir_path):
-        match = re.match(pattern, f)
-        if (match):
-            species.append(match.group(1))
-    # Remove duplicate species
-    species_set = set(species)
-    species = list(species_set)
-    return species
+    return get_dir_index(dir_path).get_species('ef')
 
 
 def subset_iso(df, iso):
@@ -295,6 +1191,349 @@ def subset_yr_span(df, yr, yr_rng=5):
     return sub_df
     
 
+class CedsIndex:
+    """
+    Index of the (iso, sector, fuel) rows of a CEDS DataFrame for repeated
+    lookups without scanning the frame.
+    
+    Each key column is factorized once into sorted integer codes, which are
+    combined into a single lexicographic row key & sorted. A query on a
+    leading run of the key columns (iso; iso & sector; or iso, sector, & fuel)
+    is a binary search of the sorted keys, and a query that doesn't specify
+    the iso starts from a per-column group-offset table. Any remaining key
+    columns only filter the matched rows. When the matched rows are
+    contiguous in the frame, as they are for sorted CEDS files, the result is
+    a positional slice of the frame.
+    
+    The index is not updated if the frame's key columns are modified.
+    """
+    
+    def __init__(self, df, keys=None):
+        """
+        Parameters
+        -----------
+        df : Pandas DataFrame
+            CEDS DataFrame
+        keys : list of str, optional
+            Key columns, in the order of the hierarchy. Default is None, in
+            which case CEDS_KEY_COLS is used.
+        
+        Attributes
+        -----------
+        df : Pandas DataFrame
+            The indexed DataFrame
+        keys : list of str
+            Key columns
+        levels : dict of {str : Pandas Index}
+            Sorted unique values of each key column
+        codes : dict of {str : NumPy array of int}
+            Code of each row's value of each key column. 0 is a missing value
+            and code i > 0 is levels[key][i - 1]
+        order : NumPy array of int
+            Row positions sorted by (iso, sector, fuel)
+        sorted_keys : NumPy array of int
+            Combined key of each row of 'order'
+        """
+        if (keys is None):
+            keys = CEDS_KEY_COLS
+        self.df = df
+        self.keys = list(keys)
+        self.levels = {}
+        self.codes = {}
+        self._level_codes = {}
+        self._sizes = []
+        row_keys = np.zeros(df.shape[0], dtype=np.int64)
+        for key in self.keys:
+            codes, uniques = pd.factorize(df[key], sort=True)
+            self.levels[key] = pd.Index(np.asarray(uniques))
+            self.codes[key] = codes.astype(np.int64) + 1
+            self._level_codes[key] = {value : code for code, value in enumerate(uniques, 1)}
+            self._sizes.append(len(uniques) + 1)
+            row_keys = row_keys * self._sizes[-1] + self.codes[key]
+        self.order = np.argsort(row_keys, kind='stable')
+        self.sorted_keys = row_keys[self.order]
+        self._groups = {}
+        self._col_pos = {col : pos for pos, col in enumerate(df.columns)}
+        self.meta_cols = [col for col in df.columns if not YEAR_COL_PATTERN.match(col)]
+    
+    def __len__(self):
+        return self.df.shape[0]
+    
+    def __repr__(self):
+        return "<CedsIndex object: {} rows, {}>".format(
+            len(self), ', '.join('{} {}'.format(len(self.levels[key]), key) for key in self.keys))
+    
+    def _get_codes(self, key, values):
+        """
+        Get the codes of a key column's values. Values that aren't present in
+        the column are ignored.
+        
+        Returns
+        -------
+        NumPy array of int
+        """
+        if (isinstance(values, str) or not np.iterable(values)):
+            values = [values]
+        level_codes = self._level_codes[key]
+        return np.array([level_codes[value] for value in values if value in level_codes],
+                        dtype=np.int64)
+    
+    def _get_group(self, key, code):
+        """
+        Get the positions of the rows with a given code of a key column, from
+        the column's group-offset table. The table is built on first use.
+        
+        Returns
+        -------
+        NumPy array of int
+        """
+        if (key not in self._groups):
+            order = np.argsort(self.codes[key], kind='stable')
+            counts = np.bincount(self.codes[key], minlength=len(self.levels[key]) + 1)
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            self._groups[key] = (order, offsets)
+        order, offsets = self._groups[key]
+        return order[offsets[code]:offsets[code + 1]]
+    
+    def _get_prefix_rows(self, prefix_codes):
+        """
+        Get the positions of the rows matching codes of the leading key
+        columns with a binary search of the sorted row keys.
+        
+        Parameters
+        -----------
+        prefix_codes : list of NumPy array of int
+            Codes of each of the first len(prefix_codes) key columns
+        
+        Returns
+        -------
+        NumPy array of int
+        """
+        combos = np.zeros(1, dtype=np.int64)
+        for size, codes in zip(self._sizes, prefix_codes):
+            combos = (combos[:, np.newaxis] * size + codes[np.newaxis, :]).ravel()
+        stride = int(np.prod(self._sizes[len(prefix_codes):], dtype=np.int64))
+        starts = np.searchsorted(self.sorted_keys, combos * stride, side='left')
+        stops = np.searchsorted(self.sorted_keys, (combos + 1) * stride, side='left')
+        return np.concatenate([self.order[start:stop] for start, stop in zip(starts, stops)] +
+                              [np.zeros(0, dtype=np.int64)])
+    
+    def locate(self, **kwargs):
+        """
+        Get the positions of the rows matching values of the key columns.
+        
+        Parameters
+        -----------
+        **kwargs : str or list of str
+            Value(s) of key columns, i.e. iso='usa' or fuel=['hard_coal',
+            'brown_coal']. Key columns that aren't given match every row.
+        
+        Returns
+        -------
+        NumPy array of int : Row positions, in frame order
+        
+        Raises
+        -------
+        KeyError if a keyword isn't a key column
+        """
+        unknown = [key for key in kwargs if key not in self.codes]
+        if (unknown):
+            raise KeyError('Not key columns of the CedsIndex: {}'.format(unknown))
+        query_codes = {key : self._get_codes(key, values) for key, values in kwargs.items()
+                       if values is not None}
+        prefix_codes = []
+        for key in self.keys:
+            if (key not in query_codes):
+                break
+            prefix_codes.append(query_codes.pop(key))
+        if (prefix_codes):
+            rows = self._get_prefix_rows(prefix_codes)
+        elif (query_codes):
+            # Start from the group table of the column with the fewest matching rows
+            group_rows = {key : np.concatenate([self._get_group(key, code) for code in codes] +
+                                               [np.zeros(0, dtype=np.int64)])
+                          for key, codes in query_codes.items()}
+            key = min(group_rows, key=lambda key: group_rows[key].size)
+            rows = group_rows[key]
+            del query_codes[key]
+        else:
+            rows = np.arange(len(self), dtype=np.int64)
+        for key, codes in query_codes.items():
+            rows = rows[np.isin(self.codes[key][rows], codes)]
+        return np.sort(rows)
+    
+    def get_year_cols(self, years):
+        """
+        Get the names of the year columns of a list of years.
+        
+        Parameters
+        -----------
+        years : int or list of int
+        
+        Returns
+        -------
+        list of str
+        
+        Raises
+        -------
+        KeyError if a year has no column in the frame
+        """
+        if (not np.iterable(years) or isinstance(years, str)):
+            years = [years]
+        year_cols = ['X{}'.format(yr) for yr in years]
+        missing = [col for col in year_cols if col not in self._col_pos]
+        if (missing):
+            raise KeyError('Year columns not in the DataFrame: {}'.format(missing))
+        return year_cols
+    
+    def query(self, iso=None, sector=None, fuel=None, years=None):
+        """
+        Get the rows of the frame matching an iso, sector, & fuel.
+        
+        Parameters
+        -----------
+        iso : str or list of str, optional
+        sector : str or list of str, optional
+        fuel : str or list of str, optional
+            Value(s) of each key column. Default is None, which matches every row
+        years : int or list of int, optional
+            Year columns to return, after the non-year columns. Default is None,
+            i.e. every column
+        
+        Returns
+        -------
+        Pandas DataFrame : Matched rows, in frame order. Not guaranteed to be a
+        copy; use .copy() before modifying it.
+        """
+        rows = self.locate(iso=iso, sector=sector, fuel=fuel)
+        if (years is None):
+            cols = slice(None)
+        else:
+            cols = [self._col_pos[col] for col in self.meta_cols + self.get_year_cols(years)]
+            cols = _as_slice(np.array(cols, dtype=np.int64))
+        return self.df.iloc[_as_slice(rows), cols]
+
+
+def _as_slice(positions):
+    """
+    Convert an array of sorted positions to a slice if they are contiguous,
+    so that selecting them with .iloc doesn't copy.
+    
+    Returns
+    -------
+    slice or NumPy array of int
+    """
+    if (positions.size and positions[-1] - positions[0] + 1 == positions.size):
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+
+def get_file_index(abs_path):
+    """
+    Get the CedsIndex of a CEDS file, reading & indexing the file only once
+    per process unless it changes.
+    
+    Parameters
+    ----------
+    abs_path : str
+        Path of the CEDS file
+    
+    Returns
+    -------
+    CedsIndex
+    """
+    f_stat = os.stat(abs_path)
+    key = (os.path.abspath(abs_path), f_stat.st_size, f_stat.st_mtime_ns)
+    if (key not in _FILE_INDEXES):
+        logger.debug('Indexing {}'.format(abs_path))
+        if (config.CONFIG is None):
+            ceds_df = read_ceds_file(abs_path)
+        else:
+            ceds_df = read_ceds_file_cached(abs_path)
+        _FILE_INDEXES[key] = CedsIndex(ceds_df)
+    return _FILE_INDEXES[key]
+
+
+def query(source, iso=None, sector=None, fuel=None, years=None):
+    """
+    Get the rows of a CEDS file or DataFrame matching an iso, sector, & fuel
+    using a CedsIndex. Files are indexed once per process; for repeated
+    queries of a DataFrame, build a CedsIndex of it & use CedsIndex.query().
+    
+    Parameters
+    ----------
+    source : str, Pandas DataFrame, or CedsIndex
+        Path of a CEDS file, a CEDS DataFrame, or an index of one
+    iso : str or list of str, optional
+    sector : str or list of str, optional
+    fuel : str or list of str, optional
+        Value(s) of each key column. Default is None, which matches every row
+    years : int or list of int, optional
+        Year columns to return, after the non-year columns. Default is None,
+        i.e. every column
+    
+    Returns
+    -------
+    Pandas DataFrame
+    """
+    if (isinstance(source, str)):
+        source = get_file_index(source)
+    elif (isinstance(source, pd.DataFrame)):
+        source = CedsIndex(source)
+    return source.query(iso=iso, sector=sector, fuel=fuel, years=years)
+
+
+def clear_file_indexes():
+    """
+    Remove every memoized file index.
+    """
+    _FILE_INDEXES.clear()
+    
+
+def align_ceds_frames(left, right, keys=None):
+    """
+    Match the rows of two CEDS DataFrames by their (iso, sector, fuel) keys
+    using a hashed index of each frame, rather than by position.
+    
+    Parameters
+    ----------
+    left : Pandas DataFrame
+        CEDS DataFrame, i.e. frozen emissions factors. Matched rows keep the
+        order of this frame.
+    right : Pandas DataFrame
+        CEDS DataFrame, i.e. activity.
+    keys : list of str, optional
+        Key columns. Default is None, in which case CEDS_KEY_COLS is used.
+    
+    Returns
+    -------
+    tuple of (NumPy array, NumPy array, Pandas DataFrame, Pandas DataFrame)
+        Positions of the matched rows in 'left', positions of the corresponding
+        rows in 'right', and the keys of the unmatched rows of 'left' & 'right'.
+    
+    Raises
+    ------
+    ValueError if either frame has duplicate keys.
+    """
+    if (keys is None):
+        keys = CEDS_KEY_COLS
+    left_idx = pd.MultiIndex.from_arrays([left[key] for key in keys])
+    right_idx = pd.MultiIndex.from_arrays([right[key] for key in keys])
+    for name, idx in [('left', left_idx), ('right', right_idx)]:
+        if (not idx.is_unique):
+            dupes = idx[idx.duplicated()].unique().tolist()
+            raise ValueError('Duplicate {} keys in {} DataFrame: {}'.format(keys, name, dupes[:10]))
+    right_pos = right_idx.get_indexer(left_idx)
+    matched = right_pos >= 0
+    left_pos = np.flatnonzero(matched)
+    right_pos = right_pos[matched]
+    right_unmatched = np.ones(len(right_idx), dtype=bool)
+    right_unmatched[right_pos] = False
+    left_unmatched_keys = left.loc[~matched, keys]
+    right_unmatched_keys = right.loc[right_unmatched, keys]
+    return (left_pos, right_pos, left_unmatched_keys, right_unmatched_keys)
+    
+
 def arr_to_csv(arr, out_path):
     import csv
     print('Writing {}...'.format(arr))
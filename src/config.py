@@ -12,6 +12,7 @@ Change log
     * From class 'dirs' attribute, remove 'ceds' key & val.
     * Remove OS-specific directory code.
 """
+import copy
 import yaml
 import os
 from sys import platform
@@ -19,6 +20,23 @@ from sys import platform
 # Global config 'constant'
 CONFIG = None
 
+# Mass-balance corrections used when the YAML file has no 'corrections' section.
+# The pre-1970 1A1bc_Other-transformation emissions of SO2 & CO2 are copied
+# directly from the CMIP6 SO2 total emissions file
+DEFAULT_CORRECTIONS = {
+    species : {'file'    : 'final-emissions/SO2_total_CEDS_emissions.csv',
+               'sectors' : ['1A1bc_Other-transformation']}
+    for species in ['SO2', 'CO2']
+    }
+
+# Rows appended to every total emissions file when the YAML file has no
+# 'injected_rows' section. The global 1A3di_Oil_Tanker_Loading sector is missing
+# from the CMIP6 files, and gridding fails due to versioning without it
+DEFAULT_INJECTED_ROWS = [
+    {'iso' : 'global', 'sector' : '1A3di_Oil_Tanker_Loading', 'fuel' : 'process',
+     'units' : 'kt', 'value' : 0}
+    ]
+
 class ConfigObj:
     
     def __init__(self, yaml_path):
@@ -37,6 +55,7 @@ class ConfigObj:
             Keys: 
                 year_first : First year of CEDS output
                 year_last  : Last (most current) year of CEDS output
+                dtype      : dtype of the CEDS year columns, 'float64' or 'float32'
         dirs : dict of {str : str}
             Dictionary containing various input and output directory paths
             Keys:
@@ -45,21 +64,88 @@ class ConfigObj:
                 'output': Path to main output directory
                 'cmip6' : Path to CMIP6/intermediate-output directory
                 'ceds'  : Path to local CEDS project direcotyr
+        cache : dict of {str : bool or str}
+            Options for the binary cache of the CMIP6 input files.
+            Keys:
+                enabled : Whether or not to cache the input files. Default is True.
+                dir     : Path of the cache directory. Default is None, which
+                          places the cache in <cmip6 dir>/.cache
         freeze_year : int
             Freeze emission factors for years >= this year.
+        freeze_backend : str
+            Representation of the EF files used while freezing. 'dataframe'
+            (default) holds them in Pandas DataFrames, 'array' in a single
+            NumPy array per file.
         freeze_isos : str or list of str
             Freeze emissions for these CEDS ISOs. Default is 'all'.
         freeze_species : str or list of str
             Emission species to freeze.
         init_file : str
             Name of the init .yml file
+        scenarios : list of dict
+            Freeze scenarios to sweep over. Each scenario is a dict with keys
+            'name', 'year', & 'isos'. Empty unless the YAML file has a
+            'scenarios' section.
+        calc : dict
+            Options of the frozen total emissions calculation. 'chunksize' is
+            the number of rows of the frozen EF & activity files to process at
+            a time, or None (default) to process the whole files at once.
+        corrections : dict
+            Mass-balance corrections of the frozen total emissions, keyed by
+            species. Each correction is a dict with keys 'file' (reference total
+            emissions file, relative to the CMIP6 directory), 'sectors', &
+            'years' (first & last year to copy from the reference file).
+            Default is to copy the 1750-1970 1A1bc_Other-transformation
+            emissions of SO2 & CO2 from the CMIP6 SO2 total emissions file.
+        output : dict
+            Options of the frozen EF & total emissions files. 'precision' is the
+            number of significant digits of the emissions values, or None
+            (default) for full precision. 'compression' is 'gzip' or None
+            (default). 'max_pending' is the number of files that may wait to
+            be written in the background while the next species is processed,
+            or 0 to write them synchronously. Default is 2.
+        injected_rows : list of dict
+            Rows appended to every total emissions file. Each row is a dict with
+            keys 'iso', 'sector', 'fuel', 'units', & 'value' (emissions of every
+            year). Default is config.DEFAULT_INJECTED_ROWS.
+        outliers : dict
+            Outlier detection of the freeze year EFs. 'method' is the name of an
+            outlier_detection.DETECTORS method, default 'zscore'. 'params'
+            holds the method's keyword parameters, i.e. {'thresh' : 3}.
+            'replacement' is the name of an outlier_detection.REPLACEMENTS
+            strategy, default 'global_median'.
+        instrument : dict
+            Options of the per-stage timing & memory report. 'enabled' (default
+            True) turns the report on or off. 'tracemalloc' (default False)
+            also records the peak memory allocated by Python in each stage,
+            which slows down processing.
+        diagnostics : dict
+            Diagnostics files of the EF objects. 'policy' is 'off', 'deferred'
+            (default), or 'eager'. Deferred files are written at the end of the
+            run, eager files as soon as each EF object is created.
+        incremental : bool
+            Whether or not to skip species whose input files, config values, &
+            output files are unchanged since they were last processed. Default
+            is True.
         """
         self.dirs           = self._init_dirs()
         self.freeze_year    = None
         self.freeze_isos    = None
         self.freeze_species = None
+        self.freeze_backend = 'dataframe'
         self.init_file      = None
         self.ceds_meta      = {}
+        self.cache          = {'enabled' : True, 'dir' : None}
+        self.scenarios      = []
+        self.calc           = {'chunksize' : None}
+        self.corrections    = {}
+        self.injected_rows  = []
+        self.output         = {'precision' : None, 'compression' : None, 'max_pending' : 2}
+        self.outliers       = {'method' : 'zscore', 'params' : {},
+                               'replacement' : 'global_median'}
+        self.instrument     = {'enabled' : True, 'tracemalloc' : False}
+        self.diagnostics    = {'policy' : 'deferred'}
+        self.incremental    = True
         self._parse_yaml(yaml_path)
     
     def _init_dirs(self):
@@ -105,14 +191,111 @@ class ConfigObj:
         self.dirs['output'] = os.path.join(self.dirs['root'], 'output')
         self.dirs['cmip6']  = os.path.join(self.dirs['input'], 'cmip')
         self.freeze_year    = int(info['freeze']['year'])
-        try:     # Is freeze_isos a string?
-            self.freeze_isos = info['freeze']['isos'].lower()
-        except:  # We have determined that freeze_isos is not a string
-            self.freeze_isos = [x.lower() for x in info['freeze']['isos']]
+        self.freeze_isos    = self._parse_isos(info['freeze']['isos'])
         self.freeze_species  = info['freeze']['species']
+        self.freeze_backend  = info['freeze'].get('backend', 'dataframe')
         self.init_file       = os.path.basename(yaml_path)
         self.ceds_meta['year_first'] = info['ceds']['year_first']
         self.ceds_meta['year_last']  = info['ceds']['year_last']
+        self.ceds_meta['dtype']      = info['ceds'].get('dtype', 'float64')
+        if ('cache' in info):
+            self.cache['enabled'] = info['cache'].get('enabled', True)
+            self.cache['dir']     = info['cache'].get('dir', None)
+        if ('calc' in info):
+            self.calc['chunksize'] = info['calc'].get('chunksize', None)
+        self.corrections = self._parse_corrections(info.get('corrections', DEFAULT_CORRECTIONS))
+        self.injected_rows = [{'iso'    : str(row['iso']),
+                               'sector' : str(row['sector']),
+                               'fuel'   : str(row['fuel']),
+                               'units'  : str(row['units']),
+                               'value'  : float(row.get('value', 0))}
+                              for row in info.get('injected_rows', DEFAULT_INJECTED_ROWS)]
+        if ('output' in info):
+            self.output['precision']   = info['output'].get('precision', None)
+            self.output['compression'] = info['output'].get('compression', None)
+            self.output['max_pending'] = int(info['output'].get('max_pending', 2))
+        if ('outliers' in info):
+            self.outliers['method'] = str(info['outliers'].get('method', 'zscore'))
+            self.outliers['replacement'] = str(info['outliers'].get('replacement',
+                                                                    'global_median'))
+            self.outliers['params'] = {key : val for key, val in info['outliers'].items()
+                                       if key not in ('method', 'replacement')}
+        if ('instrument' in info):
+            self.instrument['enabled']     = info['instrument'].get('enabled', True)
+            self.instrument['tracemalloc'] = info['instrument'].get('tracemalloc', False)
+        if ('diagnostics' in info):
+            policy = info['diagnostics'].get('policy', 'deferred')
+            # YAML parses an unquoted 'off' as False
+            self.diagnostics['policy'] = 'off' if policy is False else str(policy)
+        if ('build' in info):
+            self.incremental = info['build'].get('incremental', True)
+        for scenario in info.get('scenarios', []):
+            self.scenarios.append({
+                'name' : str(scenario['name']),
+                'year' : int(scenario.get('year', self.freeze_year)),
+                'isos' : self._parse_isos(scenario.get('isos', self.freeze_isos))
+                })
+    
+    def _parse_isos(self, isos):
+        """
+        Parse the ISOs to freeze.
+        
+        Params
+        -------
+        isos : str or list of str
+            ISO(s) to freeze, or 'all'
+        
+        Return
+        -------
+        str or list of str, lower-cased
+        """
+        try:     # Is isos a string?
+            return isos.lower()
+        except:  # We have determined that isos is not a string
+            return [x.lower() for x in isos]
+    
+    def _parse_corrections(self, corrections):
+        """
+        Parse the mass-balance corrections of the frozen total emissions.
+        
+        Params
+        -------
+        corrections : dict
+            Corrections keyed by species, see DEFAULT_CORRECTIONS
+        
+        Return
+        -------
+        dict of dict, keyed by species
+        """
+        parsed = {}
+        for species, correction in (corrections or {}).items():
+            years = correction.get('years', [self.ceds_meta['year_first'], 1970])
+            parsed[species] = {'file'    : correction['file'],
+                               'sectors' : list(correction['sectors']),
+                               'years'   : (int(years[0]), int(years[1]))}
+        return parsed
+    
+    def get_scenario_config(self, scenario):
+        """
+        Get a copy of the instance with the freeze year & ISOs of a sweep scenario.
+        The scenario's output is written to a subdirectory of the output directory
+        named after the scenario.
+        
+        Params
+        -------
+        scenario : dict
+            Scenario from the instance's 'scenarios' attribute
+        
+        Return
+        -------
+        ConfigObj
+        """
+        scenario_config = copy.deepcopy(self)
+        scenario_config.freeze_year    = scenario['year']
+        scenario_config.freeze_isos    = scenario['isos']
+        scenario_config.dirs['output'] = os.path.join(self.dirs['output'], scenario['name'])
+        scenario_config.scenarios      = []
+        return scenario_config
         
     def __repr__(self):
         return "<ConfigObj object {}>".format(self.init_file)
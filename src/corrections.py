@@ -0,0 +1,143 @@
+"""
+Mass-balance corrections of the frozen total emissions
+
+The emissions of some species, sectors, & years are copied directly from a
+reference CMIP6 total emissions file rather than calculated from the frozen
+emissions factors. The corrections are configured per species in the global
+CONFIG object (see config.DEFAULT_CORRECTIONS). Each reference file is read &
+indexed by (iso, sector, fuel) only once per process.
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import ceds_io
+import config
+import instrument
+
+logger = logging.getLogger('main')
+
+# Indexed reference rows keyed by (path, size, mtime_ns, sectors)
+_SOURCE_CACHE = {}
+
+
+def get_correction(species):
+    """
+    Get the mass-balance correction of a species from the global CONFIG object.
+
+    Parameters
+    -----------
+    species : str
+        Emission species
+
+    Return
+    -------
+    dict with keys 'file', 'sectors', & 'years', or None if the species has
+    no correction
+    """
+    return config.CONFIG.corrections.get(species, None)
+
+
+def get_correction_file(species):
+    """
+    Get the absolute path of the reference file of a species' correction.
+
+    Parameters
+    -----------
+    species : str
+        Emission species
+
+    Return
+    -------
+    str, or None if the species has no correction
+    """
+    correction = get_correction(species)
+    if (correction is None):
+        return None
+    return os.path.join(config.CONFIG.dirs['cmip6'], correction['file'])
+
+
+def load_correction_source(abs_path, sectors):
+    """
+    Read the rows of a reference total emissions file that belong to the given
+    sectors, indexed by (iso, sector, fuel). The result is memoized, so each
+    file is only read once per process unless it changes.
+
+    Parameters
+    -----------
+    abs_path : str
+        Absolute path of the reference total emissions file
+    sectors : list of str
+        Sectors to keep
+
+    Return
+    -------
+    Pandas DataFrame of the year columns, indexed by (iso, sector, fuel)
+    """
+    f_stat = os.stat(abs_path)
+    key = (abs_path, f_stat.st_size, f_stat.st_mtime_ns, tuple(sectors))
+    if (key not in _SOURCE_CACHE):
+        logger.debug('Reading correction source {}'.format(abs_path))
+        ref_df = ceds_io.read_ceds_file_cached(abs_path)
+        ref_df = ref_df.loc[ref_df['sector'].isin(sectors)]
+        year_cols = [col for col in ref_df.columns if ceds_io.YEAR_COL_PATTERN.match(col)]
+        ref_idx = pd.MultiIndex.from_arrays([ref_df[col].astype(str)
+                                             for col in ceds_io.CEDS_KEY_COLS])
+        _SOURCE_CACHE[key] = pd.DataFrame(ref_df[year_cols].to_numpy(),
+                                          index=ref_idx, columns=year_cols)
+    return _SOURCE_CACHE[key]
+
+
+@instrument.timed('correct')
+def apply_correction(species, emissions_df):
+    """
+    Overwrite a species' total emissions with those of its correction's
+    reference file, for the correction's sectors & years. Rows are matched by
+    (iso, sector, fuel); rows without a match and NaN reference values are
+    left unchanged.
+
+    Parameters
+    -----------
+    species : str
+        Emission species
+    emissions_df : Pandas DataFrame
+        Total emissions, or a chunk of them. Modified in place.
+
+    Return
+    -------
+    int : Number of corrected rows
+    """
+    correction = get_correction(species)
+    if (correction is None):
+        return 0
+    ref_df = load_correction_source(get_correction_file(species), correction['sectors'])
+    cols = ['X{}'.format(yr) for yr in range(correction['years'][0], correction['years'][1] + 1)]
+    cols = [col for col in cols if col in emissions_df.columns and col in ref_df.columns]
+
+    rows = np.flatnonzero(emissions_df['sector'].isin(correction['sectors']).to_numpy())
+    if (rows.size == 0 or not cols):
+        return 0
+    sub_df = emissions_df.iloc[rows]
+    sub_idx = pd.MultiIndex.from_arrays([sub_df[col].astype(str)
+                                         for col in ceds_io.CEDS_KEY_COLS])
+    ref_pos = ref_df.index.get_indexer(sub_idx)
+    matched = ref_pos >= 0
+    rows = rows[matched]
+    if (rows.size == 0):
+        return 0
+
+    col_pos = [emissions_df.columns.get_loc(col) for col in cols]
+    ref_vals = ref_df[cols].to_numpy()[ref_pos[matched]]
+    cur_vals = emissions_df.iloc[rows, col_pos].to_numpy()
+    emissions_df.iloc[rows, col_pos] = np.where(np.isnan(ref_vals), cur_vals, ref_vals)
+    logger.debug('Corrected {} {} rows for {}-{}'.format(rows.size, species, *correction['years']))
+    return rows.size
+
+
+def clear_cache():
+    """
+    Remove all memoized correction sources.
+    """
+    _SOURCE_CACHE.clear()
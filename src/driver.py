@@ -10,15 +10,22 @@ Matt Nicholson
 7 Feb 2020
 """
 import argparse
+import itertools
 import logging
+import multiprocessing
 import os
+import numpy as np
 import pandas as pd
 
 import log_config
 import ceds_io
 import config
-import z_stats
+import corrections
+import instrument
+import manifest
+import outlier_detection
 import emission_factor_file
+import sectors
 
 
 def init_parser():
@@ -42,6 +49,18 @@ def init_parser():
         Default is to execute both functions. 
         Example: Recalculate final emissions only
             > python main.py path/to/yaml -f "calc_emissions"
+    -i, --intermediates; optional
+        Write the frozen emissions factors files to /output when executing both
+        functions. Without this flag, the frozen emissions factors are kept in
+        memory and passed directly from "freeze_emissions" to "calc_emissions".
+    -w, --workers; int, optional
+        Number of worker processes. When > 1, each species is processed in its
+        own worker process. Default is 1.
+        Example: Freeze & calculate emissions for up to 9 species at once
+            > python main.py path/to/yaml -w 9
+    --force; optional
+        Re-process every species, even those whose input files, config values,
+        & output files are unchanged since they were last processed.
     """
     parse_desc = """Freeze CEDS CMIP6 emissions factors and calculate frozen total emissions"""
     
@@ -55,6 +74,21 @@ def init_parser():
                         dest='function', action='store', type=str, default='all',
                         help=('Optional; Function(s) to execute ("freeze_emissions" or "calc_emissions").'
                               'Default value is "both", which executes both functions'))
+                        
+    parser.add_argument('-i', '--intermediates', required=False,
+                        dest='intermediates', action='store_true',
+                        help=('Optional; Write the frozen emissions factors files when executing '
+                              'both functions. By default they are kept in memory only'))
+                        
+    parser.add_argument('-w', '--workers', metavar='workers', required=False,
+                        dest='workers', action='store', type=int, default=1,
+                        help=('Optional; Number of worker processes. Species are processed in '
+                              'parallel when > 1. Default value is 1'))
+                        
+    parser.add_argument('--force', required=False,
+                        dest='force', action='store_true',
+                        help=('Optional; Re-process every species, ignoring the build '
+                              'manifest in the output directory'))
     return parser
 
 
@@ -81,18 +115,80 @@ def freeze_emissions():
     -------
     None, writes frozen emissions factors files to /output directory.
     """
-    failed_species = [''] * len(config.CONFIG.freeze_species)
-    fail_idx = 0
+    failed_species = []
+    
+    logger = logging.getLogger("main")
+    logger.info("In main::freeze_emissions()")
+    logger.info("dir_cmip6 = {}".format(config.CONFIG.dirs['cmip6']))
+    logger.info("freeze year = {}".format(config.CONFIG.freeze_year))
+    
+    # Begin for-loop over each species we want to freeze
+    # Each frozen EF file is written in the background while the next species is frozen
+    with ceds_io.background_writes() as writer:
+        for species in config.CONFIG.freeze_species:
+            with log_config.species_context(species):
+                frozen_df = freeze_species(species)
+            if (frozen_df is None):
+                failed_species.append(species)
+    # --- END EF file loop -----
+    failed_species += get_write_failures(writer, failed_species)
+    emission_factor_file.write_deferred_diagnostics()
+    for failure in failed_species:
+        logger.warning('Emissions calculation failed for {}'.format(failure))
+    logger.info("Finished processing all species\nLeaving main::freeze_emissions()\n")
+
+
+def get_write_failures(writer, failed_species):
+    """
+    Get the species whose output files could not be written in the background.
+    
+    Parameters
+    ----------
+    writer : ceds_io.BackgroundWriter or None
+        Background writer of the species loop, None if writes were synchronous.
+    failed_species : list of str
+        Species that already failed.
+    
+    Returns
+    -------
+    list of str
+    """
+    if (writer is None):
+        return []
+    failures = []
+    for species, f_path, err in writer.failed:
+        if (species not in failed_species and species not in failures):
+            failures.append(species)
+    return failures
+    
+    
+def freeze_species(species, write=True, ef_df=None):
+    """
+    Freeze the CMIP6 emissions factors of a single species for years >= 'year'
+    and write the frozen emissions factors file to the /output directory.
+    
+    Parameters
+    ----------
+    species : str
+        Emission species to freeze.
+    write : bool, optional
+        Whether or not to write the frozen emissions factors file. Default is True.
+    ef_df : Pandas DataFrame, optional
+        Already-parsed CMIP6 emissions factors of the species, which are left
+        unmodified. Default is None, in which case the CMIP6 emissions factors
+        file is read.
+    
+    Returns
+    -------
+    Pandas DataFrame : The species' frozen emissions factors, or None if its
+                       CMIP6 emissions factors file could not be found.
+    """
+    logger = logging.getLogger("main")
     
     # Unpack config directory paths for better readability
     dir_cmip6 = config.CONFIG.dirs['cmip6']
     dir_output = config.CONFIG.dirs['output']
     
-    logger = logging.getLogger("main")
-    logger.info("In main::freeze_emissions()")
-    logger.info("dir_cmip6 = {}".format(dir_cmip6))
-    logger.info("freeze year = {}".format(config.CONFIG.freeze_year))
-        
     # Construct the column header strings for years >= 'year' param
     year_strs = ['X{}'.format(yr) for yr in range(config.CONFIG.freeze_year,
                                                   config.CONFIG.ceds_meta['year_last'] + 1)]
@@ -100,84 +196,60 @@ def freeze_emissions():
     logger.debug("year_strs[0] = {}".format(year_strs[0]))
     logger.debug("year_strs[-1] = {}".format(year_strs[-1]))
     
-    # Begin for-loop over each species we want to freeze
-    for species in config.CONFIG.freeze_species:
-        logger.info("Processing species: {}".format(species))
-        
-        # Get the species' EF file
-        try:
-            f_path = ceds_io.get_file_for_species(dir_cmip6, species, "ef")
-        except FileNotFoundError as err:
-            # If a FileNotFoundError is returned, log it and move on to the next species
-            err_str = "Error encountered while fetching EF file: {}".format(err)
-            logger.error(err_str)
-            failed_species[fail_idx] = species
-            fail_idx += 1
-            continue
+    logger.info("Processing species: {}".format(species))
+    
+    # Get the species' EF file
+    try:
+        f_path = ceds_io.get_file_for_species(dir_cmip6, species, "ef")
+    except FileNotFoundError as err:
+        # If a FileNotFoundError is returned, log it and move on to the next species
+        err_str = "Error encountered while fetching EF file: {}".format(err)
+        logger.error(err_str)
+        return None
 
-        logger.info("Loading EF DataFrame from {}".format(f_path))
-        ef_obj = emission_factor_file.EmissionFactorFile(species, f_path)
-        
-        # Get combustion sectors
-        sectors = ef_obj.get_sectors()
-        fuels = ef_obj.get_fuels()
-        
-        # Not going to python-ize these nested loops as it decreases readability
-        for sector in sectors:
-            for fuel in fuels:
-                info_str = "Processing {}...{}...{}".format(species, sector, fuel)
-                logger.info("--- {} ---".format(info_str))
-                print("{}...".format(info_str))
-                
-                if (ef_obj.get_comb_shape()[0] != 0):
-                    # Calculate the median of the EF values
-                    ef_median = z_stats.get_ef_median(ef_obj)
-                    logger.debug("EF data array median: {}".format(ef_median))
-                    logger.debug("Identifying outliers")
-                    
-                    outliers = z_stats.get_outliers_zscore(ef_obj, sector, fuel)
-                    if (len(outliers) != 0):
-                        logger.debug("Setting outlier values to median EF value")
-                        # Set the EF value of each idenfitied outlier to the median of the EF values
-                        for olr in outliers:
-                            # Set outlier values to the calculated median val
-                            logger.debug('Outlier: {}-{}-{}-{}'.format(olr[0], sector, fuel, olr[1]))
-                            ef_obj.combustion_factors.loc[
-                                    (ef_obj.combustion_factors['iso'] == olr[0]) &
-                                    (ef_obj.combustion_factors['sector'] == sector) &
-                                    (ef_obj.combustion_factors['fuel'] == fuel) &
-                                    (ef_obj.combustion_factors[ef_obj.freeze_year] == olr[1])
-                                    ] = ef_median
-                    else:
-                        logger.debug("No outliers were identified")
-                    # Overwrite the current EFs for years >= 1970
-                    logger.debug("Overwriting original EF DataFrame with new EF values")
-                else:
-                    logger.warning("Subsetted EF dataframe is empty")
-            # --- END fuel loop -----
-        # --- END sector loop -----
-        # Freeze the combustion emissions
-        logger.debug("Freezing emissions...")
-        ef_obj.freeze_emissions(year_strs)
-        
-        # Overwrite the corresponding values from the original EF DataFrame
-        logger.debug("Reconstructing total emissions factors DataFrame...")
-        ef_obj.reconstruct_emissions()
-        
+    logger.info("Loading EF DataFrame from {}".format(f_path))
+    with instrument.stage('read_ef', species):
+        ef_obj = emission_factor_file.init_ef_obj(species, f_path, ef_df=ef_df)
+    
+    if (ef_obj.get_comb_shape()[0] != 0):
+        with instrument.stage('outliers', species):
+            logger.debug("Identifying outliers for all sector & fuel groups using {}".format(
+                         config.CONFIG.outliers['method']))
+            # Group the freeze year EFs once for both detection & replacement
+            ef_groups = outlier_detection.EFGroups.from_ef_obj(ef_obj)
+            outliers = outlier_detection.detect(ef_groups)
+            if (outliers.any()):
+                logger.debug("Replacing outlier values using {}".format(
+                             config.CONFIG.outliers['replacement']))
+                replacements = outlier_detection.get_replacements(ef_groups, outliers)
+                if (logger.isEnabledFor(logging.DEBUG)):
+                    olr_df = ef_obj.get_comb_columns(['iso', 'sector', 'fuel',
+                                                      ef_obj.freeze_year])[outliers]
+                    for olr, new_ef in zip(olr_df.itertuples(index=False), replacements):
+                        logger.debug('Outlier: {}-{}-{}-{} -> {}'.format(*olr, new_ef))
+                # Set the freeze year EF of every identified outlier to its replacement
+                ef_obj.set_comb_values(ef_obj.freeze_year, outliers, replacements)
+            else:
+                logger.debug("No outliers were identified")
+    else:
+        logger.warning("Subsetted EF dataframe is empty")
+    # Freeze the combustion emissions directly in the EF DataFrame, so there is
+    # no need to reconstruct it from the combustion EFs
+    logger.debug("Freezing emissions...")
+    with instrument.stage('freeze', species):
+        ef_obj.freeze_emissions(year_strs, in_place=True)
+    
+    all_factors = ef_obj.all_factors
+    if (write):
         f_name = os.path.basename(f_path)
-        f_out = os.path.join(dir_output, f_name)
+        f_out = ceds_io.get_output_path(os.path.join(dir_output, f_name))
         
         info_str = "Writing frozen emissions factors DataFrame to {}".format(f_out)
-        logger.debug(info_str)
-        print(info_str + '\n')
+        logger.debug(info_str, extra=log_config.PROGRESS)
         
-        ef_obj.all_factors.to_csv(f_out, sep=',', header=True, index=False)
-        logger.info("--- Finished processing {} ---\n".format(species))
-    # --- END EF file loop -----
-    for failure in failed_species:
-        if failure != '':
-            logger.warning('Emissions calculation failed for {}'.format(failure))
-    logger.info("Finished processing all species\nLeaving main::freeze_emissions()\n")
+        ceds_io.submit_write(all_factors, f_out, label=species, stage='write_ef')
+    logger.info("--- Finished processing {} ---\n".format(species))
+    return all_factors
     
     
 def calc_emissions():
@@ -205,12 +277,52 @@ def calc_emissions():
     -------
     None, writes frozen total emissions files to /output directory.
     """
-    failed_species = [''] * len(config.CONFIG.freeze_species)
-    fail_idx = 0
+    failed_species = []
     
     logger = logging.getLogger("main")
     logger.info('In main::calc_emissions()')
     
+    with ceds_io.background_writes() as writer:
+        for species in config.CONFIG.freeze_species:
+            with log_config.species_context(species):
+                success = calc_species(species)
+            if (not success):
+                failed_species.append(species)
+    # --- End species loop ---
+    failed_species += get_write_failures(writer, failed_species)
+    for failure in failed_species:
+        logger.warning('Emissions calculation failed for {}'.format(failure))
+    logger.info('Finished processing all species! Leaving validate::calc_emissions()\n')
+
+
+def calc_species(species, ef_df=None, act_df=None):
+    """
+    Produce the frozen total emissions file for a single species from its frozen
+    emissions factors file & CMIP6 activity file.
+    
+    Parameters
+    ----------
+    species : str
+        Emission species to calculate frozen total emissions for.
+    ef_df : Pandas DataFrame, optional
+        The species' frozen emissions factors, as returned by freeze_species().
+        Default is None, in which case the frozen emissions factors file is read
+        from the /output directory.
+    act_df : Pandas DataFrame, optional
+        Already-parsed CMIP6 activity of the species. Default is None, in which
+        case the CMIP6 activity file is read.
+    
+    Returns
+    -------
+    bool : True if the species' total emissions were calculated, False if its
+           frozen emissions factors file or activity file could not be found.
+    """
+    logger = logging.getLogger("main")
+    
+    chunksize = config.CONFIG.calc['chunksize']
+    if (chunksize and ef_df is None and act_df is None):
+        return calc_species_chunked(species, chunksize)
+    
     # Unpack for better readability
     dir_output = config.CONFIG.dirs['output']
     dir_cmip6 = config.CONFIG.dirs['cmip6']
@@ -221,113 +333,568 @@ def calc_emissions():
     logger.debug('data_col_headers[0] = '.format(data_col_headers[0]))
     logger.debug('data_col_headers[-1] = '.format(data_col_headers[-1]))
     
-    for species in config.CONFIG.freeze_species:
-        info_str = '\nCalculating frozen total emissions for {}...'.format(species)
-        logger.info(info_str)
-        print(info_str)
-        
-        # Get emission factor file for species
+    info_str = '\nCalculating frozen total emissions for {}...'.format(species)
+    logger.info(info_str, extra=log_config.PROGRESS)
+    
+    # Get emission factor file for species, unless the frozen EFs were passed in
+    if (ef_df is None):
         try:
             frozen_ef_file = ceds_io.get_file_for_species(dir_output, species, "ef")
         except FileNotFoundError as err:
             # If a FileNotFoundError is returned, log it and move on to the next species
             err_str = "Error encountered while fetching EF file: {}".format(err)
             logger.error(err_str)
-            failed_species[fail_idx] = species
-            fail_idx += 1
-            print(err_str)
-            continue
-        
-        # Get activity file for species
+            return False
+    
+    # Get activity file for species, unless the activity was passed in
+    if (act_df is None):
         try:
             activity_file = ceds_io.get_file_for_species(dir_cmip6, species, "activity")
         except:
             # If a FileNotFoundError is returned, log it and move on to the next species
             err_msg = 'No activity file found for {}'.format(species)
             logger.error(err_msg)
-            failed_species[fail_idx] = species
-            fail_idx += 1
-            print(err_msg)
-            continue
-        
-        # Read emission factor & activity files into DataFrames
+            return False
+    
+    # Read emission factor & activity files into DataFrames
+    if (ef_df is None):
         logger.debug('Reading emission factor file from {}'.format(frozen_ef_file))
-        ef_df = pd.read_csv(frozen_ef_file, sep=',', header=0)
-        
+        with instrument.stage('read_frozen_ef', species):
+            ef_df = ceds_io.read_ceds_file(frozen_ef_file)
+    else:
+        logger.debug('Using in-memory frozen emission factors')
+    
+    if (act_df is None):
         logger.debug('Reading activity file from {}'.format(activity_file))
-        act_df = pd.read_csv(activity_file, sep=',', header=0)
-        
-        # Get the 'iso', 'sector', & 'fuel' columns
+        with instrument.stage('read_activity', species):
+            act_df = ceds_io.read_ceds_file_cached(activity_file)
+    else:
+        logger.debug('Using in-memory activity')
+    
+    # Get a subset of the emission factor & activity files that contain numerical
+    # data so we can compute emissions. We *could* skip this step and just
+    # do the slicing whithin the dataframe multiplication step (~line 245),
+    # but that is much messier and confusing to read
+    logger.debug('Subsetting emission factor & activity DataFrames')
+    if (ef_df.iloc[:, 0:3].equals(act_df.iloc[:, 0:3])):
+        # The rows of both files are in the same order
         meta_cols = ef_df.iloc[:, 0:4]
-        
-        # Sanity check
-        if (not ef_df.iloc[:, 0:3].equals(act_df.iloc[:, 0:3])):
-            err_str = 'Emission Factor & Activity DataFrames have mis-matched meta columns'
-            logger.error(err_str)
-            raise ValueError(err_str)
-        
-        # Get a subset of the emission factor & activity files that contain numerical
-        # data so we can compute emissions. We *could* skip this step and just
-        # do the slicing whithin the dataframe multiplication step (~line 245),
-        # but that is much messier and confusing to read
-        logger.debug('Subsetting emission factor & activity DataFrames')
-        ef_subs = ef_df[data_col_headers]
-        act_subs = act_df[data_col_headers]
-        
-        logger.debug('ef_subs.shape {}'.format(ef_subs.shape))
-        logger.debug('act_subs.shape {}'.format(act_subs.shape))
-        
-        logger.debug('Calculating total emissions')
-        
-        if (ef_subs.shape != act_subs.shape):
-            # Error is arising where ef_subs.shape = (55212, 265) &
-            # act_subs.shape = (54772, 265).
-            # ValueError will be raised by pandas
-            logger.error('ValueError: ef_subs & act_subs could not be broadcast together')
-        
-        emissions_df = pd.DataFrame(ef_subs.values * act_subs.values,
-                                    columns=ef_subs.columns, index=ef_subs.index)
-        
-        # Insert the meta ('iso', 'sector', 'fuel', 'units') columns at the 
-        # beginning of the DataFrame
-        logger.debug('Concatinating meta_cols and emissions_df DataFrames along axis 1')
-        emissions_df = pd.concat([meta_cols, emissions_df], axis=1)
-        
-        if (species == 'SO2' or species == 'CO2'):
-            # Correct for mass-balance correction by copying pre-1970 emissions
-            # directly from the CMIP6 total emissions file
-            cols = ['X{}'.format(yr) for yr in range(config.CONFIG.ceds_meta['year_first'], 1971)]
-            cmip_file = os.path.join(dir_cmip6, 'final-emissions', 'SO2_total_CEDS_emissions.csv')
-            logger.debug('Reading SO2 CMIP6 total emissions file from {}'.format(cmip_file))
-            cmip_df = pd.read_csv(cmip_file, sep=',', header=0)
-            cmip_so2 = cmip_df.loc[cmip_df['sector'] == '1A1bc_Other-transformation'].copy()
-            # Extract 1750-1970 emissions
-            cmip_so2 = cmip_so2[cols]
-            # Update the values of 1750-1970 emissions for the 1A1bc_Other-transformation
-            # sector in the master final emissions dataframe
-            emissions_df.update(cmip_so2)
-            
-        # Correct missing tanker loading sector or else gridding fails due to versioning.
-        logger.debug('Adding missing global 1A3di_Oil_Tanker_Loading sector')
-        zeros = [0] * len(data_col_headers)
-        tls_row = ['global', '1A3di_Oil_Tanker_Loading',  'process', 'kt'] + zeros
-        tls_df = pd.DataFrame([tls_row], columns=emissions_df.columns.values.tolist())
-        emissions_df = emissions_df.append(tls_df, ignore_index=True)
-        
-        f_name = '{}_total_CEDS_emissions.csv'.format(species)
-        f_out = os.path.join(dir_output, f_name)
-        
-        info_str = 'Writing emissions DataFrame to {}'.format(f_out)
-        logger.debug(info_str)
-        print(info_str + '\n')
-        
-        emissions_df.to_csv(f_out, sep=',', header=True, index=False)
-        logger.info('Finished calculating total emissions for {}'.format(species))
+        ef_vals = ef_df[data_col_headers].to_numpy()
+        act_vals = act_df[data_col_headers].to_numpy()
+    else:
+        # The files are from different CEDS versions or are ordered differently
+        # (i.e., 55212 EF rows vs. 54772 activity rows), so match rows by key
+        logger.warning('Emission Factor & Activity DataFrames have mis-matched meta columns, '
+                       'matching rows by {}'.format(ceds_io.CEDS_KEY_COLS))
+        with instrument.stage('align', species):
+            ef_pos, act_pos, ef_unmatched, act_unmatched = ceds_io.align_ceds_frames(ef_df, act_df)
+            log_unmatched_keys(species, ef_unmatched, 'emission factor')
+            log_unmatched_keys(species, act_unmatched, 'activity')
+            meta_cols = ef_df.iloc[ef_pos, 0:4]
+            ef_vals = ef_df[data_col_headers].to_numpy()[ef_pos]
+            act_vals = act_df[data_col_headers].to_numpy()[act_pos]
+    
+    logger.debug('ef_vals.shape {}'.format(ef_vals.shape))
+    logger.debug('act_vals.shape {}'.format(act_vals.shape))
+    
+    # Calculate the total emissions directly into the output DataFrame, along
+    # with the injected rows, i.e. the missing global 1A3di_Oil_Tanker_Loading
+    # sector, or else gridding fails due to versioning
+    logger.debug('Calculating total emissions')
+    with instrument.stage('multiply', species):
+        emissions_df = assemble_emissions(meta_cols, ef_vals, act_vals, data_col_headers)
+    
+    # Copy the emissions of the species' corrected sectors & years directly
+    # from its reference CMIP6 total emissions file
+    corrections.apply_correction(species, emissions_df)
+    
+    f_name = '{}_total_CEDS_emissions.csv'.format(species)
+    f_out = ceds_io.get_output_path(os.path.join(dir_output, f_name))
+    
+    info_str = 'Writing emissions DataFrame to {}'.format(f_out)
+    logger.debug(info_str, extra=log_config.PROGRESS)
+    
+    ceds_io.submit_write(emissions_df, f_out, label=species, stage='write_emissions')
+    logger.info('Finished calculating total emissions for {}'.format(species))
+    return True
+
+
+def calc_species_chunked(species, chunksize):
+    """
+    Calculate the frozen total emissions of a single species by reading its
+    frozen emissions factors file & CMIP6 activity file in aligned chunks of rows
+    and appending the emissions of each chunk to the output file, so that only a
+    few chunks are held in memory at once.
+    
+    Parameters
+    ----------
+    species : str
+        Emission species to calculate frozen total emissions for.
+    chunksize : int
+        Number of rows per chunk.
+    
+    Returns
+    -------
+    bool : True if the species' total emissions were calculated, False if its
+           frozen emissions factors file or activity file could not be found.
+    """
+    logger = logging.getLogger("main")
+    
+    dir_output = config.CONFIG.dirs['output']
+    dir_cmip6 = config.CONFIG.dirs['cmip6']
+    data_col_headers = ['X{}'.format(i) for i in range(config.CONFIG.ceds_meta['year_first'],
+                                                       config.CONFIG.ceds_meta['year_last'] + 1)]
+    
+    info_str = '\nCalculating frozen total emissions for {} in chunks of {} rows...'
+    info_str = info_str.format(species, chunksize)
+    logger.info(info_str, extra=log_config.PROGRESS)
+    
+    try:
+        frozen_ef_file = ceds_io.get_file_for_species(dir_output, species, "ef")
+        activity_file = ceds_io.get_file_for_species(dir_cmip6, species, "activity")
+    except FileNotFoundError as err:
+        err_str = "Error encountered while fetching input files: {}".format(err)
+        logger.error(err_str)
+        return False
+    
+    f_name = '{}_total_CEDS_emissions.csv'.format(species)
+    f_out = ceds_io.get_output_path(os.path.join(dir_output, f_name))
+    precision = ceds_io.get_output_options()['precision']
+    
+    info_str = 'Writing emissions DataFrame to {}'.format(f_out)
+    logger.debug(info_str, extra=log_config.PROGRESS)
+    
+    logger.debug('Reading emission factor file from {}'.format(frozen_ef_file))
+    logger.debug('Reading activity file from {}'.format(activity_file))
+    ef_chunks = ceds_io.read_ceds_file_chunks(frozen_ef_file, chunksize)
+    act_chunks = ceds_io.read_ceds_file_chunks(activity_file, chunksize)
+    
+    with instrument.stage('calc_chunked', species), ceds_io.open_output(f_out) as fh:
+        header = True
+        # Meta columns of the injected rows, if the files have no rows to chunk
+        meta_cols = pd.DataFrame(columns=['iso', 'sector', 'fuel', 'units'])
+        for ef_chunk, act_chunk in itertools.zip_longest(ef_chunks, act_chunks):
+            # Sanity check, which also catches files with different numbers of rows
+            if (ef_chunk is None or act_chunk is None or
+                    not ef_chunk.iloc[:, 0:3].equals(act_chunk.iloc[:, 0:3])):
+                err_str = ('Emission Factor & Activity DataFrames have mis-matched meta columns. '
+                           'Unset calc: chunksize to match their rows by key')
+                logger.error(err_str)
+                raise ValueError(err_str)
+            meta_cols = ef_chunk.iloc[:, 0:4]
+            emissions_df = assemble_emissions(meta_cols,
+                                              ef_chunk[data_col_headers].to_numpy(),
+                                              act_chunk[data_col_headers].to_numpy(),
+                                              data_col_headers, injected_rows=[])
+            corrections.apply_correction(species, emissions_df)
+            ceds_io.write_ceds_frame(emissions_df, fh, header=header, precision=precision)
+            header = False
+        # The injected rows go at the end of the file
+        logger.debug('Adding injected rows')
+        no_vals = np.zeros((0, len(data_col_headers)))
+        emissions_df = assemble_emissions(meta_cols.iloc[0:0], no_vals, no_vals, data_col_headers)
+        ceds_io.write_ceds_frame(emissions_df, fh, header=header, precision=precision)
+    ceds_io.remove_stale_copy(f_out)
+    ceds_io.index_file(f_out)
+    
+    logger.info('Finished calculating total emissions for {}'.format(species))
+    return True
+    
+    
+def log_unmatched_keys(species, unmatched_keys, f_type):
+    """
+    Log the (iso, sector, fuel) keys of a species' emission factor or activity
+    rows that have no matching row in the other file, and are thus left out of
+    its total emissions.
+    
+    Parameters
+    ----------
+    species : str
+        Emission species.
+    unmatched_keys : Pandas DataFrame
+        Keys of the unmatched rows, see ceds_io.align_ceds_frames().
+    f_type : str
+        Type of the file the rows are from, 'emission factor' or 'activity'.
+    
+    Returns
+    -------
+    None
+    """
+    if (unmatched_keys.empty):
+        return
+    logger = logging.getLogger("main")
+    logger.warning('{}: {} {} rows have no match and are excluded'.format(species,
+                   len(unmatched_keys), f_type))
+    for key in unmatched_keys.itertuples(index=False):
+        logger.debug('Unmatched {} row: {}'.format(f_type, '-'.join(map(str, key))))
+    
+    
+def assemble_emissions(meta_cols, ef_vals, act_vals, data_col_headers, injected_rows=None):
+    """
+    Assemble a total emissions DataFrame in a single pre-allocated array. The
+    emissions are calculated directly into the array, followed by the injected
+    rows, and the meta columns are then inserted in front, so the year columns
+    are never copied.
+    
+    Parameters
+    ----------
+    meta_cols : Pandas DataFrame
+        'iso', 'sector', 'fuel', & 'units' columns of the emissions.
+    ef_vals : NumPy array
+        Frozen emissions factors, with the same rows as meta_cols.
+    act_vals : NumPy array
+        Activity, with the same rows as meta_cols.
+    data_col_headers : list of str
+        Year column headers.
+    injected_rows : list of dict, optional
+        Rows to append, each with 'iso', 'sector', 'fuel', 'units', & 'value'
+        keys. Default is None, in which case config.CONFIG.injected_rows is used.
+    
+    Returns
+    -------
+    Pandas DataFrame
+    """
+    if (injected_rows is None):
+        injected_rows = config.CONFIG.injected_rows
+    n_rows = ef_vals.shape[0]
+    n_total = n_rows + len(injected_rows)
+    
+    data = np.empty((n_total, len(data_col_headers)), dtype=np.result_type(ef_vals, act_vals))
+    np.multiply(ef_vals, act_vals, out=data[:n_rows])
+    for idx, row in enumerate(injected_rows):
+        data[n_rows + idx] = row['value']
+    emissions_df = pd.DataFrame(data, columns=data_col_headers, copy=False)
+    
+    for idx, col in enumerate(meta_cols.columns):
+        values = np.empty(n_total, dtype=object)
+        values[:n_rows] = meta_cols[col].to_numpy(dtype=object)
+        values[n_rows:] = [row[col] for row in injected_rows]
+        emissions_df.insert(idx, col, values)
+    return emissions_df
+
+
+def freeze_calc_emissions(write_efs=False):
+    """
+    Freeze CMIP6 emissions factors and produce frozen total emissions files in
+    a single pass over the species.
+    
+    The frozen emissions factors of each species are kept in memory and multiplied
+    directly with the species' activity, rather than being written to /output
+    by freeze_emissions() and read back in by calc_emissions().
+    
+    Parameters
+    ----------
+    write_efs : bool, optional
+        Whether or not to also write the frozen emissions factors files to the
+        /output directory. Default is False.
+    
+    Returns
+    -------
+    None, writes frozen total emissions files to /output directory.
+    """
+    failed_species = []
+    
+    logger = logging.getLogger("main")
+    logger.info("In main::freeze_calc_emissions()")
+    logger.info("dir_cmip6 = {}".format(config.CONFIG.dirs['cmip6']))
+    logger.info("freeze year = {}".format(config.CONFIG.freeze_year))
+    
+    with ceds_io.background_writes() as writer:
+        for species in config.CONFIG.freeze_species:
+            with log_config.species_context(species):
+                success = freeze_calc_species(species, write_efs=write_efs)
+            if (not success):
+                failed_species.append(species)
     # --- End species loop ---
+    failed_species += get_write_failures(writer, failed_species)
+    emission_factor_file.write_deferred_diagnostics()
     for failure in failed_species:
-        if failure != '':
-            logger.warning('Emissions calculation failed for {}'.format(failure))
-    logger.info('Finished processing all species! Leaving validate::calc_emissions()\n')
+        logger.warning('Emissions calculation failed for {}'.format(failure))
+    logger.info('Finished processing all species! Leaving main::freeze_calc_emissions()\n')
+    
+    
+def freeze_calc_species(species, write_efs=False, ef_df=None, act_df=None):
+    """
+    Freeze the CMIP6 emissions factors of a single species and produce its frozen
+    total emissions file without reading the frozen emissions factors from disk.
+    
+    Parameters
+    ----------
+    species : str
+        Emission species to process.
+    write_efs : bool, optional
+        Whether or not to also write the frozen emissions factors file to the
+        /output directory. Default is False.
+    ef_df : Pandas DataFrame, optional
+        Already-parsed CMIP6 emissions factors of the species. Default is None.
+    act_df : Pandas DataFrame, optional
+        Already-parsed CMIP6 activity of the species. Default is None.
+    
+    Returns
+    -------
+    bool : True if the species' total emissions were calculated or are already
+           up to date, otherwise False.
+    """
+    build = get_build_manifest(species, write_efs=write_efs)
+    if (build is not None and build.is_current()):
+        logging.getLogger("main").info('{} is up to date, skipping'.format(species))
+        return True
+    frozen_df = freeze_species(species, write=write_efs, ef_df=ef_df)
+    if (frozen_df is None):
+        return False
+    success = calc_species(species, ef_df=frozen_df, act_df=act_df)
+    if (success and build is not None):
+        # Only record the outputs once they have been written
+        ceds_io.after_writes(build.update, build.outputs)
+    return success
+    
+    
+def get_build_manifest(species, write_efs=False):
+    """
+    Get the build manifest of a species in the output directory, which is used
+    to skip species that are already up to date.
+    
+    Parameters
+    ----------
+    species : str
+        Emission species.
+    write_efs : bool, optional
+        Whether or not the frozen emissions factors file is written. Default is False.
+    
+    Returns
+    -------
+    BuildManifest, or None if incremental builds are disabled or the species'
+    input files could not be found.
+    """
+    if (not config.CONFIG.incremental):
+        return None
+    dir_cmip6  = config.CONFIG.dirs['cmip6']
+    dir_output = config.CONFIG.dirs['output']
+    try:
+        ef_file = ceds_io.get_file_for_species(dir_cmip6, species, "ef")
+        activity_file = ceds_io.get_file_for_species(dir_cmip6, species, "activity")
+    except FileNotFoundError:
+        return None
+    # The master sector file decides which sectors are frozen
+    inputs = [ef_file, activity_file, sectors.get_registry().f_path]
+    if (outlier_detection.get_options()['replacement'] == 'region_median'):
+        inputs.append(outlier_detection.get_iso_regions_file())
+    if (corrections.get_correction(species) is not None):
+        inputs.append(corrections.get_correction_file(species))
+    outputs = [os.path.join(dir_output, '{}_total_CEDS_emissions.csv'.format(species))]
+    if (write_efs):
+        outputs.append(os.path.join(dir_output, os.path.basename(ef_file)))
+    outputs = [ceds_io.get_output_path(f_out) for f_out in outputs]
+    fingerprint = manifest.get_config_fingerprint(species, write_efs=write_efs)
+    return manifest.BuildManifest(species, dir_output, inputs, outputs, fingerprint)
+    
+    
+def sweep_emissions(write_efs=False):
+    """
+    Freeze CMIP6 emissions factors and produce frozen total emissions files for
+    every scenario in config.CONFIG.scenarios.
+    
+    The CMIP6 emissions factors & activity files of each species are read once
+    and re-used for every scenario. Output for each scenario is written to
+    /output/<scenario name>.
+    
+    Parameters
+    ----------
+    write_efs : bool, optional
+        Whether or not to also write the frozen emissions factors files.
+        Default is False.
+    
+    Returns
+    -------
+    None, writes frozen total emissions files to /output/<scenario name> directories.
+    """
+    failed_species = []
+    
+    logger = logging.getLogger("main")
+    logger.info("In main::sweep_emissions()")
+    logger.info("Scenarios: {}".format([scn['name'] for scn in config.CONFIG.scenarios]))
+    
+    with ceds_io.background_writes() as writer:
+        for species in config.CONFIG.freeze_species:
+            with log_config.species_context(species):
+                success = sweep_species(species, write_efs=write_efs)
+            if (not success):
+                failed_species.append(species)
+    # --- End species loop ---
+    failed_species += get_write_failures(writer, failed_species)
+    emission_factor_file.write_deferred_diagnostics()
+    for failure in failed_species:
+        logger.warning('Emissions calculation failed for {}'.format(failure))
+    logger.info('Finished processing all species! Leaving main::sweep_emissions()\n')
+    
+    
+def sweep_species(species, write_efs=False):
+    """
+    Freeze the CMIP6 emissions factors of a single species and produce its frozen
+    total emissions file for every scenario in config.CONFIG.scenarios, reading
+    the species' CMIP6 emissions factors & activity files only once.
+    
+    Parameters
+    ----------
+    species : str
+        Emission species to process.
+    write_efs : bool, optional
+        Whether or not to also write the frozen emissions factors files.
+        Default is False.
+    
+    Returns
+    -------
+    bool : True if the species' total emissions were calculated for every
+           scenario, otherwise False.
+    """
+    logger = logging.getLogger("main")
+    base_config = config.CONFIG
+    
+    try:
+        ef_file = ceds_io.get_file_for_species(base_config.dirs['cmip6'], species, "ef")
+        activity_file = ceds_io.get_file_for_species(base_config.dirs['cmip6'], species, "activity")
+    except FileNotFoundError as err:
+        logger.error("Error encountered while fetching input files: {}".format(err))
+        return False
+    
+    ef_df  = None
+    act_df = None
+    success = True
+    try:
+        for scenario in base_config.scenarios:
+            logger.info("--- Scenario {}: {} ---".format(scenario['name'], species))
+            config.CONFIG = base_config.get_scenario_config(scenario)
+            if (not os.path.isdir(config.CONFIG.dirs['output'])):
+                os.makedirs(config.CONFIG.dirs['output'])
+            build = get_build_manifest(species, write_efs=write_efs)
+            if (build is not None and build.is_current()):
+                logger.info('{} is up to date, skipping'.format(species))
+                continue
+            # Only read the input files once a scenario needs them
+            if (ef_df is None):
+                logger.debug('Reading emission factor file from {}'.format(ef_file))
+                with instrument.stage('read_ef', species):
+                    ef_df = ceds_io.read_ceds_file_cached(ef_file)
+                logger.debug('Reading activity file from {}'.format(activity_file))
+                with instrument.stage('read_activity', species):
+                    act_df = ceds_io.read_ceds_file_cached(activity_file)
+            if (not freeze_calc_species(species, write_efs=write_efs, ef_df=ef_df, act_df=act_df)):
+                logger.warning('Scenario {} failed for {}'.format(scenario['name'], species))
+                success = False
+    finally:
+        config.CONFIG = base_config
+    return success
+    
+    
+def run_parallel(function, workers, write_efs=False, level='debug'):
+    """
+    Freeze emissions factors and/or calculate frozen total emissions with each
+    species in config.CONFIG.freeze_species processed by its own worker process.
+    
+    The workers' log records are forwarded through a queue to the 'main' logger
+    of this process as they are logged, tagged with their species, so with the
+    log_config.QueueLogging backend they are also written to the per-species
+    log files (logs/main-<species>.log).
+    
+    Parameters
+    ----------
+    function : str
+        Function(s) to execute for each species. Valid values are "all", "sweep",
+        "freeze_emissions", & "calc_emissions".
+    workers : int
+        Number of worker processes.
+    write_efs : bool, optional
+        Whether or not to write the frozen emissions factors files when function
+        is "all". Default is False.
+    level : str, optional
+        Logging level of the worker processes. Default is 'debug'.
+    
+    Returns
+    -------
+    None, writes frozen emissions factors and/or frozen total emissions files
+    to /output directory.
+    """
+    logger = logging.getLogger("main")
+    logger.info('In main::run_parallel()')
+    logger.info('Processing {} species with {} workers'.format(len(config.CONFIG.freeze_species),
+                                                              workers))
+    failed_species = []
+    
+    species_args = [(species, function, write_efs) for species in config.CONFIG.freeze_species]
+    with log_config.worker_queue('main') as log_queue:
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(config.CONFIG, log_queue, level)) as pool:
+            for species, success, records in pool.imap_unordered(_process_species, species_args):
+                instrument.add_records(records)
+                if (not success):
+                    failed_species.append(species)
+            # Let the workers exit normally, which flushes their queued log records
+            pool.close()
+            pool.join()
+    # --- End species loop ---
+    for failure in failed_species:
+        logger.warning('Emissions calculation failed for {}'.format(failure))
+    logger.info('Finished processing all species! Leaving main::run_parallel()\n')
+    
+    
+def _init_worker(config_obj, log_queue, level):
+    """
+    Initialize a worker process of the run_parallel() process pool.
+    
+    Parameters
+    ----------
+    config_obj : ConfigObj
+        Global CONFIG object of the parent process.
+    log_queue : multiprocessing.Queue
+        Queue forwarding log records to the parent process.
+    level : str
+        Logging level.
+    
+    Returns
+    -------
+    None.
+    """
+    config.CONFIG = config_obj
+    log_config.init_worker_logger(log_queue, 'main', level=level)
+    
+    
+def _process_species(species_args):
+    """
+    Freeze emissions factors and/or calculate frozen total emissions for a single
+    species within a run_parallel() worker process.
+    
+    Parameters
+    ----------
+    species_args : tuple of (str, str, bool)
+        Species, function(s) to execute, & whether to write the frozen emissions
+        factors file.
+    
+    Returns
+    -------
+    tuple of (str, bool, list of dict)
+        Species, whether or not the species was processed successfully, & the
+        species' instrument stage records.
+    """
+    species, function, write_efs = species_args
+    logger = logging.getLogger('main')
+    
+    species_funcs = {'all'              : lambda sp: freeze_calc_species(sp, write_efs=write_efs),
+                     'sweep'            : lambda sp: sweep_species(sp, write_efs=write_efs),
+                     'freeze_emissions' : lambda sp: freeze_species(sp) is not None,
+                     'calc_emissions'   : calc_species}
+    
+    with log_config.species_context(species):
+        try:
+            success = species_funcs[function](species)
+        except Exception as err:
+            logger.exception('{} raised while processing {}: {}'.format(type(err).__name__,
+                                                                        species, err))
+            success = False
+        # Diagnostics deferred in the worker process are written by the worker
+        emission_factor_file.write_deferred_diagnostics()
+    records = instrument.get_records()
+    instrument.clear_records()
+    return (species, success, records)
 
 
 def main():
@@ -335,27 +902,52 @@ def main():
     parser = init_parser()
     args = parser.parse_args()
     
+    valid_funcs = ['all', 'freeze_emissions', 'calc_emissions']
+    if (args.function not in valid_funcs):
+        raise ValueError('Invalid function argument. Valid args are "all", "freeze_emissions", or "calc_emissions"')
+    if (args.workers < 1):
+        raise ValueError('Invalid workers argument. Must be >= 1')
+    
     # Parse the input YAML file & initialize global CONFIG 'constant'
     config.CONFIG = config.ConfigObj(args.input_file)
+    if (args.force):
+        config.CONFIG.incremental = False
+    instrument.clear_records()
     
-    # Initialize a new main log
-    logger = log_config.init_logger('logs', 'main', level='debug')
+    # Initialize a new main log, written with per-species logs & a console
+    # progress display on a background thread
+    log_level = 'debug'
+    log_backend = log_config.QueueLogging('logs', 'main', level=log_level)
+    logger = log_backend.logger
     logger.info('Input file {}'.format(args.input_file))
     
     info_str = 'Function(s) to execute: {}'
     # Execute the specified function(s)
-    if (args.function == 'all'):
-        logger.info(info_str.format('freeze_emissions() & calc_emissions()'))
-        freeze_emissions()
-        calc_emissions()
+    if (config.CONFIG.scenarios):
+        if (args.function == 'all'):
+            args.function = 'sweep'
+        else:
+            logger.warning('Scenarios are only swept when executing both functions, ignoring them')
+    
+    if (args.workers > 1):
+        logger.info(info_str.format('{} with {} worker processes'.format(args.function, args.workers)))
+        run_parallel(args.function, args.workers, write_efs=args.intermediates, level=log_level)
+    elif (args.function == 'sweep'):
+        logger.info(info_str.format('sweep_emissions()'))
+        sweep_emissions(write_efs=args.intermediates)
+    elif (args.function == 'all'):
+        logger.info(info_str.format('freeze_calc_emissions()'))
+        freeze_calc_emissions(write_efs=args.intermediates)
     elif (args.function == 'freeze_emissions'):
         logger.info(info_str.format('freeze_emissions()'))
         freeze_emissions()
     elif (args.function == 'calc_emissions'):
         logger.info(info_str.format('calc_emissions()'))
         calc_emissions()
-    else:
-        raise ValueError('Invalid function argument. Valid args are "all", "freeze_emissions", or "calc_emissions"')
+    
+    # Write the per-species, per-stage timing & memory report
+    instrument.write_report(os.path.join(config.CONFIG.dirs['output'], 'diagnostic'))
+    log_backend.stop()
         
 
 if __name__ == '__main__':
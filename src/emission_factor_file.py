@@ -43,6 +43,11 @@ get_factors_all()
 get_factors_combustion()
     Return the instance's dataframe that contains only emissions factors from 
     combustion-related sectors.
+get_comb_columns()
+    Return a subset of the columns of the instance's combustion EFs.
+set_comb_values()
+    Set the combustion EF values of a single year column for the rows selected
+    by a boolean mask.
 get_isos()
     Return a list of ISOs present in an instance's EF dataframe. Can access both
     the master EF and combustion EF dataframes.
@@ -62,8 +67,29 @@ _log_init()
     Write information about the newly-initialized EmissionFactorFile instance
     to the main log file.
 _write_diagnostics()
-    Write diagnostics files describing the ISOs and sectors of the EmissionFactorFile
-    instance that are to be frozen.
+    Write, defer, or skip the diagnostics file describing the ISOs and sectors
+    of the EmissionFactorFile instance that are to be frozen, depending on the
+    diagnostics policy in the global CONFIG object.
+_get_diagnostics_source()
+    Get references to the columns of the diagnostics file, without copying them.
+
+EmissionFactorArray
+-------------------
+Array-backed subclass of EmissionFactorFile. The year columns of the EF file are
+held in a single 2-D NumPy array ('data'), the iso, sector, & fuel columns as
+integer category codes ('codes'), and the combustion EFs as row indices into
+'data' ('comb_rows'). 'all_factors' & 'combustion_factors' are constructed on
+access. Selected with the 'freeze: backend: array' config option.
+
+Module Functions
+----------------
+init_ef_obj()
+    Create a new EmissionFactorFile or EmissionFactorArray, depending on the
+    EF backend in the global CONFIG object.
+get_diagnostics_policy()
+    Get the diagnostics policy from the global CONFIG object.
+write_deferred_diagnostics()
+    Write the diagnostics files deferred by the 'deferred' diagnostics policy.
 
 
 Matt Nicholson
@@ -74,13 +100,27 @@ import os
 import pandas as pd
 import numpy as np
 
+import ceds_io
 import config
+import sectors
+from log_config import LazyStr
 
 logger = logging.getLogger('main')
 
+# Diagnostics policies, see config.ConfigObj
+DIAGNOSTICS_POLICIES = ['off', 'deferred', 'eager']
+
+# Columns of the diagnostics file
+DIAGNOSTICS_COLUMNS = ['iso', 'sector', 'fuel']
+
+# Sources of the diagnostics files waiting to be written by
+# write_deferred_diagnostics(), see EmissionFactorFile._get_diagnostics_source(),
+# keyed by path. A later EF object of the same species replaces an earlier one
+_DEFERRED_DIAGNOSTICS = {}
+
 class EmissionFactorFile:
     
-    def __init__(self, species, f_path):
+    def __init__(self, species, f_path, ef_df=None):
         """
         Constructor for an EmissionFactorFile instance.
         
@@ -90,6 +130,10 @@ class EmissionFactorFile:
             Emission species represented in the EF file.
         f_path : str
             Path of the EF file.
+        ef_df : Pandas DataFrame, optional
+            Already-parsed contents of the EF file. A copy is used, so the same
+            DataFrame can initialize multiple instances. Default is None, in which
+            case the EF file is parsed.
             
         Attributes
         -----------
@@ -104,12 +148,18 @@ class EmissionFactorFile:
         freeze_year : str
             Year at which to freeze the EFs, formatted to match the format of 
             the EF dataframe year column headers (ex: 'X1970').
+        frozen_in_place : bool
+            Whether the EFs were frozen directly in 'all_factors'.
         """
         self.species     = species
         self.path        = f_path
-        self.all_factors = self._parse_file(f_path)
+        if (ef_df is None):
+            self.all_factors = self._parse_file(f_path)
+        else:
+            self.all_factors = ef_df.copy()
         self.freeze_year = 'X{}'.format(config.CONFIG.freeze_year)
         self.combustion_factors = self._get_comb_factors()
+        self.frozen_in_place = False
         if (config.CONFIG.freeze_isos != 'all' and config.CONFIG.freeze_isos != ['all']):
             self._filter_isos()
         self._log_init()
@@ -213,6 +263,42 @@ class EmissionFactorFile:
         """
         return self.combustion_factors
     
+    def get_comb_columns(self, columns):
+        """
+        Return a subset of the columns of the instance's combustion EFs.
+        
+        Parameters
+        -----------
+        columns : list of str
+            Names of the columns to return (ex: ['sector', 'fuel', 'X1970']).
+        
+        Return
+        -------
+        Pandas DataFrame, indexed like the combustion EF dataframe
+        """
+        return self.combustion_factors[columns]
+    
+    def set_comb_values(self, year, mask, value):
+        """
+        Set the combustion EF values of a single year column for the rows
+        selected by a boolean mask.
+        
+        Parameters
+        -----------
+        year : str
+            Year column header (ex: 'X1970').
+        mask : Pandas Series of bool
+            Boolean mask indexed like the combustion EF dataframe, i.e. as
+            returned by outlier_detection.get_outliers().
+        value : float or array-like of float
+            Value(s) to set.
+        
+        Return
+        -------
+        None.
+        """
+        self.combustion_factors.loc[mask, year] = value
+    
     def get_isos(self, ef='comb', unique=True):
         """
         Return a list of ISOs present in an instance's EF dataframe.
@@ -248,24 +334,44 @@ class EmissionFactorFile:
                 ret_val = self.combustion_factors['iso'].tolist()
         return ret_val
         
-    def freeze_emissions(self, year_strs):
+    def freeze_emissions(self, year_strs, in_place=False):
         """
         Set all combustion-related emissions factors for years greater than the
         freeze year equal to their value at the freeze year.
         
+        The freeze year column is broadcast across the post-freeze year columns
+        with a single assignment. Combustion EFs whose freeze year value is NaN
+        are left unchanged, as DataFrame.update() in reconstruct_emissions() 
+        would skip them anyway.
+        
         Parameters
         -----------
         year_strs : list of str
             List of strings representing years >= the freeze year, in column header
             format (ex: 'X1970').
+        in_place : bool, optional
+            If True, the frozen EFs are written directly into the 'all_factors'
+            dataframe, making reconstruct_emissions() unnecessary. The
+            'combustion_factors' dataframe is then left unfrozen. Default is False.
             
         Return
         -------
         None.
         """
-        year_0 = year_strs[0]
-        for year in year_strs[1:]:
-            self.combustion_factors[year] = self.combustion_factors[year_0]
+        freeze_vals = self.combustion_factors[year_strs[0]].to_numpy()
+        valid = ~np.isnan(freeze_vals)
+        freeze_vals = freeze_vals[valid]
+        if (in_place):
+            rows = self.all_factors.index.get_indexer(self.combustion_factors.index[valid])
+            cols = self.all_factors.columns.get_indexer(year_strs)
+            frozen = np.broadcast_to(freeze_vals[:, np.newaxis], (rows.shape[0], cols.shape[0]))
+            self.all_factors.iloc[rows, cols] = frozen
+            self.frozen_in_place = True
+        else:
+            cols = self.combustion_factors.columns.get_indexer(year_strs[1:])
+            rows = np.flatnonzero(valid)
+            frozen = np.broadcast_to(freeze_vals[:, np.newaxis], (rows.shape[0], cols.shape[0]))
+            self.combustion_factors.iloc[rows, cols] = frozen
             
     def reconstruct_emissions(self):
         """
@@ -273,6 +379,8 @@ class EmissionFactorFile:
         corresponding frozen EF values. 
         
         Updates the values of the instance's 'all_factors' dataframe in-place.
+        Only the year columns are updated so the categorical meta columns keep
+        their dtype. Does nothing if the EFs were frozen in place.
         
         Parameters
         -----------
@@ -282,7 +390,12 @@ class EmissionFactorFile:
         -------
         None.
         """
-        self.all_factors.update(self.combustion_factors)
+        if (self.frozen_in_place):
+            logger.debug("EFs were frozen in place, nothing to reconstruct")
+            return
+        year_cols = [col for col in self.combustion_factors.columns
+                     if ceds_io.YEAR_COL_PATTERN.match(col)]
+        self.all_factors.update(self.combustion_factors[year_cols])
     
     def _filter_isos(self):
         """
@@ -316,7 +429,7 @@ class EmissionFactorFile:
         Pandas DataFrame
         """
         logger.debug("Reading EF file {}".format(f_path))
-        ef_df = pd.read_csv(f_path, sep=',', header=0)
+        ef_df = ceds_io.read_ceds_file_cached(f_path)
         return ef_df
     
     def _get_comb_factors(self):
@@ -332,20 +445,8 @@ class EmissionFactorFile:
         -------
         Pandas DataFrame
         """
-        combustion_sectors = ['1A1a_Electricity-public', '1A1a_Electricity-autoproducer',
-                              '1A1a_Heat-production', '1A2a_Ind-Comb-Iron-steel',
-                              '1A2b_Ind-Comb-Non-ferrous-metals', '1A2c_Ind-Comb-Chemicals',
-                              '1A2d_Ind-Comb-Pulp-paper', '1A2e_Ind-Comb-Food-tobacco',
-                              '1A2f_Ind-Comb-Non-metalic-minerals', '1A2g_Ind-Comb-Construction',
-                              '1A2g_Ind-Comb-transpequip', '1A2g_Ind-Comb-machinery',
-                              '1A2g_Ind-Comb-mining-quarying', '1A2g_Ind-Comb-wood-products',
-                              '1A2g_Ind-Comb-textile-leather', '1A2g_Ind-Comb-other',
-                              '1A3ai_International-aviation', '1A3aii_Domestic-aviation',
-                              '1A3b_Road', '1A3c_Rail', '1A3di_International-shipping',
-                              '1A3dii_Domestic-navigation', '1A3eii_Other-transp',
-                              '1A4a_Commercial-institutional', '1A4b_Residential',
-                              '1A4c_Agriculture-forestry-fishing', '1A5_Other-unspecified']
-        combustion_df = self.all_factors.loc[self.all_factors['sector'].isin(combustion_sectors)].copy()
+        comb_mask = sectors.get_registry().comb_mask(self.all_factors['sector'])
+        combustion_df = self.all_factors.loc[comb_mask].copy()
         return combustion_df
         
     def _log_init(self):
@@ -360,19 +461,22 @@ class EmissionFactorFile:
         -------
         None.
         """
-        logger.debug('New EmissionFactorFile instance created for {}'.format(self.species))
-        logger.debug('    Parent file....{}'.format(self.path))
-        logger.debug('    Freeze year....{}'.format(self.freeze_year))
-        logger.debug('    Comb DF shape: {}'.format(self.get_comb_shape()))
-        logger.debug('    Comb Sectors...{}'.format(self.get_sectors()))
-        logger.debug('    Comb ISOs......{}'.format(self.get_isos()))
+        # The sectors & ISOs are only gathered if the records are emitted
+        logger.debug('New EmissionFactorFile instance created for %s', self.species)
+        logger.debug('    Parent file....%s', self.path)
+        logger.debug('    Freeze year....%s', self.freeze_year)
+        logger.debug('    Comb DF shape: %s', LazyStr(self.get_comb_shape))
+        logger.debug('    Comb Sectors...%s', LazyStr(self.get_sectors))
+        logger.debug('    Comb ISOs......%s', LazyStr(self.get_isos))
         
     def _write_diagnostics(self):
         """
         Write some diagnostics files.
         
         Currently writes a CSV file containing the sectors and ISOs that are
-        going to be frozen.
+        going to be frozen. Depending on the diagnostics policy, the file is
+        written immediately ('eager'), by write_deferred_diagnostics() at the
+        end of the run ('deferred'), or not at all ('off').
         
         Parameters
         ----------
@@ -388,14 +492,409 @@ class EmissionFactorFile:
             CSV file containing ISOs and their respective sectors that are going
             to be frozen.
         """
+        policy = get_diagnostics_policy()
+        if (policy == 'off'):
+            return
         diag_fname = '{}_frozen_isos_sectors.csv'.format(self.species)
-        out_dir = os.path.join(config.CONFIG.dirs['root'], 'src', 'diagnostics')
-        if not os.path.isdir(out_dir):
-            logger.debug('Creating diagnostic directory {}'.format(out_dir))
-            os.mkdir(out_dir)
-        diag_df = self.combustion_factors[['iso', 'sector', 'fuel']]
-        logger.debug('Writing diagnostics file {}'.format(diag_fname))
-        diag_df.to_csv(os.path.join(out_dir, diag_fname), sep=',', header=True, index=False)
+        diag_path = os.path.join(config.CONFIG.dirs['root'], 'src', 'diagnostics', diag_fname)
+        diag_source = self._get_diagnostics_source()
+        if (policy == 'deferred'):
+            # The columns are only sliced once the file is written
+            logger.debug('Deferring diagnostics file %s', diag_fname)
+            _DEFERRED_DIAGNOSTICS[diag_path] = diag_source
+        else:
+            _write_diagnostics_file(diag_path, diag_source)
+    
+    def _get_diagnostics_source(self):
+        """
+        Get references to the columns of the diagnostics file, without copying
+        them. The meta columns of the combustion EFs are never modified, so they
+        can be sliced when the file is written.
+        
+        Return
+        -------
+        tuple of (dict of {str : Pandas Series}, None)
+            Diagnostics columns of the combustion EFs, & the rows to take from
+            them (None, i.e. every row).
+        """
+        return ({col : self.combustion_factors[col] for col in DIAGNOSTICS_COLUMNS}, None)
 
     def __repr__(self):
         return "<EmissionFactorFile object - {} {}>".format(self.species, self.shape)
+
+
+class EmissionFactorArray(EmissionFactorFile):
+    """
+    Array-backed EmissionFactorFile.
+    
+    Rather than holding the EF file in a DataFrame & its combustion EFs in a
+    second DataFrame, the year columns of the EF file are held in a single
+    contiguous 2-D float array and the iso, sector, & fuel columns as integer
+    category codes. Combustion EFs are referenced by row index instead of being
+    copied, so freezing writes directly into the array and reconstruct_emissions()
+    has nothing left to do.
+    """
+    
+    def __init__(self, species, f_path, ef_df=None):
+        """
+        Constructor for an EmissionFactorArray instance.
+        
+        Parameters
+        -----------
+        species : str
+            Emission species represented in the EF file.
+        f_path : str
+            Path of the EF file.
+        ef_df : Pandas DataFrame, optional
+            Already-parsed contents of the EF file, which is left unmodified.
+            Default is None, in which case the EF file is parsed.
+            
+        Attributes
+        -----------
+        species : str
+            Name of the emission species represented in the EF file.
+        path : str  
+            Path of the EF file being processed.
+        meta : Pandas DataFrame
+            Categorical meta columns ('iso', 'sector', 'fuel', 'units') of the
+            EF file.
+        year_cols : list of str
+            Year column headers of the EF file (ex: 'X1970').
+        data : NumPy 2-D array of float
+            EF values, shape (rows, years).
+        codes : dict of {str : NumPy array of int}
+            Integer category codes of the 'iso', 'sector', & 'fuel' columns.
+        comb_rows : NumPy array of int
+            Row indices of the combustion-related EFs.
+        freeze_year : str
+            Year at which to freeze the EFs, formatted to match the format of 
+            the EF dataframe year column headers (ex: 'X1970').
+        """
+        self.species     = species
+        self.path        = f_path
+        self.freeze_year = 'X{}'.format(config.CONFIG.freeze_year)
+        if (ef_df is None):
+            ef_df = self._parse_file(f_path)
+        self.year_cols = [col for col in ef_df.columns if ceds_io.YEAR_COL_PATTERN.match(col)]
+        meta_cols = [col for col in ef_df.columns if col not in self.year_cols]
+        self.meta = ef_df[meta_cols].astype('category')
+        # Always copies, so a pre-parsed ef_df is never modified
+        self.data = np.array(ef_df[self.year_cols].to_numpy(), order='C')
+        del ef_df
+        self.codes = {col : self.meta[col].cat.codes.to_numpy() for col in ['iso', 'sector', 'fuel']}
+        self.comb_rows = self._get_comb_rows()
+        if (config.CONFIG.freeze_isos != 'all' and config.CONFIG.freeze_isos != ['all']):
+            self._filter_isos()
+        self._log_init()
+        self._write_diagnostics()
+    
+    @property
+    def all_factors(self):
+        """
+        Pandas DataFrame containing the entirety of the EF file, constructed
+        from the instance's meta columns & data array.
+        """
+        data_df = pd.DataFrame(self.data, columns=self.year_cols, index=self.meta.index)
+        return pd.concat([self.meta, data_df], axis=1)
+    
+    @property
+    def combustion_factors(self):
+        """
+        Pandas DataFrame containing a copy of the combustion-related EFs.
+        """
+        return self.get_comb_columns(list(self.meta.columns) + self.year_cols)
+    
+    def get_shape(self):
+        """
+        Get the shape of the EF file.
+        
+        Return
+        -------
+        tuple of int
+        """
+        return (self.data.shape[0], self.meta.shape[1] + self.data.shape[1])
+        
+    def get_comb_shape(self):
+        """
+        Get the shape of the combustion-related EFs.
+        
+        Return
+        -------
+        tuple of int
+        """
+        return (self.comb_rows.shape[0], self.meta.shape[1] + self.data.shape[1])
+    
+    def get_sectors(self, ef='comb'):
+        """
+        Get the sectors in the EF file.
+        
+        Parameters
+        -----------
+        ef : string
+            If 'all', all sectors will be returned. If 'comb', only combustion-related
+            sectors will be returned. Default is 'comb'
+        
+        Return
+        -------
+        List of str
+        """
+        return self._get_meta_values('sector', ef).unique().tolist()
+    
+    def get_fuels(self, ef='comb'):
+        """
+        Get the fuels 
+        
+        Parameters
+        -----------
+        ef : string
+            If 'all', all fuels will be returned. If 'comb', only combustion-related
+            fuels will be returned. Default is 'comb'
+        
+        Return
+        -------
+        List of str
+        """
+        return self._get_meta_values('fuel', ef).unique().tolist()
+    
+    def get_isos(self, ef='comb', unique=True):
+        """
+        Return a list of ISOs present in the EF file. See EmissionFactorFile.get_isos().
+        
+        Return
+        -------
+        list of str           
+        """
+        isos = self._get_meta_values('iso', ef)
+        if (unique):
+            return isos.unique().tolist()
+        return isos.tolist()
+    
+    def get_comb_columns(self, columns):
+        """
+        Return a subset of the columns of the instance's combustion EFs.
+        
+        Parameters
+        -----------
+        columns : list of str
+            Names of the meta and/or year columns to return (ex: ['sector', 'fuel', 'X1970']).
+        
+        Return
+        -------
+        Pandas DataFrame, indexed by the combustion row indices
+        """
+        comb_cols = {}
+        for col in columns:
+            if (col in self.meta.columns):
+                comb_cols[col] = self.meta[col].array.take(self.comb_rows)
+            else:
+                comb_cols[col] = self.data[self.comb_rows, self.year_cols.index(col)]
+        return pd.DataFrame(comb_cols, index=self.meta.index[self.comb_rows], columns=columns)
+    
+    def set_comb_values(self, year, mask, value):
+        """
+        Set the combustion EF values of a single year column for the rows
+        selected by a boolean mask.
+        
+        Parameters
+        -----------
+        year : str
+            Year column header (ex: 'X1970').
+        mask : Pandas Series or NumPy array of bool
+            Boolean mask aligned with the combustion rows.
+        value : float or array-like of float
+            Value(s) to set.
+        
+        Return
+        -------
+        None.
+        """
+        rows = self.comb_rows[np.asarray(mask, dtype=bool)]
+        self.data[rows, self.year_cols.index(year)] = value
+    
+    def freeze_emissions(self, year_strs, in_place=True):
+        """
+        Set all combustion-related emissions factors for years greater than the
+        freeze year equal to their value at the freeze year with a single
+        broadcast assignment.
+        
+        Parameters
+        -----------
+        year_strs : list of str
+            List of strings representing years >= the freeze year, in column header
+            format (ex: 'X1970').
+        in_place : bool, optional
+            Ignored; the EFs are always frozen in the instance's data array.
+            
+        Return
+        -------
+        None.
+        """
+        col_0 = self.year_cols.index(year_strs[0])
+        col_n = self.year_cols.index(year_strs[-1]) + 1
+        freeze_vals = self.data[self.comb_rows, col_0]
+        # Leave combustion EFs with a NaN freeze year value unchanged, matching
+        # EmissionFactorFile
+        valid = ~np.isnan(freeze_vals)
+        self.data[self.comb_rows[valid], col_0 + 1:col_n] = freeze_vals[valid, np.newaxis]
+    
+    def reconstruct_emissions(self):
+        """
+        Does nothing; the combustion EFs are frozen directly in the instance's
+        data array.
+        """
+        pass
+    
+    def _filter_isos(self):
+        """
+        Remove any ISOs from the combustion rows that are not meant to be frozen.
+        """
+        iso_list = config.CONFIG.freeze_isos
+        logger.debug("Filtering ISOs for {}".format(iso_list))
+        if (not isinstance(iso_list, list)):
+            iso_list = [iso_list]
+        iso_codes = self._get_codes('iso', iso_list)
+        self.comb_rows = self.comb_rows[np.isin(self.codes['iso'][self.comb_rows], iso_codes)]
+    
+    def _get_comb_rows(self):
+        """
+        Get the row indices of the combustion-related EFs.
+        
+        Return
+        -------
+        NumPy array of int
+        """
+        return np.flatnonzero(sectors.get_registry().comb_mask(self.meta['sector']))
+    
+    def _get_codes(self, col, values):
+        """
+        Get the integer category codes of a list of meta column values. Values
+        that aren't present in the column are ignored.
+        
+        Return
+        -------
+        NumPy array of int
+        """
+        categories = self.meta[col].cat.categories
+        return np.flatnonzero(categories.isin(values))
+    
+    def _get_meta_values(self, col, ef):
+        """
+        Get a meta column for either all rows (ef='all') or the combustion rows
+        (ef='comb').
+        
+        Return
+        -------
+        Pandas Series
+        """
+        if (ef != 'comb'):
+            return self.meta[col]
+        return self.meta[col].iloc[self.comb_rows]
+    
+    def _get_diagnostics_source(self):
+        """
+        Get references to the columns of the diagnostics file, without copying
+        them.
+        
+        Return
+        -------
+        tuple of (dict of {str : Pandas Series}, NumPy array of int)
+            Diagnostics columns of every row, & the combustion rows to take
+            from them.
+        """
+        return ({col : self.meta[col] for col in DIAGNOSTICS_COLUMNS}, self.comb_rows)
+    
+    def __repr__(self):
+        return "<EmissionFactorArray object - {} {}>".format(self.species, self.get_shape())
+
+
+def init_ef_obj(species, f_path, ef_df=None):
+    """
+    Create a new EF object for a species using the EF backend specified by the
+    global CONFIG object.
+    
+    Parameters
+    -----------
+    species : str
+        Emission species represented in the EF file.
+    f_path : str
+        Path of the EF file.
+    ef_df : Pandas DataFrame, optional
+        Already-parsed contents of the EF file. Default is None.
+    
+    Return
+    -------
+    EmissionFactorFile (backend 'dataframe') or EmissionFactorArray (backend 'array')
+    """
+    if (config.CONFIG.freeze_backend == 'array'):
+        return EmissionFactorArray(species, f_path, ef_df=ef_df)
+    return EmissionFactorFile(species, f_path, ef_df=ef_df)
+
+
+def get_diagnostics_policy():
+    """
+    Get the diagnostics policy from the global CONFIG object.
+    
+    Return
+    -------
+    str : 'off', 'deferred', or 'eager'
+    
+    Raises
+    -------
+    ValueError if the policy is not one of DIAGNOSTICS_POLICIES
+    """
+    policy = config.CONFIG.diagnostics['policy']
+    if (policy not in DIAGNOSTICS_POLICIES):
+        raise ValueError('Invalid diagnostics policy {}. Valid policies: {}'.format(
+            policy, ', '.join(DIAGNOSTICS_POLICIES)))
+    return policy
+
+
+def _write_diagnostics_file(diag_path, diag_source):
+    """
+    Write a diagnostics file, creating its directory if needed.
+    
+    Parameters
+    -----------
+    diag_path : str
+        Path of the diagnostics file.
+    diag_source : tuple of (dict of {str : Pandas Series}, NumPy array of int or None)
+        Columns of the diagnostics file & the rows to take from them, see
+        EmissionFactorFile._get_diagnostics_source().
+    
+    Return
+    -------
+    None
+    """
+    columns, rows = diag_source
+    if (rows is not None):
+        columns = {col : values.array.take(rows) for col, values in columns.items()}
+    diag_df = pd.DataFrame(columns, columns=DIAGNOSTICS_COLUMNS)
+    out_dir = os.path.dirname(diag_path)
+    if not os.path.isdir(out_dir):
+        logger.debug('Creating diagnostic directory %s', out_dir)
+        os.makedirs(out_dir, exist_ok=True)
+    logger.debug('Writing diagnostics file %s', os.path.basename(diag_path))
+    diag_df.to_csv(diag_path, sep=',', header=True, index=False)
+
+
+def write_deferred_diagnostics():
+    """
+    Write the diagnostics files deferred by EF objects created under the
+    'deferred' diagnostics policy, then forget them.
+    
+    Return
+    -------
+    int : Number of files written
+    """
+    n_files = len(_DEFERRED_DIAGNOSTICS)
+    while (_DEFERRED_DIAGNOSTICS):
+        diag_path = next(iter(_DEFERRED_DIAGNOSTICS))
+        _write_diagnostics_file(diag_path, _DEFERRED_DIAGNOSTICS.pop(diag_path))
+    return n_files
+
+
+def clear_deferred_diagnostics():
+    """
+    Forget the deferred diagnostics files without writing them.
+    """
+    _DEFERRED_DIAGNOSTICS.clear()
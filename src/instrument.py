@@ -0,0 +1,233 @@
+"""
+Per-stage timing & memory instrumentation of the frozen emissions functions
+
+Stages are timed with the stage() context manager or the timed() decorator.
+Each completed stage is recorded with its species & its wall & CPU time. Its
+memory use is recorded as the resident set size (RSS) of the process at the
+end of the stage, the change of the RSS during the stage, and the RSS
+high-water mark of the process so far. If tracemalloc is enabled, the peak
+memory allocated by Python during the stage is also recorded. write_report()
+writes the records to JSON & CSV files in /output/diagnostic.
+"""
+import contextlib
+import csv
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import config
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logger = logging.getLogger('main')
+
+# Fields of each stage record, in report column order
+REPORT_FIELDS = ['species', 'stage', 'start_s', 'wall_s', 'cpu_s', 'rss_mb', 'rss_delta_mb',
+                 'max_rss_mb', 'traced_peak_mb']
+
+# Completed stage records of the current run
+_RECORDS = []
+
+# Start time of the current run
+_RUN_START = time.time()
+
+
+def get_options():
+    """
+    Get the instrumentation options from the global CONFIG object.
+
+    Return
+    -------
+    dict with keys 'enabled' & 'tracemalloc'
+    """
+    if (config.CONFIG is None):
+        return {'enabled' : False, 'tracemalloc' : False}
+    return config.CONFIG.instrument
+
+
+def get_rss():
+    """
+    Get the current resident set size of the process.
+
+    Return
+    -------
+    float : RSS in MB, or None if it is not available on this platform
+    """
+    try:
+        with open('/proc/self/statm', 'r') as fh:
+            pages = int(fh.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        # Only available on Linux
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def get_max_rss():
+    """
+    Get the resident set size high-water mark of the process, i.e. the largest
+    RSS since the process started rather than during a single stage.
+
+    Return
+    -------
+    float : Maximum RSS in MB, or None if it is not available on this platform
+    """
+    if (resource is None):
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS & kilobytes elsewhere
+    if (sys.platform == 'darwin'):
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+@contextlib.contextmanager
+def stage(name, species=None):
+    """
+    Time a stage of processing a species & record it.
+
+    Parameters
+    -----------
+    name : str
+        Stage name, i.e. 'read_ef' or 'freeze'
+    species : str, optional
+        Species being processed. Default is None
+
+    Yields
+    ------
+    None
+    """
+    options = get_options()
+    if (not options['enabled']):
+        yield
+        return
+    trace = options['tracemalloc']
+    if (trace):
+        if (not tracemalloc.is_tracing()):
+            tracemalloc.start()
+        elif (hasattr(tracemalloc, 'reset_peak')):
+            tracemalloc.reset_peak()
+    rss_start = get_rss()
+    start = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        record = {'species'        : species,
+                  'stage'          : name,
+                  'start_s'        : round(start - _RUN_START, 3),
+                  'wall_s'         : round(time.perf_counter() - wall_start, 4),
+                  'cpu_s'          : round(time.process_time() - cpu_start, 4),
+                  'rss_mb'         : get_rss(),
+                  'rss_delta_mb'   : None,
+                  'max_rss_mb'     : get_max_rss(),
+                  'traced_peak_mb' : None}
+        if (rss_start is not None and record['rss_mb'] is not None):
+            record['rss_delta_mb'] = record['rss_mb'] - rss_start
+        if (trace):
+            record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        _RECORDS.append(record)
+        logger.debug('Stage {} of {} took {}s'.format(name, species, record['wall_s']))
+
+
+def timed(name):
+    """
+    Decorator recording each call of a function taking a species as its first
+    argument as a stage, see stage().
+
+    Parameters
+    -----------
+    name : str
+        Stage name
+
+    Return
+    -------
+    Decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(species, *args, **kwargs):
+            with stage(name, species=species):
+                return func(species, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_records():
+    """
+    Get the stage records of the current run.
+
+    Return
+    -------
+    list of dict
+    """
+    return list(_RECORDS)
+
+
+def add_records(records):
+    """
+    Add stage records, i.e. those returned by a worker process.
+
+    Parameters
+    -----------
+    records : list of dict
+        Stage records, see get_records()
+
+    Return
+    -------
+    None
+    """
+    _RECORDS.extend(records)
+
+
+def clear_records():
+    """
+    Remove all stage records & restart the run clock.
+    """
+    global _RUN_START
+    del _RECORDS[:]
+    _RUN_START = time.time()
+
+
+def write_report(out_dir, f_base=None):
+    """
+    Write the stage records of the current run to a JSON & a CSV file.
+
+    Parameters
+    -----------
+    out_dir : str
+        Output directory, i.e. /output/diagnostic
+    f_base : str, optional
+        Base name of the report files. Default is None, in which case
+        'stages-<run start time>' is used
+
+    Return
+    -------
+    list of str : Paths of the report files, empty if there are no records
+    """
+    if (not _RECORDS):
+        return []
+    if (f_base is None):
+        f_base = 'stages-{}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(_RUN_START)))
+    if (not os.path.isdir(out_dir)):
+        os.makedirs(out_dir, exist_ok=True)
+    json_path = os.path.join(out_dir, f_base + '.json')
+    csv_path = os.path.join(out_dir, f_base + '.csv')
+    info = {'config' : config.CONFIG.init_file if config.CONFIG else None,
+            'stages' : _RECORDS}
+    with open(json_path, 'w') as fh:
+        json.dump(info, fh, indent=2)
+    with open(csv_path, 'w', newline='') as fh:
+        writer = csv.DictWriter(fh, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(_RECORDS)
+    logger.info('Wrote stage report {}'.format(csv_path))
+    return [json_path, csv_path]
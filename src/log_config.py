@@ -1,6 +1,12 @@
 """
 Logging functions for frozen-emission scripts
 
+QueueLogging is the logging backend of driver.main(). Records are put on a
+queue by the logger & written on a background thread to the main log file, a
+log file per species, & a rate-limited console progress display. Records of
+worker processes are forwarded to it through a multiprocessing queue, see
+worker_queue() & init_worker_logger().
+
 Usage
 ------
 python main.py /path/to/config.yml
@@ -8,8 +14,58 @@ python main.py /path/to/config.yml
 Matt Nicholson
 7 Feb 2020
 """
+import atexit
+import contextlib
 import logging
+import logging.handlers
+import multiprocessing
 import os
+import queue
+import sys
+import threading
+
+LOG_LEVELS = {'debug'    : logging.DEBUG,
+              'info'     : logging.INFO,
+              'warn'     : logging.WARNING,
+              'error'    : logging.ERROR,
+              'critical' : logging.CRITICAL}
+
+LOG_FORMAT = "%(asctime)s %(levelname)6s: %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 'extra' of the records shown on the console progress display, i.e.
+# logger.info('Writing {}'.format(f_out), extra=log_config.PROGRESS)
+PROGRESS = {'progress' : True}
+
+# Minimum number of seconds between the progress records shown on the console
+PROGRESS_INTERVAL = 0.5
+
+# Species being processed by each thread, see species_context()
+_CONTEXT = threading.local()
+
+class LazyStr:
+    """
+    Log record argument whose value is only computed when the record is
+    formatted, i.e. logger.debug('Sectors: %s', LazyStr(ef_obj.get_sectors))
+    doesn't call get_sectors() unless debug records are emitted.
+    """
+    __slots__ = ('func', 'args')
+    
+    def __init__(self, func, *args):
+        """
+        Parameters
+        -----------
+        func : callable
+            Function returning the value to format
+        *args
+            Positional arguments of 'func'
+        """
+        self.func = func
+        self.args = args
+    
+    def __str__(self):
+        return str(self.func(*self.args))
+
 
 def nuke_logs(log_dir, target=None):
     """
@@ -36,6 +92,285 @@ def nuke_logs(log_dir, target=None):
             pass
 
 
+@contextlib.contextmanager
+def species_context(species):
+    """
+    Context manager that tags the records logged by the current thread with a
+    species, which QueueLogging uses to route them to the species' log file.
+    
+    Parameters
+    -----------
+    species : str
+        Emission species
+    """
+    previous = getattr(_CONTEXT, 'species', None)
+    _CONTEXT.species = species
+    try:
+        yield
+    finally:
+        _CONTEXT.species = previous
+
+
+def get_species_context():
+    """
+    Return
+    -------
+    str : Species being processed by the current thread, or None
+    """
+    return getattr(_CONTEXT, 'species', None)
+
+
+class SpeciesFilter(logging.Filter):
+    """
+    Tag each record with the species being processed by the thread that logged
+    it, see species_context(). Records already tagged, i.e. by a worker
+    process, are left unchanged.
+    """
+    
+    def filter(self, record):
+        if (not hasattr(record, 'species')):
+            record.species = get_species_context()
+        return True
+
+
+class SpeciesRouter(logging.Handler):
+    """
+    Write the records tagged with a species to the species' own log file,
+    <log_dir>/<log_name>-<species>.log, which is created on the species' first
+    record. Untagged records are ignored.
+    """
+    
+    def __init__(self, log_dir, log_name, formatter):
+        """
+        Parameters
+        -----------
+        log_dir : str
+            Path to the log directory
+        log_name : str
+            Prefix of the log file names
+        formatter : logging.Formatter
+        """
+        super().__init__()
+        self.log_dir = log_dir
+        self.log_name = log_name
+        self.setFormatter(formatter)
+        self._handlers = {}
+    
+    def emit(self, record):
+        species = getattr(record, 'species', None)
+        if (species is None):
+            return
+        handler = self._handlers.get(species, None)
+        if (handler is None):
+            f_name = '{}-{}.log'.format(self.log_name, species)
+            nuke_logs(self.log_dir, target=f_name)
+            handler = logging.FileHandler(os.path.join(self.log_dir, f_name))
+            handler.setFormatter(self.formatter)
+            self._handlers[species] = handler
+        handler.handle(record)
+    
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+        self._handlers = {}
+        super().close()
+
+
+class ProgressFilter(logging.Filter):
+    """
+    Rate-limit the console: warnings & errors are always shown, progress
+    records (see PROGRESS) at most once every 'min_interval' seconds, and
+    every other record is dropped.
+    """
+    
+    def __init__(self, min_interval=PROGRESS_INTERVAL):
+        """
+        Parameters
+        -----------
+        min_interval : float, optional
+            Minimum number of seconds between progress records. Default is
+            PROGRESS_INTERVAL
+        """
+        super().__init__()
+        self.min_interval = min_interval
+        self._last = None
+    
+    def filter(self, record):
+        if (record.levelno >= logging.WARNING):
+            return True
+        if (not getattr(record, 'progress', False)):
+            return False
+        if (self._last is not None and record.created - self._last < self.min_interval):
+            return False
+        self._last = record.created
+        return True
+
+
+class QueueLogging:
+    """
+    Queue-based logging backend. The logger only puts its records on a queue;
+    a QueueListener thread formats them & writes them to
+        * the main log file, <log_dir>/<log_name>.log
+        * a log file per species (optional), see SpeciesRouter
+        * the console (optional), showing only a rate-limited progress
+          display & warnings, see ProgressFilter
+    Messages are interpolated by the thread that logs them, so that mutable
+    arguments are captured when they're logged, but formatting the log lines
+    & all file & console I/O is done by the listener thread.
+    """
+    
+    def __init__(self, log_dir, log_name='main', level='debug', species_logs=True,
+                 console=True, progress_interval=PROGRESS_INTERVAL):
+        """
+        Parameters
+        -----------
+        log_dir : str
+            Path to the log directory
+        log_name : str, optional
+            Name of the logger object & main log file. Default is 'main'
+        level : str, optional
+            Logging level. Default is 'debug'
+        species_logs : bool, optional
+            Whether or not to also write a log file per species. Default is True
+        console : bool, optional
+            Whether or not to show progress & warnings on the console. Default
+            is True
+        progress_interval : float, optional
+            Minimum number of seconds between progress records on the console.
+            Default is PROGRESS_INTERVAL
+        """
+        if (not os.path.isdir(log_dir)):
+            os.makedirs(log_dir)
+        nuke_logs(log_dir, target=log_name)
+        formatter = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+        file_handler = logging.FileHandler(os.path.join(log_dir, '{}.log'.format(log_name)))
+        file_handler.setFormatter(formatter)
+        self.handlers = [file_handler]
+        if (species_logs):
+            self.handlers.append(SpeciesRouter(log_dir, log_name, formatter))
+        if (console):
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(logging.Formatter('%(message)s'))
+            console_handler.addFilter(ProgressFilter(progress_interval))
+            self.handlers.append(console_handler)
+        
+        self.queue = queue.Queue(-1)
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers,
+                                                       respect_handler_level=True)
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.queue_handler.addFilter(SpeciesFilter())
+        self.logger = logging.getLogger(log_name)
+        _remove_handlers(self.logger)
+        self.logger.setLevel(LOG_LEVELS[level])
+        self.logger.addHandler(self.queue_handler)
+        self.listener.start()
+        self._running = True
+        # Write the queued records even if the run raises
+        atexit.register(self.stop)
+        self.logger.info("Log created!\n")
+    
+    def stop(self):
+        """
+        Write every queued record, then close the log files. The logger is
+        left without handlers.
+        """
+        if (not self._running):
+            return
+        self._running = False
+        self.listener.stop()
+        self.logger.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            handler.close()
+        atexit.unregister(self.stop)
+    
+    def __enter__(self):
+        return self.logger
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+    
+    def __repr__(self):
+        return "<QueueLogging object {}>".format(self.logger.name)
+
+
+class _LoggerHandler(logging.Handler):
+    """
+    Hand records to the handlers of a logger, i.e. records forwarded from a
+    worker process.
+    """
+    
+    def __init__(self, logger):
+        super().__init__()
+        self.logger = logger
+    
+    def emit(self, record):
+        self.logger.handle(record)
+
+
+@contextlib.contextmanager
+def worker_queue(log_name='main'):
+    """
+    Context manager that forwards the records of worker processes to a logger
+    of this process. Yields a multiprocessing queue to pass to
+    init_worker_logger() in each worker. Worker processes should exit before
+    the context does, so that their queued records are flushed.
+    
+    Parameters
+    -----------
+    log_name : str, optional
+        Name of the logger the records are forwarded to. Default is 'main'
+    
+    Yields
+    -------
+    multiprocessing.Queue
+    """
+    log_queue = multiprocessing.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue,
+                                              _LoggerHandler(logging.getLogger(log_name)))
+    listener.start()
+    try:
+        yield log_queue
+    finally:
+        listener.stop()
+        log_queue.close()
+
+
+def init_worker_logger(log_queue, log_name='main', level='debug'):
+    """
+    Initialize the logger of a worker process to put its records on a queue
+    of the parent process, see worker_queue().
+    
+    Parameters
+    -----------
+    log_queue : multiprocessing.Queue
+    log_name : str, optional
+        Name of the logger object. Default is 'main'
+    level : str, optional
+        Logging level. Default is 'debug'.
+    
+    Return
+    -------
+    logger : logging.Logger object
+    """
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(SpeciesFilter())
+    logger = logging.getLogger(log_name)
+    _remove_handlers(logger)
+    logger.setLevel(LOG_LEVELS[level])
+    logger.addHandler(handler)
+    return logger
+
+
+def _remove_handlers(logger):
+    """
+    Remove & close the handlers of a logger, i.e. those left over from a
+    previous initialization.
+    """
+    for old_handler in logger.handlers[:]:
+        logger.removeHandler(old_handler)
+        old_handler.close()
+
+
 def init_logger(log_dir, log_name, level='debug'):
     """
     Initialize a new logger
@@ -53,13 +388,6 @@ def init_logger(log_dir, log_name, level='debug'):
     -------
     logger : logging.Logger object
     """
-    log_levels = {'debug': logging.DEBUG,
-                  'info' : logging.INFO,
-                  'warn' : logging.WARNING,
-                  'error': logging.ERROR,
-                  'critical': logging.CRITICAL
-                  }
-    
     nuke_logs(log_dir, target=log_name)
     
     if (not os.path.isdir(log_dir)):
@@ -67,16 +395,19 @@ def init_logger(log_dir, log_name, level='debug'):
     
     if (not log_name.endswith('.log')):
         f_name = '{}.log'.format(log_name)
+    else:
+        f_name = log_name
     log_path = os.path.join(log_dir, f_name)
     
-    log_format = logging.Formatter("%(asctime)s %(levelname)6s: %(message)s", "%Y-%m-%d %H:%M:%S")
+    log_format = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
     
     handler = logging.FileHandler(log_path)
     handler.setFormatter(log_format)
         
     logger = logging.getLogger(log_name)
-    logger.setLevel(log_levels[level])
+    _remove_handlers(logger)
+    logger.setLevel(LOG_LEVELS[level])
     logger.addHandler(handler)
     logger.info("Log created!\n")
     
-    return logger
\ No newline at end of file
+    return logger
@@ -0,0 +1,234 @@
+"""
+Build manifest used to skip species whose CMIP6 input files, configuration, &
+output files are unchanged since they were last processed
+
+Each species' manifest is a small JSON file in /output/manifest recording the
+size, modification time, & SHA-1 hash of the species' input & output files as
+well as a fingerprint of the config values that affect its output.
+"""
+import hashlib
+import json
+import logging
+import os
+from os.path import isfile, join
+
+import config
+
+logger = logging.getLogger('main')
+
+# Name of the manifest sub-directory of the output directory
+MANIFEST_DIR = 'manifest'
+
+# Format version of the manifest files. Manifests of any other version are stale
+MANIFEST_VERSION = 1
+
+# File hashes keyed by (path, size, mtime_ns) so that a file is hashed at most
+# once per process
+_HASH_CACHE = {}
+
+
+def hash_file(abs_path, block_size=1 << 20):
+    """
+    Get the SHA-1 hash of a file.
+
+    Parameters
+    -----------
+    abs_path : str
+        Absolute path of the file
+    block_size : int, optional
+        Number of bytes to read at a time. Default is 1 MiB
+
+    Returns
+    -------
+    str : Hex digest of the file's SHA-1 hash
+    """
+    f_stat = os.stat(abs_path)
+    key = (abs_path, f_stat.st_size, f_stat.st_mtime_ns)
+    if (key not in _HASH_CACHE):
+        sha = hashlib.sha1()
+        with open(abs_path, 'rb') as fh:
+            for block in iter(lambda: fh.read(block_size), b''):
+                sha.update(block)
+        _HASH_CACHE[key] = sha.hexdigest()
+    return _HASH_CACHE[key]
+
+
+def get_file_state(abs_path, prev_state=None):
+    """
+    Get the size, modification time, & SHA-1 hash of a file. If the size &
+    modification time match those of 'prev_state', its hash is re-used rather
+    than re-reading the file.
+
+    Parameters
+    -----------
+    abs_path : str
+        Absolute path of the file
+    prev_state : dict, optional
+        Previously recorded state of the file. Default is None
+
+    Returns
+    -------
+    dict with keys 'size', 'mtime_ns', & 'sha1'
+    """
+    f_stat = os.stat(abs_path)
+    state = {'size' : f_stat.st_size, 'mtime_ns' : f_stat.st_mtime_ns}
+    if (prev_state and prev_state.get('size') == state['size'] and
+            prev_state.get('mtime_ns') == state['mtime_ns']):
+        state['sha1'] = prev_state['sha1']
+    else:
+        state['sha1'] = hash_file(abs_path)
+    return state
+
+
+def get_config_fingerprint(species, write_efs=False):
+    """
+    Get a fingerprint of the global CONFIG values that affect a species' output.
+
+    Parameters
+    -----------
+    species : str
+        Emission species
+    write_efs : bool, optional
+        Whether or not the frozen emissions factors file is written. Default is False
+
+    Returns
+    -------
+    str : Hex digest of the SHA-1 hash of the config values
+    """
+    info = {'species'    : species,
+            'freeze_year': config.CONFIG.freeze_year,
+            'freeze_isos': config.CONFIG.freeze_isos,
+            'year_first' : config.CONFIG.ceds_meta['year_first'],
+            'year_last'  : config.CONFIG.ceds_meta['year_last'],
+            'dtype'      : config.CONFIG.ceds_meta.get('dtype', 'float64'),
+            'backend'    : config.CONFIG.freeze_backend,
+            'outliers'   : config.CONFIG.outliers,
+            'correction' : config.CONFIG.corrections.get(species, None),
+            'injected'   : config.CONFIG.injected_rows,
+            'precision'  : config.CONFIG.output['precision'],
+            'compression': config.CONFIG.output['compression'],
+            'write_efs'  : write_efs}
+    info_str = json.dumps(info, sort_keys=True)
+    return hashlib.sha1(info_str.encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    """
+    Build manifest of a single species in a single output directory
+    """
+
+    def __init__(self, species, dir_output, inputs, outputs, fingerprint):
+        """
+        Parameters
+        -----------
+        species : str
+            Emission species
+        dir_output : str
+            Path of the output directory holding the species' output files
+        inputs : list of str
+            Absolute paths of the species' input files
+        outputs : list of str
+            Absolute paths of the species' output files
+        fingerprint : str
+            Config fingerprint, see get_config_fingerprint()
+        """
+        self.species     = species
+        self.path        = join(dir_output, MANIFEST_DIR, '{}.json'.format(species))
+        self.inputs      = [os.path.abspath(f) for f in inputs]
+        self.outputs     = [os.path.abspath(f) for f in outputs]
+        self.fingerprint = fingerprint
+        self.entry       = self._read()
+
+    def _read(self):
+        """
+        Read the species' manifest file.
+
+        Return
+        -------
+        dict, or None if the manifest does not exist or could not be read
+        """
+        if (not isfile(self.path)):
+            return None
+        try:
+            with open(self.path, 'r') as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError) as err:
+            logger.warning('Unable to read manifest {}: {}'.format(self.path, err))
+            return None
+        if (entry.get('version') != MANIFEST_VERSION):
+            return None
+        return entry
+
+    def _files_current(self, paths, recorded):
+        """
+        Determine whether a list of files matches its recorded states.
+
+        Params
+        -------
+        paths : list of str
+            Absolute paths of the files
+        recorded : dict
+            Recorded file states keyed by path
+
+        Return
+        -------
+        bool
+        """
+        if (sorted(paths) != sorted(recorded.keys())):
+            return False
+        for f_path in paths:
+            if (not isfile(f_path)):
+                logger.debug('{} does not exist'.format(f_path))
+                return False
+            state = get_file_state(f_path, prev_state=recorded[f_path])
+            if (state['sha1'] != recorded[f_path]['sha1']):
+                logger.debug('{} has changed'.format(f_path))
+                return False
+        return True
+
+    def is_current(self):
+        """
+        Determine whether the species' outputs are up to date, i.e., its input
+        files & config fingerprint are unchanged and its output files have not
+        been modified since the manifest was written.
+
+        Return
+        -------
+        bool
+        """
+        if (self.entry is None):
+            logger.debug('No manifest found for {}'.format(self.species))
+            return False
+        if (self.entry['fingerprint'] != self.fingerprint):
+            logger.debug('Config fingerprint of {} has changed'.format(self.species))
+            return False
+        return (self._files_current(self.inputs, self.entry['inputs']) and
+                self._files_current(self.outputs, self.entry['outputs']))
+
+    def update(self):
+        """
+        Record the current state of the species' input & output files and write
+        the manifest file.
+
+        Return
+        -------
+        None
+        """
+        prev_inputs = self.entry['inputs'] if self.entry else {}
+        self.entry = {'version'     : MANIFEST_VERSION,
+                      'species'     : self.species,
+                      'fingerprint' : self.fingerprint,
+                      'inputs'      : {f : get_file_state(f, prev_inputs.get(f))
+                                       for f in self.inputs},
+                      'outputs'     : {f : get_file_state(f) for f in self.outputs}}
+        manifest_dir = os.path.dirname(self.path)
+        if (not os.path.isdir(manifest_dir)):
+            os.makedirs(manifest_dir, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as fh:
+            json.dump(self.entry, fh, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        logger.debug('Wrote manifest {}'.format(self.path))
+
+    def __repr__(self):
+        return "<BuildManifest object {}>".format(self.path)
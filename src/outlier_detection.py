@@ -0,0 +1,603 @@
+"""
+Pluggable outlier detectors for the freeze year EFs of every combustion sector
+& fuel group, & strategies for replacing the outliers
+
+EFGroups factorizes the (sector, fuel) groups of an EF object once and
+precomputes each group's size, moments, sort order, & quantiles, which are
+shared by every detector. Detectors are functions registered in DETECTORS
+under a method name; each takes an EFGroups instance & keyword parameters and
+returns a boolean outlier mask over all groups at once. The method & its
+parameters are selected by the 'outliers' section of the config file.
+
+Methods
+-------
+zscore
+    |z-score| > thresh (default 3), using the population standard deviation.
+iqr
+    Outside [Q1 - outlier_const * IQR, Q3 + outlier_const * IQR]
+    (default outlier_const 1.5).
+mad
+    |modified z-score| = 0.6745 * |x - median| / MAD > thresh (default 3.5).
+boxcox_zscore
+    z-score > thresh (default 3) of the Box-Cox transformed EFs of each group.
+
+Groups containing NaN values and groups that are all zeros produce no
+outliers for every method.
+
+Replacement strategies
+----------------------
+global_median
+    Median of the freeze year EFs of every combustion row.
+sector_fuel_median
+    Median of the outlier's sector & fuel group.
+region_median
+    Median of the outlier's sector & fuel group within its region, from
+    input/ceds_isos.csv. Falls back to the sector & fuel median for ISOs
+    without a region and regional groups of fewer than MIN_REGION_GROUP_SIZE EFs.
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+import z_stats
+
+logger = logging.getLogger('main')
+
+# Outlier detection method used if the config file does not select one
+DEFAULT_METHOD = 'zscore'
+
+# Outlier replacement strategy used if the config file does not select one
+DEFAULT_REPLACEMENT = 'global_median'
+
+# ISO to region mapping file in the input directory, see get_iso_regions()
+ISO_REGIONS_FILE = 'ceds_isos.csv'
+
+# Minimum number of EFs of a regional sector & fuel group whose median
+# replaces outliers, see replace_region_median()
+MIN_REGION_GROUP_SIZE = 3
+
+# Detector functions keyed by method name, see register_detector()
+DETECTORS = {}
+
+# Replacement strategy functions keyed by name, see register_replacement()
+REPLACEMENTS = {}
+
+# Region of each ISO keyed by mapping file path, see get_iso_regions()
+_ISO_REGIONS = {}
+
+
+class EFGroups:
+    """
+    Freeze year EFs of the combustion rows of an EF object, factorized by
+    (sector, fuel) group, with per-group statistics computed once & cached
+    """
+
+    def __init__(self, sectors, fuels, values, index=None, isos=None):
+        """
+        Parameters
+        -----------
+        sectors : array-like of str
+            Sector of each row
+        fuels : array-like of str
+            Fuel of each row
+        values : array-like of float
+            EF of each row
+        index : Pandas Index, optional
+            Index of the rows, used for the returned outlier masks. Default is
+            None, i.e. a RangeIndex
+        isos : array-like of str, optional
+            ISO of each row, needed by the 'region_median' replacement
+            strategy. Default is None
+
+        Attributes
+        -----------
+        values : NumPy array of float64
+        codes : NumPy array of int
+            Group code of each row
+        counts : NumPy array of int
+            Number of rows of each group
+        order : NumPy array of int
+            Row positions sorted by group, then value
+        starts : NumPy array of int
+            Position of each group's first row in 'order'
+        valid : NumPy array of bool
+            Whether or not each group may have outliers, i.e. has no NaN
+            values & is not all zeros
+        """
+        self.values = np.asarray(values, dtype=np.float64)
+        self.index = index if index is not None else pd.RangeIndex(self.values.size)
+        self.isos = np.asarray(isos, dtype=object) if isos is not None else None
+        sector_codes, _ = pd.factorize(np.asarray(sectors, dtype=object))
+        self._init_groups(_combine_codes(sector_codes, np.asarray(fuels, dtype=object)))
+
+    def _init_groups(self, codes):
+        """
+        Compute the group sizes, sort order, & validity of a set of group codes.
+
+        Parameters
+        -----------
+        codes : NumPy array of int
+            Group code of each row, numbered from 0 in order of appearance
+        """
+        self.codes = codes
+        self.n_groups = int(self.codes.max()) + 1 if self.codes.size else 0
+        self.counts = np.bincount(self.codes, minlength=self.n_groups)
+        self.order = np.lexsort((self.values, self.codes))
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1])).astype(np.intp)
+        has_nan = np.bincount(self.codes, weights=np.isnan(self.values),
+                              minlength=self.n_groups) > 0
+        n_zero = np.bincount(self.codes, weights=self.values == 0.0, minlength=self.n_groups)
+        self.valid = ~has_nan & (n_zero < self.counts)
+        self._cache = {}
+
+    @classmethod
+    def from_ef_obj(cls, ef_obj):
+        """
+        Create an EFGroups instance from the freeze year combustion EFs of an
+        EmissionFactorFile or EmissionFactorArray.
+
+        Parameters
+        -----------
+        ef_obj : EmissionFactorFile or EmissionFactorArray
+
+        Return
+        -------
+        EFGroups
+        """
+        comb_df = ef_obj.get_comb_columns(['iso', 'sector', 'fuel', ef_obj.freeze_year])
+        return cls(comb_df['sector'].to_numpy(), comb_df['fuel'].to_numpy(),
+                   comb_df[ef_obj.freeze_year].to_numpy(), index=comb_df.index,
+                   isos=comb_df['iso'].to_numpy())
+
+    def with_values(self, values):
+        """
+        Create an EFGroups instance with the same rows & groups but different
+        values, re-using the group codes.
+
+        Parameters
+        -----------
+        values : array-like of float
+            New value of each row
+
+        Return
+        -------
+        EFGroups
+        """
+        groups = EFGroups.__new__(EFGroups)
+        groups.values = np.asarray(values, dtype=np.float64)
+        groups.index = self.index
+        groups.isos = self.isos
+        groups._init_groups(self.codes)
+        return groups
+
+    def subgroups(self, keys):
+        """
+        Create an EFGroups instance with the same rows & values whose groups
+        are split further by another key, i.e. the region of each row.
+
+        Parameters
+        -----------
+        keys : array-like of str
+            Key of each row
+
+        Return
+        -------
+        EFGroups
+        """
+        groups = EFGroups.__new__(EFGroups)
+        groups.values = self.values
+        groups.index = self.index
+        groups.isos = self.isos
+        groups._init_groups(_combine_codes(self.codes, np.asarray(keys, dtype=object)))
+        return groups
+
+    def _group_sum(self, values):
+        return np.bincount(self.codes, weights=values, minlength=self.n_groups)
+
+    @property
+    def mean(self):
+        """Mean of each group"""
+        if ('mean' not in self._cache):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._cache['mean'] = self._group_sum(self.values) / self.counts
+        return self._cache['mean']
+
+    @property
+    def deviation(self):
+        """Deviation of each row from the mean of its group"""
+        if ('deviation' not in self._cache):
+            self._cache['deviation'] = self.values - self.mean[self.codes]
+        return self._cache['deviation']
+
+    @property
+    def std(self):
+        """Population (ddof=0) standard deviation of each group"""
+        if ('std' not in self._cache):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._cache['std'] = np.sqrt(self._group_sum(self.deviation ** 2) / self.counts)
+        return self._cache['std']
+
+    def quantile(self, q):
+        """
+        Get a quantile of each group, linearly interpolated like numpy.percentile().
+
+        Parameters
+        -----------
+        q : float
+            Quantile, between 0 & 1
+
+        Return
+        -------
+        NumPy array of float, one value per group
+        """
+        key = ('quantile', q)
+        if (key not in self._cache):
+            if ('sorted' not in self._cache):
+                self._cache['sorted'] = self.values[self.order]
+            self._cache[key] = _sorted_quantile(self._cache['sorted'], self.starts,
+                                                self.counts, q)
+        return self._cache[key]
+
+    @property
+    def median(self):
+        """Median of each group"""
+        return self.quantile(0.5)
+
+    @property
+    def mad(self):
+        """Median absolute deviation from the median of each group"""
+        if ('mad' not in self._cache):
+            abs_dev = np.abs(self.values - self.median[self.codes])
+            order = np.lexsort((abs_dev, self.codes))
+            self._cache['mad'] = _sorted_quantile(abs_dev[order], self.starts, self.counts, 0.5)
+        return self._cache['mad']
+
+    def iter_groups(self):
+        """
+        Iterate over the row positions of each valid group.
+
+        Yields
+        ------
+        tuple of (int, NumPy array of int) : Group code & row positions, in
+                                             ascending order of value
+        """
+        for code in np.flatnonzero(self.valid):
+            start = self.starts[code]
+            yield code, self.order[start:start + self.counts[code]]
+
+    def __repr__(self):
+        return "<EFGroups object: {} rows, {} groups>".format(self.values.size, self.n_groups)
+
+
+def _combine_codes(codes, keys):
+    """
+    Combine group codes with another key into new group codes, numbered from
+    0 in order of appearance.
+
+    Parameters
+    -----------
+    codes : NumPy array of int
+    keys : NumPy array
+
+    Return
+    -------
+    NumPy array of int
+    """
+    key_codes, key_uniques = pd.factorize(keys)
+    # Missing keys form their own group
+    key_codes = np.where(key_codes < 0, len(key_uniques), key_codes)
+    combined, _ = pd.factorize(codes * (len(key_uniques) + 1) + key_codes)
+    return combined
+
+
+def _sorted_quantile(sorted_vals, starts, counts, q):
+    """
+    Get a linearly-interpolated quantile of each group of an array sorted by
+    group & value.
+
+    Parameters
+    -----------
+    sorted_vals : NumPy array of float
+    starts : NumPy array of int
+        Position of each group's first value
+    counts : NumPy array of int
+        Number of values of each group
+    q : float
+        Quantile, between 0 & 1
+
+    Return
+    -------
+    NumPy array of float, one value per group
+    """
+    pos = q * (counts - 1)
+    lower = np.floor(pos).astype(np.intp)
+    upper = np.minimum(lower + 1, counts - 1)
+    frac = pos - lower
+    lower_vals = sorted_vals[starts + lower]
+    upper_vals = sorted_vals[starts + upper]
+    return lower_vals + (upper_vals - lower_vals) * frac
+
+
+def register_detector(name):
+    """
+    Decorator registering an outlier detector function under a method name.
+    The function takes an EFGroups instance & keyword parameters and returns
+    a NumPy array of bool, True for outlier rows.
+
+    Parameters
+    -----------
+    name : str
+        Method name, as used in the config file
+
+    Return
+    -------
+    Decorator
+    """
+    def decorator(func):
+        DETECTORS[name] = func
+        return func
+    return decorator
+
+
+@register_detector('zscore')
+def detect_zscore(groups, thresh=3):
+    """
+    Flag rows whose absolute z-score within their group exceeds 'thresh'.
+    Groups with a standard deviation of zero produce no outliers.
+    """
+    std = groups.std
+    valid = (groups.valid & (std > 0.0))[groups.codes]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        score = np.abs(groups.deviation) / std[groups.codes]
+    return valid & (score > thresh)
+
+
+@register_detector('iqr')
+def detect_iqr(groups, outlier_const=1.5):
+    """
+    Flag rows outside 'outlier_const' interquartile ranges of the group's
+    lower & upper quartiles.
+    """
+    lower_quartile = groups.quantile(0.25)
+    upper_quartile = groups.quantile(0.75)
+    iqr = (upper_quartile - lower_quartile) * outlier_const
+    upper_limit = (upper_quartile + iqr)[groups.codes]
+    lower_limit = (lower_quartile - iqr)[groups.codes]
+    return groups.valid[groups.codes] & ((groups.values > upper_limit) |
+                                         (groups.values < lower_limit))
+
+
+@register_detector('mad')
+def detect_mad(groups, thresh=3.5):
+    """
+    Flag rows whose absolute modified z-score, based on the median absolute
+    deviation (MAD), exceeds 'thresh'. Groups with a MAD of zero produce no
+    outliers.
+    """
+    mad = groups.mad
+    valid = (groups.valid & (mad > 0.0))[groups.codes]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        score = 0.6745 * np.abs(groups.values - groups.median[groups.codes]) / mad[groups.codes]
+    return valid & (score > thresh)
+
+
+@register_detector('boxcox_zscore')
+def detect_boxcox_zscore(groups, thresh=3):
+    """
+    Flag rows whose absolute z-score within their group exceeds 'thresh'
+    after Box-Cox transforming each group (see z_stats.boxcox_array()).
+    Groups that cannot be transformed produce no outliers.
+    """
+    transformed = groups.values.copy()
+    valid = groups.valid.copy()
+    for code, rows in groups.iter_groups():
+        try:
+            with np.errstate(divide='raise', over='raise', invalid='raise'):
+                transformed[rows], _ = z_stats.boxcox_array(groups.values[rows])
+        except (ValueError, ZeroDivisionError, FloatingPointError, RuntimeWarning):
+            valid[code] = False
+    boxcox_groups = groups.with_values(transformed)
+    boxcox_groups.valid &= valid
+    return detect_zscore(boxcox_groups, thresh=thresh)
+
+
+def register_replacement(name):
+    """
+    Decorator registering an outlier replacement strategy under a name. The
+    function takes an EFGroups instance & a boolean outlier mask and returns
+    the replacement value of each outlier row.
+
+    Parameters
+    -----------
+    name : str
+        Strategy name, as used in the config file
+
+    Return
+    -------
+    Decorator
+    """
+    def decorator(func):
+        REPLACEMENTS[name] = func
+        return func
+    return decorator
+
+
+@register_replacement('global_median')
+def replace_global_median(groups, outliers):
+    """
+    Replace every outlier with the median of all EFs.
+    """
+    ef_median = np.median(groups.values)
+    logger.debug("EF data array median: {}".format(ef_median))
+    return np.full(int(outliers.sum()), ef_median)
+
+
+@register_replacement('sector_fuel_median')
+def replace_sector_fuel_median(groups, outliers):
+    """
+    Replace each outlier with the median of its sector & fuel group.
+    """
+    return groups.median[groups.codes[outliers]]
+
+
+@register_replacement('region_median')
+def replace_region_median(groups, outliers):
+    """
+    Replace each outlier with the median of its sector & fuel group within its
+    region, or with the median of its sector & fuel group if its ISO has no
+    region or the regional group has fewer than MIN_REGION_GROUP_SIZE EFs.
+    """
+    if (groups.isos is None):
+        raise ValueError('The region_median replacement strategy requires the ISO of each EF')
+    regions = pd.Series(groups.isos).map(get_iso_regions()).to_numpy(dtype=object)
+    region_groups = groups.subgroups(regions)
+    rows = np.flatnonzero(outliers)
+    region_codes = region_groups.codes[rows]
+    use_region = ((region_groups.counts[region_codes] >= MIN_REGION_GROUP_SIZE) &
+                  pd.notna(regions[rows]))
+    return np.where(use_region, region_groups.median[region_codes],
+                    groups.median[groups.codes[rows]])
+
+
+def get_iso_regions_file():
+    """
+    Get the path of the ISO to region mapping file in the input directory.
+
+    Return
+    -------
+    str
+    """
+    return os.path.join(config.CONFIG.dirs['input'], ISO_REGIONS_FILE)
+
+
+def get_iso_regions(f_path=None):
+    """
+    Get the region of each CEDS ISO. The file is read once per process.
+
+    Parameters
+    -----------
+    f_path : str, optional
+        Path of the ISO mapping file, with columns 'iso' & 'region'. Default is
+        None, i.e. ceds_isos.csv in the input directory
+
+    Return
+    -------
+    dict of {str : str}
+    """
+    if (f_path is None):
+        f_path = get_iso_regions_file()
+    if (f_path not in _ISO_REGIONS):
+        iso_df = pd.read_csv(f_path, encoding='utf-8-sig', dtype=str)
+        _ISO_REGIONS[f_path] = dict(zip(iso_df['iso'], iso_df['region']))
+    return _ISO_REGIONS[f_path]
+
+
+def get_options():
+    """
+    Get the outlier detection method, parameters, & replacement strategy from
+    the global CONFIG object.
+
+    Return
+    -------
+    dict with keys 'method', 'params', & 'replacement'
+    """
+    if (config.CONFIG is None):
+        return {'method' : DEFAULT_METHOD, 'params' : {}, 'replacement' : DEFAULT_REPLACEMENT}
+    return config.CONFIG.outliers
+
+
+def get_detector(method):
+    """
+    Get a registered outlier detector function.
+
+    Parameters
+    -----------
+    method : str
+        Method name, i.e. 'zscore'
+
+    Return
+    -------
+    function
+    """
+    try:
+        return DETECTORS[method]
+    except KeyError:
+        raise ValueError('Invalid outlier detection method {}. Valid methods: {}'.format(
+                         method, ', '.join(sorted(DETECTORS.keys()))))
+
+
+def detect(groups, method=None, **params):
+    """
+    Run an outlier detector over every group of an EFGroups instance.
+
+    Parameters
+    -----------
+    groups : EFGroups
+    method : str, optional
+        Method name. Default is None, i.e. the config file's method
+    **params
+        Detector parameters. Default is the config file's parameters if
+        'method' is the config file's method
+
+    Return
+    -------
+    Pandas Series of bool, indexed like the rows of 'groups'
+    """
+    options = get_options()
+    if (method is None or method == options['method']):
+        method = options['method']
+        params = dict(options['params'], **params)
+    mask = get_detector(method)(groups, **params)
+    logger.debug('Outliers identified with {}: {}'.format(method, int(mask.sum())))
+    return pd.Series(mask, index=groups.index)
+
+
+def get_outliers(ef_obj, method=None, **params):
+    """
+    Identify outliers of the freeze year EFs of every combustion sector & fuel
+    group of an EF object.
+
+    Parameters
+    -----------
+    ef_obj : EmissionFactorFile or EmissionFactorArray
+    method : str, optional
+        Method name. Default is None, i.e. the config file's method
+    **params
+        Detector parameters, see detect()
+
+    Return
+    -------
+    Pandas Series of bool, indexed like the combustion EFs, that is True for
+    rows whose freeze year EF is an outlier
+    """
+    return detect(EFGroups.from_ef_obj(ef_obj), method=method, **params)
+
+
+def get_replacements(groups, outliers, strategy=None):
+    """
+    Get the replacement values of the outliers of an EFGroups instance.
+
+    Parameters
+    -----------
+    groups : EFGroups
+    outliers : Pandas Series or NumPy array of bool
+        Outlier mask, see detect()
+    strategy : str, optional
+        Replacement strategy name. Default is None, i.e. the config file's
+        strategy
+
+    Return
+    -------
+    NumPy array of float : Replacement value of each outlier row, in row order
+    """
+    if (strategy is None):
+        strategy = get_options()['replacement']
+    try:
+        func = REPLACEMENTS[strategy]
+    except KeyError:
+        raise ValueError('Invalid outlier replacement strategy {}. Valid strategies: {}'.format(
+                         strategy, ', '.join(sorted(REPLACEMENTS.keys()))))
+    return func(groups, np.asarray(outliers, dtype=bool))
@@ -8,6 +8,12 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import os
+import sys
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ceds_io
 
 species = 'SO2'
 sector  = '1A1a_Electricity-public'
@@ -26,19 +32,13 @@ f_template = 'H.{}_total_EFs_extended.csv'
 # -- Organic frozen EF file --------------------------
 f_a = f_template.format(species)
 f_a = os.path.join(dir_a, f_a)
-df_a = pd.read_csv(f_a, sep=',', header=0)
-ef_a = df_a.loc[(df_a['sector'] == sector) &
-                (df_a['fuel'] == fuel) &
-                (df_a['iso'] == iso)].to_numpy()
+ef_a = ceds_io.query(f_a, iso=iso, sector=sector, fuel=fuel).to_numpy()
 ef_a = ef_a[0][4:]
 
 # -- Frozen EF file used in gridding on PIC ----------
 f_b = f_template.format(species)
 f_b = os.path.join(dir_b, f_b)               
-df_b = pd.read_csv(f_b, sep=',', header=0)
-ef_b = df_b.loc[(df_b['sector'] == sector) &
-                (df_b['fuel'] == fuel) &
-                (df_b['iso'] == iso)].to_numpy()
+ef_b = ceds_io.query(f_b, iso=iso, sector=sector, fuel=fuel).to_numpy()
 ef_b = ef_b[0][4:]
 
 # -- Sanity Check ------------------------------------
@@ -8,6 +8,12 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import os
+import sys
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ceds_io
 
 species = 'SO2'
 sector  = '1A1a_Electricity-public'
@@ -29,15 +35,9 @@ f_frozen  = os.path.join(frozen_dir, f_frozen)
 f_cmip6  = f_template.format(species)
 f_cmip6  = os.path.join(cmip6_dir, f_cmip6)
 
-em_df     = pd.read_csv(f_frozen, sep=',', header=0)
-frozen_em = em_df.loc[(em_df['sector'] == sector) &
-                      (em_df['fuel'] == fuel) &
-                      (em_df['iso'] == iso)].to_numpy()
+frozen_em = ceds_io.query(f_frozen, iso=iso, sector=sector, fuel=fuel).to_numpy()
                       
-em_df    = pd.read_csv(f_cmip6, sep=',', header=0)
-cmip6_em = em_df.loc[(em_df['sector'] == sector) &
-                     (em_df['fuel'] == fuel) &
-                     (em_df['iso'] == iso)].to_numpy()
+cmip6_em = ceds_io.query(f_cmip6, iso=iso, sector=sector, fuel=fuel).to_numpy()
 
 frozen_em = frozen_em[0][4:]
 cmip6_em  = cmip6_em[0][4:]
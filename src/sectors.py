@@ -0,0 +1,206 @@
+"""
+Registry of the CEDS sectors & their types
+
+The sectors are read once per process from input/master_sector.csv, whose
+'type' column classifies each sector ('comb' for combustion-related sectors,
+'NC' otherwise). Each sector is given an integer code (its row in the file),
+and each type a boolean flag array indexed by those codes, so selecting the
+rows of a type is a lookup on the sector codes rather than a string
+comparison per row. Changing the set of combustion sectors is an edit of
+master_sector.csv.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+
+MASTER_SECTOR_FILE = 'master_sector.csv'
+
+# Sector type of the combustion-related sectors in MASTER_SECTOR_FILE
+COMB_TYPE = 'comb'
+
+# Input directory used when the global CONFIG object isn't initialized
+DEFAULT_INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 'input')
+
+# SectorRegistry instances keyed by file path
+_REGISTRIES = {}
+
+
+class SectorRegistry:
+    """
+    CEDS sectors read from a master sector file, with integer codes & type flags.
+
+    Attributes
+    -----------
+    f_path : str
+        Path of the master sector file
+    sectors : pandas Index of str
+        Sectors; a sector's integer code is its position
+    types : NumPy array of str
+        Type of each sector, indexed by sector code
+    """
+
+    def __init__(self, f_path):
+        """
+        Parameters
+        -----------
+        f_path : str
+            Path of a master sector file with columns 'sector' & 'type'
+        """
+        sector_df = pd.read_csv(f_path, encoding='utf-8-sig', dtype=str)
+        self.f_path = f_path
+        self.sectors = pd.Index(sector_df['sector'])
+        self.types = sector_df['type'].to_numpy()
+        self._flags = {}
+
+    def __len__(self):
+        return len(self.sectors)
+
+    def __contains__(self, sector):
+        return sector in self.sectors
+
+    def get_codes(self, sectors):
+        """
+        Get the integer codes of sectors.
+
+        Parameters
+        -----------
+        sectors : list-like of str
+
+        Return
+        -------
+        NumPy array of int, with -1 for sectors that aren't in the registry
+        """
+        return self.sectors.get_indexer(sectors)
+
+    def get_flags(self, sector_type):
+        """
+        Get a boolean array, indexed by sector code, of whether each sector is
+        of a type. The array is computed once per type.
+
+        Parameters
+        -----------
+        sector_type : str
+
+        Return
+        -------
+        NumPy array of bool
+        """
+        if (sector_type not in self._flags):
+            self._flags[sector_type] = self.types == sector_type
+        return self._flags[sector_type]
+
+    def get_sectors(self, sector_type=None):
+        """
+        Get the sectors of a type, in file order.
+
+        Parameters
+        -----------
+        sector_type : str, optional
+            Default is None, which returns every sector
+
+        Return
+        -------
+        list of str
+        """
+        if (sector_type is None):
+            return self.sectors.tolist()
+        return self.sectors[self.get_flags(sector_type)].tolist()
+
+    def combustion_sectors(self):
+        """
+        Get the combustion-related sectors, in file order.
+
+        Return
+        -------
+        list of str
+        """
+        return self.get_sectors(COMB_TYPE)
+
+    def type_mask(self, sectors, sector_type):
+        """
+        Get a boolean mask of whether each value of a sector column is of a
+        type. Each distinct sector is only looked up once: the categories of a
+        categorical column are looked up directly, and other columns are
+        factorized first. Sectors that aren't in the registry & missing values
+        are False.
+
+        Parameters
+        -----------
+        sectors : Pandas Series, Categorical, or array-like of str
+        sector_type : str
+
+        Return
+        -------
+        NumPy array of bool
+        """
+        if (isinstance(sectors, pd.Series)):
+            sectors = sectors.array
+        if (isinstance(sectors, pd.Categorical)):
+            codes, uniques = sectors.codes, sectors.categories
+        else:
+            codes, uniques = pd.factorize(sectors)
+        flags = self.get_flags(sector_type)
+        reg_codes = self.get_codes(uniques)
+        # Append a False flag for codes of -1, i.e. unknown sectors & missing values
+        unique_flags = np.append(flags[reg_codes] & (reg_codes >= 0), False)
+        return unique_flags[codes]
+
+    def comb_mask(self, sectors):
+        """
+        Get a boolean mask of whether each value of a sector column is a
+        combustion-related sector. See type_mask().
+
+        Parameters
+        -----------
+        sectors : Pandas Series, Categorical, or array-like of str
+
+        Return
+        -------
+        NumPy array of bool
+        """
+        return self.type_mask(sectors, COMB_TYPE)
+
+
+def get_registry(f_path=None):
+    """
+    Get the sector registry of a master sector file. The file is read once per
+    process.
+
+    Parameters
+    -----------
+    f_path : str, optional
+        Path of the master sector file. Default is None, i.e. master_sector.csv
+        in the input directory
+
+    Return
+    -------
+    SectorRegistry
+    """
+    if (f_path is None):
+        input_dir = DEFAULT_INPUT_DIR if config.CONFIG is None else config.CONFIG.dirs['input']
+        f_path = os.path.join(input_dir, MASTER_SECTOR_FILE)
+    if (f_path not in _REGISTRIES):
+        _REGISTRIES[f_path] = SectorRegistry(f_path)
+    return _REGISTRIES[f_path]
+
+
+def get_combustion_sectors():
+    """
+    Get the combustion-related sectors of the default sector registry.
+
+    Return
+    -------
+    list of str
+    """
+    return get_registry().combustion_sectors()
+
+
+def clear_registries():
+    """
+    Remove all memoized sector registries.
+    """
+    _REGISTRIES.clear()
@@ -53,7 +53,7 @@ def plot_isos(isos='default', emissions='all'):
     # Create 3x3 facet plot
     fig, ((ax1, ax2, ax3), (ax4, ax5, ax6), (ax7, ax8, ax9)) = plt.subplots(3, 3)
     
-    idx, em in enumerate(emissions):
+    for idx, em in enumerate(emissions):
         # TODO: Make function for writing to logger & printing to console
         msg = 'Processing diagnostics for {}'.format(em)
         print(msg)
@@ -68,12 +68,12 @@ def plot_isos(isos='default', emissions='all'):
         msg = 'Reading {}...'.format(frzn_fname)
         print(msg)
         logger.debug(msg)
-        frzn_df = pd.read_csv(frzn_fname, sep=',', header=0)
+        frzn_df = ceds_io.read_ceds_file(frzn_fname)
         
         msg = 'Reading {}...'.format(cmip_fname)
         print(msg)
         logger.debug(msg)
-        cmip_df = pd.read_csv(cmip_fname, sep=',', header=0)
+        cmip_df = ceds_io.read_ceds_file(cmip_fname)
         
         # To be continued...
         
@@ -6,6 +6,7 @@ Created on Mon Nov 25 08:43:19 2019
 """
 
 import numpy as np
+import pandas as pd
 import logging
 
 from os.path import join
@@ -19,40 +20,71 @@ import ceds_io
 
 
 def write_stats(ef_df, species, year, f_paths):
+    """
+    Write the mean, median, standard deviation, sum, min, & max of the EFs of
+    every sector & fuel combination to a csv file.
     
-    f_out_name = '{}.{}'.format(species, f_paths['f_out_name'])
+    The statistics of every group & year are computed in a single groupby
+    aggregation and written with a single file handle. Sector & fuel
+    combinations that do not occur in 'ef_df' are written with NaN statistics
+    and a sum of zero.
     
-    f_out_abs = join(f_paths['f_out_path'], f_out_name)
+    Parameters
+    ----------
+    ef_df : Pandas DataFrame
+        EF DataFrame
+    species : str
+        Emission species, prepended to the output file name
+    year : int, str, list of int or str, or None
+        Year(s) of the EFs, i.e. 1970, 'X1970', or [1970, 1971]. None uses every
+        year column. If more than one year is given, the output has a 'year'
+        column after 'fuel'.
+    f_paths : dict
+        Output file location. Keys: 'f_out_path' (directory) & 'f_out_name'
+        (file name, prefixed by '<species>.')
     
-    with open(f_out_abs, 'w') as fh:
-        fh.write('sector,fuel,mean,median,std,sum,min_ef,max_ef')
-        fh.write('\n')
-
-    fuels = ef_df['fuel'].unique().tolist()
-    sectors = ef_df['sector'].unique().tolist()
+    Returns
+    -------
+    str : Path of the written file
+    """
+    f_out_name = '{}.{}'.format(species, f_paths['f_out_name'])
+    f_out_abs = join(f_paths['f_out_path'], f_out_name)
     
-    for sector in sectors:
-        ef_df_sector = ef_df[ef_df['sector'] == sector]
-        
-        for fuel in fuels:
-            ef_df_fuel = ef_df_sector[ef_df_sector['fuel'] == fuel]
-            
-            ef_df_subs = ef_df_fuel['X{}'.format(year)]
-   
-            ef_mean = ef_df_subs.mean()
-            ef_median = ef_df_subs.median()
-            ef_std = ef_df_subs.std()
-            ef_sum = ef_df_subs.sum()
-            ef_min = ef_df_subs.min()
-            ef_max = ef_df_subs.max()
-           
-            curr_str = '{},{},{},{},{},{},{},{}'.format(sector, fuel, ef_mean,
-                                                        ef_median, ef_std, ef_sum,
-                                                        ef_min, ef_max)
-           
-            with open(f_out_abs, 'a') as fh:
-                fh.write(curr_str)
-                fh.write('\n')
+    if (year is None):
+        year_cols = [col for col in ef_df.columns if ceds_io.YEAR_COL_PATTERN.match(col)]
+    elif (isinstance(year, (list, tuple))):
+        year_cols = [str(yr) if str(yr).startswith('X') else 'X{}'.format(yr) for yr in year]
+    else:
+        year_cols = [str(year) if str(year).startswith('X') else 'X{}'.format(year)]
+    multi_year = len(year_cols) > 1
+    
+    # Keep the original order of appearance of the sectors & fuels
+    sector_col = ef_df['sector'].astype(object)
+    fuel_col = ef_df['fuel'].astype(object)
+    sectors = pd.unique(sector_col)
+    fuels = pd.unique(fuel_col)
+    stat_names = ['mean', 'median', 'std', 'sum', 'min', 'max']
+    
+    grouped = ef_df.groupby([sector_col, fuel_col], sort=False)[year_cols]
+    stats_df = grouped.agg(stat_names)
+    # Every sector & fuel combination, in sector-major order
+    all_groups = pd.MultiIndex.from_product([sectors, fuels], names=['sector', 'fuel'])
+    stats_df = stats_df.reindex(all_groups)
+    # Columns are (year, stat). Stack the years into rows
+    stats_df.columns.names = ['year', 'stat']
+    stats_df = stats_df.stack('year', dropna=False)
+    if (multi_year):
+        stats_df = stats_df.reindex(pd.MultiIndex.from_product([sectors, fuels, year_cols],
+                                                               names=['sector', 'fuel', 'year']))
+    else:
+        stats_df.index = stats_df.index.droplevel('year')
+    stats_df = stats_df[stat_names]
+    # The sum of an empty group is zero
+    stats_df['sum'] = stats_df['sum'].fillna(0)
+    stats_df.columns = ['mean', 'median', 'std', 'sum', 'min_ef', 'max_ef']
+    
+    stats_df.to_csv(f_out_abs, na_rep='nan')
+    return f_out_abs
 
 
 def get_ef_median(ef_obj):
@@ -67,7 +99,7 @@ def get_ef_median(ef_obj):
     -------
     NumPy float 64
     """
-    ef_list = ef_obj.get_factors_combustion()[ef_obj.freeze_year].tolist()
+    ef_list = ef_obj.get_comb_columns([ef_obj.freeze_year])[ef_obj.freeze_year].tolist()
     med = np.median(ef_list)
     return med
 
@@ -202,8 +234,27 @@ def get_boxcox(efsubset_obj):
     """
     logger = logging.getLogger('main')
     logger.info("Performing Box Cox transform...")
+    return boxcox_array(efsubset_obj.ef_data)
+
+
+def boxcox_array(data):
+    """
+    Box-Cox transform an array of EF values. Values of zero are transformed to
+    -1/lambda, and an array of all zeros is returned unchanged.
     
-    data = np.asarray(efsubset_obj.ef_data, dtype=np.float64)
+    Parameters
+    ----------
+    data : array-like of float
+    
+    Return
+    ------
+    xt : ndarray
+        Box-Cox power transformed array
+    lam : float
+        The lambda that maximizes the log-likelihood function
+    """
+    logger = logging.getLogger('main')
+    data = np.asarray(data, dtype=np.float64)
     
     # If the data values are tiny, scale the values to avoid overflow 
     # during numpy arithmetic
@@ -219,7 +270,7 @@ def get_boxcox(efsubset_obj):
     except ValueError:
         # ValueError: Data must be positive
         # Temporarily discarding the 0, and then using -1/λ for the transformed value of 0
-        logger.info("Data values <= 0 encountered")
+        logger.debug("Data values <= 0 encountered")
         
         pos_data = data[data > 0]
         
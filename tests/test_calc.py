@@ -0,0 +1,119 @@
+"""
+Tests for the total emissions calculation helpers in driver.py
+"""
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, '../src')
+
+import config
+import driver
+
+
+class TestAssembleEmissions(unittest.TestCase):
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        self.meta_cols = pd.DataFrame({'iso'    : ['usa', 'can'],
+                                       'sector' : ['1A3b_Road'] * 2,
+                                       'fuel'   : ['diesel_oil'] * 2,
+                                       'units'  : ['kt'] * 2}).astype('category')
+        self.ef_vals = np.array([[1.0, 2.0], [3.0, 4.0]])
+        self.act_vals = np.array([[10.0, 10.0], [2.0, 0.5]])
+        self.years = ['X1970', 'X1971']
+
+    def test_assemble(self):
+        """Test that emissions are calculated & the default tanker loading row
+        is appended
+        """
+        df = driver.assemble_emissions(self.meta_cols, self.ef_vals, self.act_vals, self.years)
+        self.assertEqual(df.columns.tolist(), ['iso', 'sector', 'fuel', 'units'] + self.years)
+        self.assertEqual(df['iso'].tolist(), ['usa', 'can', 'global'])
+        self.assertEqual(df['sector'].tolist()[-1], '1A3di_Oil_Tanker_Loading')
+        self.assertEqual(df['X1970'].tolist(), [10.0, 6.0, 0.0])
+        self.assertEqual(df['X1971'].tolist(), [20.0, 2.0, 0.0])
+
+    def test_assemble_injected_rows(self):
+        """Test configurable injected rows
+        """
+        rows = [{'iso' : 'global', 'sector' : 'a', 'fuel' : 'b', 'units' : 'kt', 'value' : 1.5},
+                {'iso' : 'global', 'sector' : 'c', 'fuel' : 'd', 'units' : 'kt', 'value' : 0.0}]
+        df = driver.assemble_emissions(self.meta_cols, self.ef_vals, self.act_vals, self.years,
+                                       injected_rows=rows)
+        self.assertEqual(df.shape, (4, 6))
+        self.assertEqual(df['sector'].tolist()[2:], ['a', 'c'])
+        self.assertEqual(df['X1971'].tolist()[2:], [1.5, 0.0])
+        df = driver.assemble_emissions(self.meta_cols, self.ef_vals, self.act_vals, self.years,
+                                       injected_rows=[])
+        self.assertEqual(df.shape, (2, 6))
+
+
+class TestCalcSpeciesChunked(unittest.TestCase):
+    """
+    Test the chunked total emissions calculation against the whole-file one,
+    using small temporary emission factor & activity files
+    """
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config.CONFIG.dirs['output'] = os.path.join(self.tmp_dir.name, 'output')
+        config.CONFIG.dirs['cmip6'] = os.path.join(self.tmp_dir.name, 'cmip6')
+        os.makedirs(config.CONFIG.dirs['output'])
+        os.makedirs(config.CONFIG.dirs['cmip6'])
+        config.CONFIG.ceds_meta['year_first'] = 1970
+        config.CONFIG.ceds_meta['year_last'] = 1971
+        config.CONFIG.cache['enabled'] = False
+        self.years = ['X1970', 'X1971']
+        self.meta_cols = pd.DataFrame({'iso'    : ['usa', 'can', 'mex'],
+                                       'sector' : ['1A3b_Road'] * 3,
+                                       'fuel'   : ['diesel_oil'] * 3,
+                                       'units'  : ['kt'] * 3})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_inputs(self, ef_vals, act_vals):
+        ef_df = self.meta_cols.iloc[:len(ef_vals)].copy()
+        act_df = self.meta_cols.iloc[:len(act_vals)].copy()
+        ef_df[self.years] = np.reshape(ef_vals, (-1, 2))
+        act_df[self.years] = np.reshape(act_vals, (-1, 2))
+        ef_df.to_csv(os.path.join(config.CONFIG.dirs['output'], 'H.XX_total_EFs_extended.csv'),
+                     index=False)
+        act_df.to_csv(os.path.join(config.CONFIG.dirs['cmip6'],
+                                   'H.XX_total_activity_extended.csv'), index=False)
+
+    def calc(self, chunksize):
+        config.CONFIG.calc['chunksize'] = chunksize
+        self.assertTrue(driver.calc_species('XX'))
+        f_path = os.path.join(config.CONFIG.dirs['output'], 'XX_total_CEDS_emissions.csv')
+        with open(f_path) as fh:
+            return fh.read()
+
+    def test_chunked_matches_unchunked(self):
+        """Test that the chunked calculation writes the same file
+        """
+        self.write_inputs([[1.0, 2.0], [3.0, 4.0], [0.5, 0.25]],
+                          [[10.0, 10.0], [2.0, 0.5], [4.0, 8.0]])
+        expected = self.calc(None)
+        self.assertEqual(self.calc(2), expected)
+        self.assertEqual(self.calc(1), expected)
+
+    def test_chunked_empty_input(self):
+        """Test that input files without rows give the header & injected rows
+        """
+        self.write_inputs(np.zeros((0, 2)), np.zeros((0, 2)))
+        expected = self.calc(None)
+        self.assertEqual(self.calc(2), expected)
+        self.assertEqual(len(expected.splitlines()), 2)
+
+
+# ------------------------------------ Main ------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,10 @@ Matt Nicholson
 import unittest
 import sys
 import os
+import tempfile
+import gzip
+import numpy as np
+import pandas as pd
 
 # Insert src directory to Python path for importing
 sys.path.insert(1, '../src')
@@ -42,6 +46,418 @@ class TestCedsIO(unittest.TestCase):
         expected = [self.f_ef, 'H.SO2_total_EFs_extended.csv' ]
         self.assertEqual(ceds_io.fetch_ef_files(config.CONFIG.dirs['cmip6']), expected)
         
+class TestReadCedsFile(unittest.TestCase):
+    """
+    Test the dtype-pinned CEDS file reader using a small temporary CSV file
+    """
+    
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.f_path = os.path.join(self.tmp_dir.name, 'H.BC_total_EFs_extended.csv')
+        with open(self.f_path, 'w') as fh:
+            fh.write('iso,sector,fuel,units,X1969,X1970,X1971\n')
+            fh.write('usa,1A3b_Road,diesel_oil,kt/kt,0.5,1,1.5\n')
+            fh.write('can,1A3b_Road,diesel_oil,kt/kt,0.25,0.5,0.75\n')
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def test_read_ceds_file_dtypes(self):
+        """Test that meta columns are read as categoricals & year columns as floats
+        """
+        df = ceds_io.read_ceds_file(self.f_path, year_dtype='float64')
+        for col in ['iso', 'sector', 'fuel', 'units']:
+            self.assertEqual(str(df[col].dtype), 'category')
+        for col in ['X1969', 'X1970', 'X1971']:
+            self.assertEqual(str(df[col].dtype), 'float64')
+        self.assertEqual(df['X1970'].tolist(), [1.0, 0.5])
+    
+    def test_read_ceds_file_float32(self):
+        """Test that year columns can be read as float32
+        """
+        df = ceds_io.read_ceds_file(self.f_path, year_dtype='float32')
+        self.assertEqual(str(df['X1971'].dtype), 'float32')
+    
+    def test_read_ceds_file_chunks(self):
+        """Test that chunked reads match a whole-file read & keep row indices
+        """
+        df = ceds_io.read_ceds_file(self.f_path, year_dtype='float64')
+        chunks = list(ceds_io.read_ceds_file_chunks(self.f_path, 1, year_dtype='float64'))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([chunk.index[0] for chunk in chunks], [0, 1])
+        chunked_df = pd.concat(chunks)
+        self.assertTrue(chunked_df['X1970'].equals(df['X1970']))
+        self.assertEqual(chunked_df['iso'].tolist(), ['usa', 'can'])
+        
+class TestReadCedsFileCached(unittest.TestCase):
+    """
+    Test the binary cache of CEDS input files using a small temporary CSV file
+    """
+    
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/config-test_frozen_sectors.yml')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, '.cache')
+        self.f_path = os.path.join(self.tmp_dir.name, 'H.BC_total_activity_extended.csv')
+        self.write_csv('0.5')
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def write_csv(self, val):
+        with open(self.f_path, 'w') as fh:
+            fh.write('iso,sector,fuel,units,X1970\n')
+            fh.write('usa,1A3b_Road,diesel_oil,kt,{}\n'.format(val))
+    
+    def test_cache_created(self):
+        """Test that reading a file writes a single cached copy that is re-used
+        """
+        df_1 = ceds_io.read_ceds_file_cached(self.f_path, cache_dir=self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        df_2 = ceds_io.read_ceds_file_cached(self.f_path, cache_dir=self.cache_dir)
+        self.assertTrue(df_1.equals(df_2))
+        self.assertEqual(str(df_2['iso'].dtype), 'category')
+    
+    def test_cache_invalidated(self):
+        """Test that a modified file replaces its stale cached copy
+        """
+        ceds_io.read_ceds_file_cached(self.f_path, cache_dir=self.cache_dir)
+        self.write_csv('0.75')
+        # Make sure the modification time changes even on coarse filesystems
+        f_stat = os.stat(self.f_path)
+        os.utime(self.f_path, ns=(f_stat.st_atime_ns, f_stat.st_mtime_ns + 10 ** 9))
+        df = ceds_io.read_ceds_file_cached(self.f_path, cache_dir=self.cache_dir)
+        self.assertEqual(df['X1970'].tolist(), [0.75])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+    
+    def test_cache_disabled(self):
+        """Test that no cached copy is written when caching is disabled
+        """
+        config.CONFIG.cache['enabled'] = False
+        ceds_io.read_ceds_file_cached(self.f_path, cache_dir=self.cache_dir)
+        self.assertFalse(os.path.isdir(self.cache_dir))
+        
+class TestWriteCedsFile(unittest.TestCase):
+    """
+    Test that the CEDS csv writer matches DataFrame.to_csv()
+    """
+    
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = pd.DataFrame({'iso'    : ['usa', 'can', 'mex'],
+                                'sector' : ['1A3b_Road', '1A3b_Road', 'a,b'],
+                                'fuel'   : ['diesel_oil', 'say "hi"', 'process'],
+                                'units'  : ['kt', np.nan, 'kt'],
+                                'X1970'  : [0.1 + 0.2, 1e-05, np.nan],
+                                'X1971'  : [1e16, -0.0, 123456.789]})
+        self.df[['iso', 'sector']] = self.df[['iso', 'sector']].astype('category')
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def write(self, df, **kwargs):
+        f_path = os.path.join(self.tmp_dir.name, 'out.csv')
+        f_path = ceds_io.write_ceds_file(df, f_path, **kwargs)
+        with (gzip.open(f_path, 'rt') if f_path.endswith('.gz') else open(f_path)) as fh:
+            return fh.read()
+    
+    def test_write_matches_to_csv(self):
+        """Test byte-compatibility with to_csv, incl. NaN, quoting, & block boundaries
+        """
+        expected = self.df.to_csv(index=False)
+        self.assertEqual(self.write(self.df), expected)
+        with open(os.path.join(self.tmp_dir.name, 'blocks.csv'), 'w', newline='') as fh:
+            ceds_io.write_ceds_frame(self.df, fh, block_rows=2)
+        with open(os.path.join(self.tmp_dir.name, 'blocks.csv')) as fh:
+            self.assertEqual(fh.read(), expected)
+    
+    def test_write_float32(self):
+        """Test byte-compatibility with to_csv for float32 year columns
+        """
+        df = self.df.astype({'X1970' : 'float32', 'X1971' : 'float32'})
+        self.assertEqual(self.write(df), df.to_csv(index=False))
+    
+    def test_write_precision(self):
+        """Test writing with a given number of significant digits
+        """
+        expected = self.df.to_csv(index=False, float_format='%.3g')
+        self.assertEqual(self.write(self.df, precision=3), expected)
+    
+    def test_write_gzip(self):
+        """Test that gzip-compressed output decompresses to the same csv
+        """
+        self.assertEqual(self.write(self.df, compression='gzip'), self.df.to_csv(index=False))
+        
+class TestBackgroundWriter(unittest.TestCase):
+    """
+    Test writing CEDS DataFrames in a background thread
+    """
+    
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = pd.DataFrame({'iso' : ['usa'], 'X1970' : [1.5]})
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def test_background_writes(self):
+        """Test that files are written by the end of the context & that callbacks
+        run after the writes they depend on
+        """
+        paths = [os.path.join(self.tmp_dir.name, 'out{}.csv'.format(i)) for i in range(4)]
+        written = []
+        with ceds_io.background_writes(max_pending=1) as writer:
+            self.assertIsInstance(writer, ceds_io.BackgroundWriter)
+            for f_path in paths:
+                ceds_io.submit_write(self.df, f_path, label='BC')
+            ceds_io.after_writes(lambda: written.append(all(map(os.path.isfile, paths))), paths)
+        self.assertEqual(written, [True])
+        self.assertEqual(writer.failed, [])
+        for f_path in paths:
+            with open(f_path) as fh:
+                self.assertEqual(fh.read(), 'iso,X1970\nusa,1.5\n')
+    
+    def test_background_write_failure(self):
+        """Test that failed writes are reported & skip their callbacks
+        """
+        bad_path = os.path.join(self.tmp_dir.name, 'missing-dir', 'out.csv')
+        called = []
+        with ceds_io.background_writes(max_pending=2) as writer:
+            ceds_io.submit_write(self.df, bad_path, label='SO2')
+            ceds_io.after_writes(lambda: called.append(True), [bad_path])
+        self.assertEqual([(f[0], f[1]) for f in writer.failed], [('SO2', bad_path)])
+        self.assertEqual(called, [])
+    
+    def test_synchronous_writes(self):
+        """Test that max_pending=0 writes immediately
+        """
+        f_path = os.path.join(self.tmp_dir.name, 'out.csv')
+        with ceds_io.background_writes(max_pending=0) as writer:
+            self.assertIsNone(writer)
+            ceds_io.submit_write(self.df, f_path)
+            self.assertTrue(os.path.isfile(f_path))
+        
+class TestAlignCedsFrames(unittest.TestCase):
+    """
+    Test matching the rows of two CEDS DataFrames by (iso, sector, fuel)
+    """
+    
+    def setUp(self):
+        self.ef_df = pd.DataFrame({'iso'    : ['usa', 'can', 'mex'],
+                                   'sector' : ['1A3b_Road'] * 3,
+                                   'fuel'   : ['diesel_oil'] * 3,
+                                   'X1970'  : [1.0, 2.0, 3.0]})
+        self.act_df = pd.DataFrame({'iso'    : ['can', 'usa', 'chn'],
+                                    'sector' : ['1A3b_Road'] * 3,
+                                    'fuel'   : ['diesel_oil'] * 3,
+                                    'X1970'  : [20.0, 10.0, 40.0]})
+    
+    def test_align(self):
+        """Test matched row positions & unmatched keys
+        """
+        ef_pos, act_pos, ef_unmatched, act_unmatched = ceds_io.align_ceds_frames(self.ef_df,
+                                                                                 self.act_df)
+        self.assertEqual(ef_pos.tolist(), [0, 1])
+        self.assertEqual(act_pos.tolist(), [1, 0])
+        self.assertEqual(ef_unmatched['iso'].tolist(), ['mex'])
+        self.assertEqual(act_unmatched['iso'].tolist(), ['chn'])
+    
+    def test_align_duplicates(self):
+        """Test that duplicate keys raise a ValueError
+        """
+        self.act_df.loc[2, 'iso'] = 'usa'
+        with self.assertRaises(ValueError):
+            ceds_io.align_ceds_frames(self.ef_df, self.act_df)
+        
+class TestDirectoryIndex(unittest.TestCase):
+    """
+    Test the one-shot directory index used to find species files
+    """
+    
+    def setUp(self):
+        self.prev_config = config.CONFIG
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        config.CONFIG.freeze_species = ['BC', 'SO2']
+        ceds_io.clear_dir_indexes()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir_path = self.tmp_dir.name
+        os.makedirs(os.path.join(self.dir_path, 'final-emissions'))
+        for f_name in ['H.BC_total_EFs_extended.csv', 'H.BC_total_EFs_extended.csv.gz',
+                       'H.SO2_total_EFs_extended.csv.gz', 'H.CO_total_EFs_extended.csv',
+                       'H.BC_total_activity_extended.csv', 'README.md',
+                       os.path.join('final-emissions', 'SO2_total_CEDS_emissions.csv')]:
+            open(os.path.join(self.dir_path, f_name), 'w').close()
+    
+    def tearDown(self):
+        config.CONFIG = self.prev_config
+        ceds_io.clear_dir_indexes()
+        self.tmp_dir.cleanup()
+    
+    def test_lookup(self):
+        """Test that files are classified by species & kind, with uncompressed
+        files taking precedence
+        """
+        dir_index = ceds_io.get_dir_index(self.dir_path)
+        self.assertEqual(len(dir_index.names), 6)
+        self.assertEqual(dir_index.get('BC', 'ef'),
+                         os.path.join(self.dir_path, 'H.BC_total_EFs_extended.csv'))
+        self.assertEqual(dir_index.get('SO2', 'ef'),
+                         os.path.join(self.dir_path, 'H.SO2_total_EFs_extended.csv.gz'))
+        self.assertEqual(dir_index.get('SO2', 'emissions'),
+                         os.path.join(self.dir_path, 'final-emissions',
+                                      'SO2_total_CEDS_emissions.csv'))
+        self.assertEqual(sorted(dir_index.get_species('ef')), ['BC', 'CO', 'SO2'])
+        with self.assertRaises(FileNotFoundError):
+            ceds_io.get_file_for_species(self.dir_path, 'SO2', 'activity')
+    
+    def test_fetch(self):
+        """Test the file listing functions
+        """
+        self.assertEqual(ceds_io.fetch_ef_files(self.dir_path), ['H.BC_total_EFs_extended.csv'])
+        self.assertEqual(ceds_io.fetch_activity_files(self.dir_path),
+                         ['H.BC_total_activity_extended.csv'])
+        self.assertEqual(sorted(ceds_io.get_avail_species(self.dir_path)), ['BC', 'CO', 'SO2'])
+    
+    def test_single_scan(self):
+        """Test that the directory is only scanned once, & re-scanned when a
+        file is missing from the index
+        """
+        ceds_io.get_file_for_species(self.dir_path, 'BC', 'ef')
+        open(os.path.join(self.dir_path, 'H.NOx_total_EFs_extended.csv'), 'w').close()
+        dir_index = ceds_io.get_dir_index(self.dir_path)
+        self.assertNotIn('NOx', dir_index.get_species('ef'))
+        self.assertEqual(ceds_io.get_file_for_species(self.dir_path, 'NOx', 'ef'),
+                         os.path.join(self.dir_path, 'H.NOx_total_EFs_extended.csv'))
+        self.assertIs(ceds_io.get_dir_index(self.dir_path), dir_index)
+    
+    def test_written_files_indexed(self):
+        """Test that files written by write_ceds_file() are added to the index
+        """
+        dir_index = ceds_io.get_dir_index(self.dir_path)
+        df = pd.DataFrame({'iso' : ['usa'], 'sector' : ['a'], 'fuel' : ['b'], 'units' : ['kt'],
+                           'X1970' : [1.0]})
+        f_out = ceds_io.write_ceds_file(df, os.path.join(self.dir_path,
+                                                         'H.OC_total_EFs_extended.csv'))
+        self.assertEqual(dir_index.files[('OC', 'ef')], f_out)
+
+    def test_stale_copy(self):
+        """Test that a file written with output compression replaces a stale
+        uncompressed copy of it, & vice versa
+        """
+        dir_index = ceds_io.get_dir_index(self.dir_path)
+        f_path = os.path.join(self.dir_path, 'H.BC_total_EFs_extended.csv')
+        df = pd.DataFrame({'iso' : ['usa'], 'sector' : ['a'], 'fuel' : ['b'], 'units' : ['kt'],
+                           'X1970' : [1.0]})
+        config.CONFIG.output['compression'] = 'gzip'
+        f_out = ceds_io.write_ceds_file(df, f_path)
+        self.assertEqual(f_out, f_path + '.gz')
+        self.assertFalse(os.path.exists(f_path))
+        self.assertEqual(ceds_io.get_file_for_species(self.dir_path, 'BC', 'ef'), f_out)
+        self.assertEqual([f for f, spec, kind in dir_index.names if (spec, kind) == ('BC', 'ef')],
+                         ['H.BC_total_EFs_extended.csv.gz'])
+
+        config.CONFIG.output['compression'] = None
+        f_out = ceds_io.write_ceds_file(df, f_path)
+        self.assertFalse(os.path.exists(f_path + '.gz'))
+        self.assertEqual(ceds_io.get_file_for_species(self.dir_path, 'BC', 'ef'), f_path)
+
+    def test_output_compression_precedence(self):
+        """Test that the copy matching the output compression is found when
+        both an uncompressed & a '.gz' copy exist
+        """
+        config.CONFIG.output['compression'] = 'gzip'
+        self.assertEqual(ceds_io.get_file_for_species(self.dir_path, 'BC', 'ef'),
+                         os.path.join(self.dir_path, 'H.BC_total_EFs_extended.csv.gz'))
+
+class TestCedsIndex(unittest.TestCase):
+    """
+    Test (iso, sector, fuel) queries of an indexed CEDS DataFrame against
+    boolean masks of the same frame
+    """
+    
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        ceds_io.clear_file_indexes()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        isos = ['can', 'mex', 'usa']
+        sectors = ['1A3b_Road', '1A4b_Residential', '2A1_Cement-production']
+        fuels = ['diesel_oil', 'hard_coal', 'process']
+        rows = [(iso, sector, fuel, 'kt') for iso in isos for sector in sectors for fuel in fuels]
+        self.df = pd.DataFrame(rows, columns=['iso', 'sector', 'fuel', 'units'])
+        for yr in range(1969, 1973):
+            self.df['X{}'.format(yr)] = np.arange(len(rows), dtype=float) + yr
+        self.ceds_idx = ceds_io.CedsIndex(self.df)
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        ceds_io.clear_file_indexes()
+    
+    def get_expected(self, **kwargs):
+        mask = np.ones(self.df.shape[0], dtype=bool)
+        for key, values in kwargs.items():
+            if (values is not None):
+                values = [values] if isinstance(values, str) else values
+                mask &= self.df[key].isin(values).to_numpy()
+        return self.df.loc[mask]
+    
+    def test_query(self):
+        """Test every combination of single, multiple, & unspecified values
+        """
+        options = {'iso'    : [None, 'usa', ['mex', 'can'], 'chn'],
+                   'sector' : [None, '1A3b_Road', ['1A3b_Road', '2A1_Cement-production']],
+                   'fuel'   : [None, 'process', ['hard_coal', 'diesel_oil']]}
+        for iso in options['iso']:
+            for sector in options['sector']:
+                for fuel in options['fuel']:
+                    expected = self.get_expected(iso=iso, sector=sector, fuel=fuel)
+                    result = self.ceds_idx.query(iso=iso, sector=sector, fuel=fuel)
+                    pd.testing.assert_frame_equal(result, expected)
+    
+    def test_query_unsorted(self):
+        """Test that queries of an unsorted frame return rows in frame order
+        """
+        self.df = self.df.sample(frac=1, random_state=0)
+        ceds_idx = ceds_io.CedsIndex(self.df)
+        for kwargs in [{'iso' : 'usa'}, {'sector' : '1A3b_Road', 'fuel' : 'process'},
+                       {'iso' : ['can', 'usa'], 'fuel' : 'hard_coal'}]:
+            pd.testing.assert_frame_equal(ceds_idx.query(**kwargs), self.get_expected(**kwargs))
+    
+    def test_query_years(self):
+        """Test selecting year columns
+        """
+        result = self.ceds_idx.query(iso='usa', sector='1A3b_Road', years=[1970, 1972])
+        self.assertEqual(result.columns.tolist(), ['iso', 'sector', 'fuel', 'units', 'X1970', 'X1972'])
+        self.assertEqual(result.shape[0], 3)
+        self.assertEqual(self.ceds_idx.query(fuel='process', years=1969).columns.tolist()[-1], 'X1969')
+        with self.assertRaises(KeyError):
+            self.ceds_idx.query(iso='usa', years=2020)
+    
+    def test_contiguous_rows_sliced(self):
+        """Test that the rows of a leading key prefix are located contiguously
+        """
+        rows = self.ceds_idx.locate(iso='mex', sector='1A4b_Residential')
+        self.assertEqual(rows.tolist(), [12, 13, 14])
+        self.assertEqual(ceds_io._as_slice(rows), slice(12, 15))
+        self.assertEqual(ceds_io._as_slice(np.array([1, 3])).tolist(), [1, 3])
+    
+    def test_unknown_key(self):
+        """Test that a keyword that isn't a key column raises a KeyError
+        """
+        with self.assertRaises(KeyError):
+            self.ceds_idx.locate(units='kt')
+    
+    def test_file_index(self):
+        """Test that a file is only indexed once while it is unchanged
+        """
+        f_path = os.path.join(self.tmp_dir.name, 'H.BC_total_EFs_extended.csv')
+        self.df.to_csv(f_path, index=False)
+        file_idx = ceds_io.get_file_index(f_path)
+        self.assertIs(ceds_io.get_file_index(f_path), file_idx)
+        result = ceds_io.query(f_path, iso='can', sector='1A3b_Road', fuel='hard_coal')
+        self.assertEqual(result['X1970'].tolist(), [1971.0])
+        
 # ------------------------------------ Main ------------------------------------
 
 if __name__ == '__main__':
@@ -6,6 +6,8 @@ Matt Nicholson
 """
 import unittest
 import sys
+import os
+import tempfile
 
 # Insert src directory to Python path for importing
 sys.path.insert(1, '../src')
@@ -66,6 +68,52 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(config.CONFIG.dirs['output'], input_path)
         
 
+class TestConfigScenarios(unittest.TestCase):
+    
+    def setUp(self):
+        yaml_str = ("freeze:\n"
+                    "  year: 1970\n"
+                    "  isos: all\n"
+                    "  species: [BC]\n"
+                    "ceds:\n"
+                    "  year_first: 1750\n"
+                    "  year_last: 2014\n"
+                    "scenarios:\n"
+                    "  - name: base\n"
+                    "  - name: usa-1990\n"
+                    "    year: 1990\n"
+                    "    isos: [USA]\n")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        f_init = os.path.join(self.tmp_dir.name, 'config-sweep.yml')
+        with open(f_init, 'w') as fh:
+            fh.write(yaml_str)
+        self.config_obj = config.ConfigObj(f_init)
+        
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        
+    def test_scenarios_parsed(self):
+        """Test that scenarios inherit the freeze year & ISOs by default
+        """
+        expected = [{'name' : 'base', 'year' : 1970, 'isos' : 'all'},
+                    {'name' : 'usa-1990', 'year' : 1990, 'isos' : ['usa']}]
+        self.assertEqual(self.config_obj.scenarios, expected)
+        
+    def test_scenario_config(self):
+        """Test the ConfigObj copy of a scenario
+        """
+        scenario = self.config_obj.scenarios[1]
+        scenario_config = self.config_obj.get_scenario_config(scenario)
+        self.assertEqual(scenario_config.freeze_year, 1990)
+        self.assertEqual(scenario_config.freeze_isos, ['usa'])
+        self.assertEqual(scenario_config.scenarios, [])
+        self.assertEqual(scenario_config.dirs['output'],
+                         os.path.join(self.config_obj.dirs['output'], 'usa-1990'))
+        # The original ConfigObj is left unmodified
+        self.assertEqual(self.config_obj.freeze_year, 1970)
+        
+        
+
 # ------------------------------------ Main ------------------------------------
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+"""
+Tests for the mass-balance corrections in corrections.py
+"""
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, '../src')
+
+import config
+import corrections
+
+
+class TestCorrections(unittest.TestCase):
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        config.CONFIG.cache['enabled'] = False
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config.CONFIG.dirs['cmip6'] = self.tmp_dir.name
+        os.makedirs(os.path.join(self.tmp_dir.name, 'final-emissions'))
+        ref_path = os.path.join(self.tmp_dir.name, 'final-emissions',
+                                'SO2_total_CEDS_emissions.csv')
+        with open(ref_path, 'w') as fh:
+            fh.write('iso,sector,fuel,units,X1969,X1970,X1971\n')
+            fh.write('can,1A1bc_Other-transformation,process,kt,7,,9\n')
+            fh.write('usa,1A1bc_Other-transformation,process,kt,4,5,6\n')
+            fh.write('usa,1A3b_Road,diesel_oil,kt,0,0,0\n')
+        self.emissions_df = pd.DataFrame({
+            'iso'    : ['usa', 'usa', 'can'],
+            'sector' : ['1A1bc_Other-transformation', '1A3b_Road', '1A1bc_Other-transformation'],
+            'fuel'   : ['process', 'diesel_oil', 'process'],
+            'units'  : ['kt'] * 3,
+            'X1969'  : [1.0, 1.0, 1.0],
+            'X1970'  : [1.0, 1.0, 1.0],
+            'X1971'  : [1.0, 1.0, 1.0]})
+        corrections.clear_cache()
+
+    def tearDown(self):
+        corrections.clear_cache()
+        self.tmp_dir.cleanup()
+
+    def test_default_corrections(self):
+        """Test that SO2 & CO2 are corrected by default
+        """
+        self.assertEqual(sorted(config.CONFIG.corrections.keys()), ['CO2', 'SO2'])
+        self.assertIsNone(corrections.get_correction('BC'))
+        self.assertEqual(corrections.apply_correction('BC', self.emissions_df), 0)
+
+    def test_apply_correction(self):
+        """Test that only the correction's sectors & years are overwritten, rows
+        are matched by key, & NaN reference values are skipped
+        """
+        n_rows = corrections.apply_correction('SO2', self.emissions_df)
+        self.assertEqual(n_rows, 2)
+        self.assertEqual(self.emissions_df['X1969'].tolist(), [4.0, 1.0, 7.0])
+        self.assertEqual(self.emissions_df['X1970'].tolist(), [5.0, 1.0, 1.0])
+        self.assertEqual(self.emissions_df['X1971'].tolist(), [1.0, 1.0, 1.0])
+
+    def test_source_memoized(self):
+        """Test that the reference file is only read once for both species
+        """
+        corrections.apply_correction('SO2', self.emissions_df)
+        corrections.apply_correction('CO2', self.emissions_df)
+        self.assertEqual(len(corrections._SOURCE_CACHE), 1)
+
+
+# ------------------------------------ Main ------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Tests for the species loops of driver.py, run on small synthetic CMIP6 files
+"""
+import unittest
+import sys
+import os
+import glob
+import tempfile
+from unittest import mock
+import numpy as np
+
+# Insert src & benchmarks directories to Python path for importing
+sys.path.insert(1, '../src')
+sys.path.insert(1, '../benchmarks')
+
+import synthetic_data
+
+import ceds_io
+import config
+import driver
+import log_config
+
+SPECIES = ['BC', 'SO2']
+
+
+class SyntheticDataTestCase(unittest.TestCase):
+    """
+    Write synthetic CMIP6 files & a config file to a temporary directory, and
+    initialize the global CONFIG object with every output written under it
+    """
+
+    def setUp(self):
+        self.prev_config = config.CONFIG
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+        synthetic_data.write_cmip6_dir(os.path.join(self.data_dir, 'cmip'), SPECIES, n_isos=5,
+                                       year_first=1960, year_last=1975)
+        synthetic_data.write_config(os.path.join(self.data_dir, 'config.yml'), SPECIES,
+                                    year_first=1960, year_last=1975)
+        synthetic_data.init_config(self.data_dir)
+
+    def tearDown(self):
+        config.CONFIG = self.prev_config
+        ceds_io.clear_dir_indexes()
+        self.tmp_dir.cleanup()
+
+    def set_output_dir(self, dir_name):
+        """Write output to a new sub-directory of the data directory"""
+        dir_output = os.path.join(self.data_dir, dir_name)
+        os.makedirs(dir_output)
+        config.CONFIG.dirs['output'] = dir_output
+        return dir_output
+
+    def read_output(self, dir_output, f_name):
+        return ceds_io.read_ceds_file(os.path.join(dir_output, f_name), year_dtype='float64')
+
+    def assert_files_close(self, dir_1, dir_2, f_name):
+        df_1 = self.read_output(dir_1, f_name)
+        df_2 = self.read_output(dir_2, f_name)
+        self.assertEqual(df_1.columns.tolist(), df_2.columns.tolist())
+        meta_cols = ['iso', 'sector', 'fuel', 'units']
+        self.assertTrue(df_1[meta_cols].astype(str).equals(df_2[meta_cols].astype(str)))
+        year_cols = df_1.columns[4:]
+        np.testing.assert_allclose(df_1[year_cols].to_numpy(), df_2[year_cols].to_numpy(),
+                                   rtol=1e-12, equal_nan=True)
+
+
+class TestFreezeCalcEmissions(SyntheticDataTestCase):
+
+    def test_matches_separate_functions(self):
+        """Test that the fused freeze & calc output matches freeze_emissions()
+        followed by calc_emissions(), and that the frozen EF files are only
+        written if requested
+        """
+        dir_separate = self.set_output_dir('separate')
+        driver.freeze_emissions()
+        driver.calc_emissions()
+
+        dir_fused = self.set_output_dir('fused')
+        driver.freeze_calc_emissions()
+        self.assertEqual(glob.glob(os.path.join(dir_fused, 'H.*_total_EFs_extended.csv')), [])
+        for species in SPECIES:
+            self.assert_files_close(dir_separate, dir_fused,
+                                    '{}_total_CEDS_emissions.csv'.format(species))
+
+        dir_fused_efs = self.set_output_dir('fused_efs')
+        driver.freeze_calc_emissions(write_efs=True)
+        for species in SPECIES:
+            self.assert_files_close(dir_separate, dir_fused_efs,
+                                    'H.{}_total_EFs_extended.csv'.format(species))
+            self.assert_files_close(dir_separate, dir_fused_efs,
+                                    '{}_total_CEDS_emissions.csv'.format(species))
+
+
+class TestRunParallel(SyntheticDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.log_dir = os.path.join(self.data_dir, 'logs')
+        self.log_backend = log_config.QueueLogging(self.log_dir, 'main', console=False)
+
+    def tearDown(self):
+        self.log_backend.stop()
+        super().tearDown()
+
+    def read_log(self, f_name):
+        with open(os.path.join(self.log_dir, f_name)) as fh:
+            return fh.read()
+
+    def test_workers(self):
+        """Test that species are processed by worker processes, whose log
+        records are routed to their species' logs, & that a species without an
+        activity file is reported as failed
+        """
+        os.remove(os.path.join(config.CONFIG.dirs['cmip6'], 'H.SO2_total_activity_extended.csv'))
+        dir_serial = self.set_output_dir('serial')
+        driver.freeze_calc_species('BC')
+
+        dir_parallel = self.set_output_dir('parallel')
+        driver.run_parallel('all', 2)
+        self.log_backend.stop()
+        self.assert_files_close(dir_serial, dir_parallel, 'BC_total_CEDS_emissions.csv')
+        self.assertFalse(os.path.exists(os.path.join(dir_parallel,
+                                                     'SO2_total_CEDS_emissions.csv')))
+
+        main_log = self.read_log('main.log')
+        self.assertIn('Emissions calculation failed for SO2', main_log)
+        self.assertNotIn('Emissions calculation failed for BC', main_log)
+        bc_log = self.read_log('main-BC.log')
+        self.assertIn('Finished calculating total emissions for BC', bc_log)
+        self.assertNotIn('SO2', bc_log)
+        so2_log = self.read_log('main-SO2.log')
+        self.assertIn('activity', so2_log)
+        self.assertNotIn('BC', so2_log)
+
+
+class TestSweepEmissions(SyntheticDataTestCase):
+
+    def test_sweep(self):
+        """Test that every scenario is written to its own output directory,
+        that the CMIP6 files are read once per species, & that the global
+        CONFIG object is restored afterwards
+        """
+        base_config = config.CONFIG
+        base_config.scenarios = [{'name' : 'freeze-1970', 'year' : 1970,
+                                  'isos' : base_config.freeze_isos},
+                                 {'name' : 'freeze-1965', 'year' : 1965,
+                                  'isos' : base_config.freeze_isos}]
+        with mock.patch('ceds_io.read_ceds_file_cached',
+                        wraps=ceds_io.read_ceds_file_cached) as read_mock:
+            driver.sweep_emissions()
+        self.assertIs(config.CONFIG, base_config)
+
+        dir_cmip6 = base_config.dirs['cmip6']
+        read_paths = [os.path.relpath(call[0][0], dir_cmip6) for call in read_mock.call_args_list]
+        expected = ['H.{}_total_{}_extended.csv'.format(species, f_type)
+                    for species in SPECIES for f_type in ['EFs', 'activity']]
+        # The reference file of the SO2 mass-balance correction
+        expected.append(os.path.normpath(synthetic_data.CORRECTION_FILE))
+        self.assertEqual(sorted(read_paths), sorted(expected))
+
+        dir_output = base_config.dirs['output']
+        for scenario in base_config.scenarios:
+            f_names = os.listdir(os.path.join(dir_output, scenario['name']))
+            for species in SPECIES:
+                self.assertIn('{}_total_CEDS_emissions.csv'.format(species), f_names)
+        self.assertEqual(glob.glob(os.path.join(dir_output, '*.csv')), [])
+        df_1970 = self.read_output(os.path.join(dir_output, 'freeze-1970'),
+                                   'BC_total_CEDS_emissions.csv')
+        df_1965 = self.read_output(os.path.join(dir_output, 'freeze-1965'),
+                                   'BC_total_CEDS_emissions.csv')
+        self.assertFalse(np.allclose(df_1970['X1975'], df_1965['X1975']))
+
+
+# ------------------------------------ Main ------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
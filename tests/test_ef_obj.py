@@ -5,8 +5,13 @@ Matt Nicholson
 12 Feb 2020
 """
 import unittest
+import logging
 import sys
 import os
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
 
 # Insert src directory to Python path for importing
 sys.path.insert(1, '../src')
@@ -67,6 +72,169 @@ class TestEmissionFactorFile(unittest.TestCase):
         self.assertEqual(sorted(self.ef_obj.get_isos()), utils_for_tests.expected_isos)
         self.assertEqual(sorted(self.ef_obj.get_isos(ef='all')), utils_for_tests.expected_isos)
         
+class TestEmissionFactorArray(unittest.TestCase):
+    """
+    Test that the array-backed EmissionFactorArray produces the same frozen EFs
+    as EmissionFactorFile, using a small temporary EF file
+    """
+    
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        config.CONFIG.cache['enabled'] = False
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.ef_path = os.path.join(self.tmp_dir.name, 'H.BC_total_EFs_extended.csv')
+        with open(self.ef_path, 'w') as fh:
+            fh.write('iso,sector,fuel,units,X1969,X1970,X1971,X1972\n')
+            fh.write('usa,1A3b_Road,diesel_oil,kt/kt,0.5,1,1.5,2\n')
+            fh.write('usa,2A1_Cement-production,process,kt/kt,0.5,1,1.5,2\n')
+            fh.write('can,1A4b_Residential,biomass,kt/kt,0.25,0.5,0.75,1\n')
+            fh.write('chn,1A3b_Road,diesel_oil,kt/kt,0.5,,1.5,2\n')
+        self.year_strs = ['X1970', 'X1971', 'X1972']
+    
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+    
+    def freeze(self, ef_class, in_place=False):
+        ef_obj = ef_class('BC', self.ef_path)
+        ef_obj.freeze_emissions(self.year_strs, in_place=in_place)
+        ef_obj.reconstruct_emissions()
+        return ef_obj
+    
+    def test_freeze(self):
+        """Test that only combustion EFs for years after the freeze year are changed
+        """
+        ef_obj = self.freeze(emission_factor_file.EmissionFactorArray)
+        self.assertEqual(ef_obj.get_comb_shape(), (3, 8))
+        self.assertEqual(ef_obj.data[:3, 1:].tolist(), [[1.0, 1.0, 1.0],
+                                                        [1.0, 1.5, 2.0],
+                                                        [0.5, 0.5, 0.5]])
+        # Combustion EFs with a NaN freeze year value are left unchanged
+        self.assertEqual(ef_obj.data[3, 2:].tolist(), [1.5, 2.0])
+    
+    def test_freeze_matches_dataframe(self):
+        """Test that both EF backends produce identical frozen EFs
+        """
+        ef_df = self.freeze(emission_factor_file.EmissionFactorFile).all_factors
+        ef_arr = self.freeze(emission_factor_file.EmissionFactorArray).all_factors
+        pd.testing.assert_frame_equal(ef_df, ef_arr)
+    
+    def test_freeze_in_place(self):
+        """Test that freezing in place gives the same EFs as freezing the
+        combustion EFs & reconstructing
+        """
+        ef_obj = self.freeze(emission_factor_file.EmissionFactorFile, in_place=True)
+        self.assertTrue(ef_obj.frozen_in_place)
+        ef_df = self.freeze(emission_factor_file.EmissionFactorFile).all_factors
+        pd.testing.assert_frame_equal(ef_obj.all_factors, ef_df)
+    
+    def test_filter_isos(self):
+        """Test that only the combustion EFs of the frozen ISOs are selected
+        """
+        config.CONFIG.freeze_isos = ['usa']
+        ef_obj = emission_factor_file.EmissionFactorArray('BC', self.ef_path)
+        self.assertEqual(ef_obj.get_isos(), ['usa'])
+        self.assertEqual(ef_obj.get_sectors(), ['1A3b_Road'])
+        self.assertEqual(ef_obj.get_isos(ef='all'), ['usa', 'can', 'chn'])
+        
+class TestDiagnosticsPolicy(unittest.TestCase):
+    """
+    Test the off, deferred, & eager diagnostics policies
+    """
+    
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        config.CONFIG.cache['enabled'] = False
+        emission_factor_file.clear_deferred_diagnostics()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config.CONFIG.dirs['root'] = self.tmp_dir.name
+        self.ef_path = os.path.join(self.tmp_dir.name, 'H.BC_total_EFs_extended.csv')
+        with open(self.ef_path, 'w') as fh:
+            fh.write('iso,sector,fuel,units,X1969,X1970\n')
+            fh.write('usa,1A3b_Road,diesel_oil,kt/kt,0.5,1\n')
+            fh.write('usa,2A1_Cement-production,process,kt/kt,0.5,1\n')
+        self.diag_path = os.path.join(self.tmp_dir.name, 'src', 'diagnostics',
+                                      'BC_frozen_isos_sectors.csv')
+    
+    def tearDown(self):
+        emission_factor_file.clear_deferred_diagnostics()
+        self.tmp_dir.cleanup()
+    
+    def test_default_policy(self):
+        """Test that diagnostics are deferred by default
+        """
+        self.assertEqual(config.CONFIG.diagnostics, {'policy' : 'deferred'})
+    
+    def test_off(self):
+        """Test that no diagnostics file is written or deferred
+        """
+        config.CONFIG.diagnostics['policy'] = 'off'
+        for ef_class in [emission_factor_file.EmissionFactorFile,
+                         emission_factor_file.EmissionFactorArray]:
+            ef_class('BC', self.ef_path)
+        self.assertEqual(emission_factor_file.write_deferred_diagnostics(), 0)
+        self.assertFalse(os.path.exists(self.diag_path))
+    
+    def test_deferred(self):
+        """Test that the diagnostics file is only written at the end of the run
+        """
+        for ef_class in [emission_factor_file.EmissionFactorFile,
+                         emission_factor_file.EmissionFactorArray]:
+            ef_class('BC', self.ef_path)
+            self.assertFalse(os.path.exists(self.diag_path))
+            self.assertEqual(emission_factor_file.write_deferred_diagnostics(), 1)
+            diag_df = pd.read_csv(self.diag_path)
+            self.assertEqual(diag_df.values.tolist(), [['usa', '1A3b_Road', 'diesel_oil']])
+            os.remove(self.diag_path)
+        self.assertEqual(emission_factor_file.write_deferred_diagnostics(), 0)
+
+    def test_deferred_no_copy(self):
+        """Test that deferring the diagnostics file doesn't copy the meta columns,
+        & that freezing the EFs afterwards doesn't change the file
+        """
+        for ef_class in [emission_factor_file.EmissionFactorFile,
+                         emission_factor_file.EmissionFactorArray]:
+            ef_obj = ef_class('BC', self.ef_path)
+            columns, _ = emission_factor_file._DEFERRED_DIAGNOSTICS[self.diag_path]
+            if (ef_class is emission_factor_file.EmissionFactorArray):
+                source_iso = ef_obj.meta['iso']
+            else:
+                source_iso = ef_obj.combustion_factors['iso']
+            self.assertTrue(np.shares_memory(columns['iso'].array.codes,
+                                             source_iso.array.codes))
+            ef_obj.freeze_emissions(['X1969', 'X1970'], in_place=True)
+            emission_factor_file.write_deferred_diagnostics()
+            diag_df = pd.read_csv(self.diag_path)
+            self.assertEqual(diag_df.values.tolist(), [['usa', '1A3b_Road', 'diesel_oil']])
+
+    def test_eager(self):
+        """Test that the diagnostics file is written when the EF object is created
+        """
+        config.CONFIG.diagnostics['policy'] = 'eager'
+        emission_factor_file.EmissionFactorFile('BC', self.ef_path)
+        self.assertTrue(os.path.isfile(self.diag_path))
+        self.assertEqual(emission_factor_file.write_deferred_diagnostics(), 0)
+    
+    def test_invalid_policy(self):
+        """Test that an invalid policy raises a ValueError
+        """
+        config.CONFIG.diagnostics['policy'] = 'sometimes'
+        with self.assertRaises(ValueError):
+            emission_factor_file.EmissionFactorFile('BC', self.ef_path)
+    
+    def test_lazy_log_init(self):
+        """Test that the logged sectors are only gathered if debug records are emitted
+        """
+        ef_obj = emission_factor_file.EmissionFactorArray('BC', self.ef_path)
+        with mock.patch.object(ef_obj, 'get_sectors', return_value=[]) as get_sectors:
+            with self.assertLogs('main', level='INFO'):
+                logging.getLogger('main').info('Debug records are not emitted')
+                ef_obj._log_init()
+            get_sectors.assert_not_called()
+            with self.assertLogs('main', level='DEBUG') as logs:
+                ef_obj._log_init()
+            get_sectors.assert_called_once_with()
+        self.assertIn('Comb Sectors...[]', '\n'.join(logs.output))
+        
 # ------------------------------------ Main ------------------------------------
 
 if __name__ == '__main__':
@@ -0,0 +1,124 @@
+"""
+Tests for the per-stage timing & memory instrumentation in instrument.py
+"""
+import unittest
+import sys
+import os
+import csv
+import json
+import tempfile
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, '../src')
+
+import config
+import instrument
+
+
+class TestInstrument(unittest.TestCase):
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        instrument.clear_records()
+
+    def tearDown(self):
+        instrument.clear_records()
+
+    def test_default_options(self):
+        """Test that instrumentation is enabled without tracemalloc by default
+        """
+        self.assertEqual(config.CONFIG.instrument, {'enabled' : True, 'tracemalloc' : False})
+
+    def test_stage(self):
+        """Test that a stage is recorded with its species & times
+        """
+        with instrument.stage('read_ef', 'BC'):
+            sum(range(1000))
+        records = instrument.get_records()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['species'], 'BC')
+        self.assertEqual(records[0]['stage'], 'read_ef')
+        self.assertGreaterEqual(records[0]['wall_s'], 0)
+        self.assertGreaterEqual(records[0]['cpu_s'], 0)
+        self.assertIsNone(records[0]['traced_peak_mb'])
+
+    @unittest.skipUnless(os.path.exists('/proc/self/statm'), 'RSS is only sampled on Linux')
+    def test_stage_rss(self):
+        """Test that the RSS change of a stage is recorded separately from the
+        RSS high-water mark of the process
+        """
+        with instrument.stage('read_ef', 'BC'):
+            block = bytearray(64 * 2 ** 20)
+            block[::4096] = b'x' * len(block[::4096])
+        with instrument.stage('freeze', 'BC'):
+            del block
+        alloc, free = instrument.get_records()
+        self.assertGreater(alloc['rss_delta_mb'], 32)
+        self.assertLess(free['rss_delta_mb'], -32)
+        # The high-water mark still includes the freed block
+        self.assertGreater(free['max_rss_mb'] - free['rss_mb'], 32)
+
+    def test_stage_exception(self):
+        """Test that a stage is recorded even if it raises
+        """
+        with self.assertRaises(ValueError):
+            with instrument.stage('freeze', 'CO'):
+                raise ValueError('test')
+        self.assertEqual(instrument.get_records()[0]['stage'], 'freeze')
+
+    def test_tracemalloc(self):
+        """Test that the traced peak memory is recorded when enabled
+        """
+        config.CONFIG.instrument['tracemalloc'] = True
+        with instrument.stage('multiply', 'NOx'):
+            block = [0] * 100000
+        del block
+        self.assertGreater(instrument.get_records()[0]['traced_peak_mb'], 0)
+        instrument.tracemalloc.stop()
+
+    def test_timed(self):
+        """Test the timed() decorator
+        """
+        @instrument.timed('correct')
+        def func(species, value):
+            return value * 2
+        self.assertEqual(func('SO2', 2), 4)
+        records = instrument.get_records()
+        self.assertEqual((records[0]['species'], records[0]['stage']), ('SO2', 'correct'))
+
+    def test_disabled(self):
+        """Test that nothing is recorded or written when disabled
+        """
+        config.CONFIG.instrument['enabled'] = False
+        with instrument.stage('read_ef', 'BC'):
+            pass
+        self.assertEqual(instrument.get_records(), [])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertEqual(instrument.write_report(tmp_dir), [])
+
+    def test_write_report(self):
+        """Test that the JSON & CSV reports hold every record, including those
+        added from worker processes
+        """
+        with instrument.stage('read_ef', 'BC'):
+            pass
+        instrument.add_records([{'species' : 'CO', 'stage' : 'freeze', 'start_s' : 0.0,
+                                 'wall_s' : 1.0, 'cpu_s' : 1.0, 'rss_mb' : None,
+                                 'rss_delta_mb' : None, 'max_rss_mb' : None,
+                                 'traced_peak_mb' : None}])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_dir = os.path.join(tmp_dir, 'diagnostic')
+            json_path, csv_path = instrument.write_report(out_dir, f_base='stages')
+            with open(json_path, 'r') as fh:
+                info = json.load(fh)
+            self.assertEqual([r['species'] for r in info['stages']], ['BC', 'CO'])
+            with open(csv_path, 'r', newline='') as fh:
+                rows = list(csv.DictReader(fh))
+            self.assertEqual(list(rows[0].keys()), instrument.REPORT_FIELDS)
+            self.assertEqual([r['stage'] for r in rows], ['read_ef', 'freeze'])
+
+
+# ------------------------------------ Main ------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
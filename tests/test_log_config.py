@@ -0,0 +1,95 @@
+"""
+Tests for the queue-based logging backend in log_config.py
+"""
+import unittest
+import sys
+import os
+import logging
+import multiprocessing
+import tempfile
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, '../src')
+
+import log_config
+
+LOG_NAME = 'test_log_config'
+
+
+def _log_from_worker(log_queue):
+    logger = log_config.init_worker_logger(log_queue, LOG_NAME)
+    with log_config.species_context('SO2'):
+        logger.info('Hello from a worker')
+
+
+class TestQueueLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backend = log_config.QueueLogging(self.tmp_dir.name, LOG_NAME, console=False)
+        self.logger = self.backend.logger
+
+    def tearDown(self):
+        self.backend.stop()
+        self.tmp_dir.cleanup()
+
+    def read_log(self, f_name):
+        with open(os.path.join(self.tmp_dir.name, f_name)) as fh:
+            return fh.read()
+
+    def test_species_routing(self):
+        """Test that records are written to the main log & their species' log
+        """
+        self.logger.info('Before any species')
+        with log_config.species_context('BC'):
+            self.logger.debug('Freezing %s', 'BC')
+        self.backend.stop()
+        main_log = self.read_log(LOG_NAME + '.log')
+        self.assertIn('Before any species', main_log)
+        self.assertIn('Freezing BC', main_log)
+        species_log = self.read_log(LOG_NAME + '-BC.log')
+        self.assertIn('Freezing BC', species_log)
+        self.assertNotIn('Before any species', species_log)
+        self.assertIsNone(log_config.get_species_context())
+
+    def test_stop_idempotent(self):
+        """Test that stopping twice is harmless & removes the queue handler
+        """
+        self.backend.stop()
+        self.backend.stop()
+        self.assertEqual(self.logger.handlers, [])
+
+    def test_worker_queue(self):
+        """Test that records of a worker process are forwarded with their species
+        """
+        with log_config.worker_queue(LOG_NAME) as log_queue:
+            worker = multiprocessing.Process(target=_log_from_worker, args=(log_queue,))
+            worker.start()
+            worker.join()
+        self.backend.stop()
+        self.assertIn('Hello from a worker', self.read_log(LOG_NAME + '.log'))
+        self.assertIn('Hello from a worker', self.read_log(LOG_NAME + '-SO2.log'))
+
+
+class TestProgressFilter(unittest.TestCase):
+
+    def make_record(self, level=logging.INFO, created=0.0, progress=False):
+        record = logging.LogRecord(LOG_NAME, level, __file__, 0, 'msg', None, None)
+        record.created = created
+        if (progress):
+            record.progress = True
+        return record
+
+    def test_rate_limit(self):
+        """Test that progress records are rate-limited & warnings always shown
+        """
+        progress_filter = log_config.ProgressFilter(min_interval=1.0)
+        self.assertTrue(progress_filter.filter(self.make_record(created=10.0, progress=True)))
+        self.assertFalse(progress_filter.filter(self.make_record(created=10.5, progress=True)))
+        self.assertTrue(progress_filter.filter(self.make_record(created=11.0, progress=True)))
+        self.assertFalse(progress_filter.filter(self.make_record(created=20.0)))
+        self.assertTrue(progress_filter.filter(self.make_record(logging.WARNING, created=11.1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
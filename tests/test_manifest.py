@@ -0,0 +1,125 @@
+"""
+Tests for the build manifest in manifest.py
+"""
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, '../src')
+
+import config
+import driver
+import manifest
+import outlier_detection
+import sectors
+
+
+class TestBuildManifest(unittest.TestCase):
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.in_path = os.path.join(self.tmp_dir.name, 'H.BC_total_EFs_extended.csv')
+        self.out_path = os.path.join(self.tmp_dir.name, 'BC_total_CEDS_emissions.csv')
+        for f_path in [self.in_path, self.out_path]:
+            with open(f_path, 'w') as fh:
+                fh.write('iso,sector,fuel,units,X1970\nusa,1A3b_Road,diesel_oil,kt,1\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_manifest(self):
+        fingerprint = manifest.get_config_fingerprint('BC')
+        return manifest.BuildManifest('BC', self.tmp_dir.name, [self.in_path],
+                                      [self.out_path], fingerprint)
+
+    def test_current(self):
+        """Test that a species is only current once its manifest is written,
+        and stays current if an input is touched but not modified
+        """
+        self.assertFalse(self.get_manifest().is_current())
+        self.get_manifest().update()
+        self.assertTrue(self.get_manifest().is_current())
+        f_stat = os.stat(self.in_path)
+        os.utime(self.in_path, ns=(f_stat.st_atime_ns, f_stat.st_mtime_ns + 10**9))
+        self.assertTrue(self.get_manifest().is_current())
+
+    def test_input_changed(self):
+        """Test that modifying an input file makes the species stale
+        """
+        self.get_manifest().update()
+        with open(self.in_path, 'a') as fh:
+            fh.write('can,1A3b_Road,diesel_oil,kt,2\n')
+        self.assertFalse(self.get_manifest().is_current())
+
+    def test_output_removed(self):
+        """Test that removing an output file makes the species stale
+        """
+        self.get_manifest().update()
+        os.remove(self.out_path)
+        self.assertFalse(self.get_manifest().is_current())
+
+    def test_config_changed(self):
+        """Test that changing the freeze year makes the species stale
+        """
+        self.get_manifest().update()
+        config.CONFIG.freeze_year += 1
+        self.assertFalse(self.get_manifest().is_current())
+
+
+class TestGetBuildManifest(unittest.TestCase):
+    """
+    Test that the species manifests built by the driver track every file that
+    affects a species' output
+    """
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for dir_name in ['input', 'cmip6', 'output']:
+            config.CONFIG.dirs[dir_name] = os.path.join(self.tmp_dir.name, dir_name)
+            os.makedirs(config.CONFIG.dirs[dir_name])
+        for f_name in [sectors.MASTER_SECTOR_FILE, outlier_detection.ISO_REGIONS_FILE]:
+            shutil.copy(os.path.join(sectors.DEFAULT_INPUT_DIR, f_name),
+                        config.CONFIG.dirs['input'])
+        for f_name in ['H.BC_total_EFs_extended.csv', 'H.BC_total_activity_extended.csv']:
+            with open(os.path.join(config.CONFIG.dirs['cmip6'], f_name), 'w') as fh:
+                fh.write('iso,sector,fuel,units,X1970\nusa,1A3b_Road,diesel_oil,kt,1\n')
+        open(os.path.join(config.CONFIG.dirs['output'], 'BC_total_CEDS_emissions.csv'),
+             'w').close()
+
+    def tearDown(self):
+        sectors.clear_registries()
+        self.tmp_dir.cleanup()
+
+    def update_input(self, f_name, line):
+        """Write a current manifest, then append a line to an input file"""
+        driver.get_build_manifest('BC').update()
+        self.assertTrue(driver.get_build_manifest('BC').is_current())
+        with open(os.path.join(config.CONFIG.dirs['input'], f_name), 'a') as fh:
+            fh.write(line)
+
+    def test_master_sector_file(self):
+        """Test that editing the master sector file makes the species stale
+        """
+        self.update_input(sectors.MASTER_SECTOR_FILE, 'new-sector,comb\n')
+        self.assertFalse(driver.get_build_manifest('BC').is_current())
+
+    def test_iso_regions_file(self):
+        """Test that editing the ISO to region mapping makes the species stale
+        only if outliers are replaced by their regional median
+        """
+        self.update_input(outlier_detection.ISO_REGIONS_FILE, 'xyz,Nowhere,XYZ\n')
+        self.assertTrue(driver.get_build_manifest('BC').is_current())
+        config.CONFIG.outliers['replacement'] = 'region_median'
+        self.update_input(outlier_detection.ISO_REGIONS_FILE, 'abc,Nowhere,XYZ\n')
+        self.assertFalse(driver.get_build_manifest('BC').is_current())
+
+
+# ------------------------------------ Main ------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
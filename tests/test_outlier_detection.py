@@ -0,0 +1,296 @@
+"""
+Tests for the outlier detectors in outlier_detection.py
+"""
+import unittest
+import sys
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, '../src')
+
+import config
+import emission_factor_file
+import outlier_detection
+import sectors
+import z_stats
+
+
+class MockEFObj:
+    """
+    Minimal stand-in for an EmissionFactorFile instance that only holds a
+    combustion EF dataframe & a freeze year
+    """
+    def __init__(self, comb_df, freeze_year='X1970'):
+        self.combustion_factors = comb_df
+        self.freeze_year = freeze_year
+
+    def get_factors_combustion(self):
+        return self.combustion_factors
+
+    def get_comb_columns(self, columns):
+        return self.combustion_factors[columns]
+
+    def get_isos(self, unique=True):
+        return self.combustion_factors['iso'].tolist()
+
+
+def make_comb_df(seed=0):
+    """
+    Create a combustion EF dataframe with log-normal groups containing a few
+    large values, an all-zero group, & a group with a NaN value
+    """
+    rng = np.random.default_rng(seed)
+    sectors = ['1A1a_Electricity-public', '1A3b_Road', '1A4b_Residential']
+    fuels = ['biomass', 'hard_coal', 'natural_gas']
+    rows = [(sector, fuel) for sector in sectors for fuel in fuels for _ in range(30)]
+    df = pd.DataFrame(rows, columns=['sector', 'fuel'])
+    # 'xyz' has no region
+    df['iso'] = (['usa', 'can', 'fra', 'deu', 'xyz'] * 6) * (len(sectors) * len(fuels))
+    df['X1970'] = rng.lognormal(0, 1, df.shape[0])
+    df.loc[rng.choice(df.shape[0], 10, replace=False), 'X1970'] *= 50
+    df.loc[(df['sector'] == '1A3b_Road') & (df['fuel'] == 'biomass'), 'X1970'] = 0.0
+    df.loc[df.index[-1], 'X1970'] = np.nan
+    # Shuffle the rows so that groups are not contiguous
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+class TestOutlierDetection(unittest.TestCase):
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        self.ef_obj = MockEFObj(make_comb_df())
+        self.groups = outlier_detection.EFGroups.from_ef_obj(self.ef_obj)
+        self.comb_df = self.ef_obj.combustion_factors
+
+    def _expected(self, func):
+        """Apply a per-group detector to every valid group of the dataframe"""
+        expected = pd.Series(False, index=self.comb_df.index)
+        for _, group in self.comb_df.groupby(['sector', 'fuel']):
+            vals = group['X1970'].to_numpy()
+            if (np.isnan(vals).any() or (vals == 0).all()):
+                continue
+            expected.loc[group.index] = func(vals)
+        return expected
+
+    def test_groups(self):
+        """Test the precomputed group statistics
+        """
+        self.assertEqual(self.groups.n_groups, 9)
+        self.assertEqual(self.groups.counts.tolist(), [30] * 9)
+        self.assertEqual(int(self.groups.valid.sum()), 7)
+        for code in range(self.groups.n_groups):
+            vals = self.groups.values[self.groups.codes == code]
+            if (not self.groups.valid[code]):
+                continue
+            self.assertAlmostEqual(self.groups.mean[code], np.mean(vals))
+            self.assertAlmostEqual(self.groups.std[code], np.std(vals))
+            self.assertAlmostEqual(self.groups.median[code], np.median(vals))
+            self.assertAlmostEqual(self.groups.quantile(0.25)[code], np.percentile(vals, 25))
+            self.assertAlmostEqual(self.groups.mad[code],
+                                   np.median(np.abs(vals - np.median(vals))))
+
+    def test_zscore(self):
+        """Test that the z-score detector matches scipy's z-scores of every group
+        """
+        outliers = outlier_detection.get_outliers(self.ef_obj)
+        expected = self._expected(lambda vals: np.abs(stats.zscore(vals)) > 3)
+        self.assertTrue(outliers.any())
+        self.assertTrue(outliers.equals(expected))
+
+    def test_zscore_matches_z_stats(self):
+        """Test that the z-score detector agrees with z_stats.get_outliers_zscore()
+        for every sector & fuel group
+        """
+        outliers = outlier_detection.detect(self.groups, 'zscore')
+        for (sector, fuel), group in self.comb_df.groupby(['sector', 'fuel']):
+            if (group['X1970'].isna().any()):
+                continue
+            sub_obj = MockEFObj(group.reset_index(drop=True))
+            expected = [olr[2] for olr in z_stats.get_outliers_zscore(sub_obj, sector, fuel)]
+            actual = np.where(outliers.loc[group.index].values)[0].tolist()
+            self.assertEqual(actual, expected)
+
+    def test_iqr(self):
+        """Test the IQR detector
+        """
+        def iqr(vals, const=2.0):
+            q1, q3 = np.percentile(vals, 25), np.percentile(vals, 75)
+            return (vals > q3 + (q3 - q1) * const) | (vals < q1 - (q3 - q1) * const)
+        outliers = outlier_detection.detect(self.groups, 'iqr', outlier_const=2.0)
+        self.assertTrue(outliers.equals(self._expected(iqr)))
+
+    def test_mad(self):
+        """Test the MAD detector
+        """
+        def mad(vals):
+            med = np.median(vals)
+            return 0.6745 * np.abs(vals - med) / np.median(np.abs(vals - med)) > 3.5
+        outliers = outlier_detection.detect(self.groups, 'mad')
+        self.assertTrue(outliers.any())
+        self.assertTrue(outliers.equals(self._expected(mad)))
+
+    def test_boxcox_zscore(self):
+        """Test the Box-Cox + z-score detector
+        """
+        def boxcox_zscore(vals):
+            xt, _ = z_stats.boxcox_array(vals)
+            return np.abs(stats.zscore(xt)) > 3
+        outliers = outlier_detection.detect(self.groups, 'boxcox_zscore')
+        self.assertTrue(outliers.equals(self._expected(boxcox_zscore)))
+
+    def test_config(self):
+        """Test that the config file's method & parameters are used
+        """
+        self.assertEqual(config.CONFIG.outliers, {'method' : 'zscore', 'params' : {},
+                                                  'replacement' : 'global_median'})
+        config.CONFIG.outliers = {'method' : 'iqr', 'params' : {'outlier_const' : 2.0},
+                                  'replacement' : 'global_median'}
+        outliers = outlier_detection.get_outliers(self.ef_obj)
+        expected = outlier_detection.detect(self.groups, 'iqr', outlier_const=2.0)
+        self.assertTrue(outliers.equals(expected))
+        with self.assertRaises(ValueError):
+            outlier_detection.detect(self.groups, 'grubbs')
+
+    def test_register_detector(self):
+        """Test that registered detectors can be selected by name
+        """
+        @outlier_detection.register_detector('above_median')
+        def detect_above_median(groups):
+            return groups.valid[groups.codes] & (groups.values > groups.median[groups.codes])
+        try:
+            outliers = outlier_detection.detect(self.groups, 'above_median')
+            self.assertEqual(int(outliers.sum()), 7 * 15)
+        finally:
+            del outlier_detection.DETECTORS['above_median']
+
+
+    def test_replace_global_median(self):
+        """Test that the default strategy replaces every outlier with the
+        median of all EFs
+        """
+        outliers = outlier_detection.detect(self.groups)
+        self.assertEqual(config.CONFIG.outliers['replacement'], 'global_median')
+        replacements = outlier_detection.get_replacements(self.groups, outliers)
+        self.assertEqual(replacements.size, outliers.sum())
+        self.assertTrue(np.isnan(replacements).all())
+        self.ef_obj.combustion_factors['X1970'] = self.ef_obj.combustion_factors['X1970'].fillna(1)
+        groups = outlier_detection.EFGroups.from_ef_obj(self.ef_obj)
+        replacements = outlier_detection.get_replacements(groups, outliers)
+        np.testing.assert_array_equal(replacements, np.median(self.comb_df['X1970']))
+
+    def test_replace_sector_fuel_median(self):
+        """Test that outliers are replaced by the median of their group
+        """
+        outliers = outlier_detection.detect(self.groups)
+        replacements = outlier_detection.get_replacements(self.groups, outliers,
+                                                          'sector_fuel_median')
+        medians = self.comb_df.groupby(['sector', 'fuel'])['X1970'].median()
+        expected = [medians[(row.sector, row.fuel)]
+                    for row in self.comb_df.loc[outliers].itertuples()]
+        np.testing.assert_allclose(replacements, expected)
+
+    def test_replace_region_median(self):
+        """Test that outliers are replaced by the median of their group within
+        their region, or of their group if their ISO has no region
+        """
+        outliers = outlier_detection.detect(self.groups, 'iqr')
+        config.CONFIG.outliers['replacement'] = 'region_median'
+        replacements = outlier_detection.get_replacements(self.groups, outliers)
+        regions = self.comb_df['iso'].map({'usa' : 'OtherOECD90', 'can' : 'OtherOECD90',
+                                           'fra' : 'Western Europe', 'deu' : 'Western Europe'})
+        region_medians = self.comb_df.groupby([regions, 'sector', 'fuel'])['X1970'].median()
+        medians = self.comb_df.groupby(['sector', 'fuel'])['X1970'].median()
+        expected = []
+        for row, region in zip(self.comb_df.loc[outliers].itertuples(), regions[outliers]):
+            if (pd.isna(region)):
+                expected.append(medians[(row.sector, row.fuel)])
+            else:
+                expected.append(region_medians[(region, row.sector, row.fuel)])
+        self.assertTrue(regions[outliers].isna().any())
+        np.testing.assert_allclose(replacements, expected)
+        with self.assertRaises(ValueError):
+            outlier_detection.get_replacements(self.groups, outliers, 'mean')
+
+
+def make_zscore_df():
+    """
+    Create a small EF dataframe with one group containing a single large
+    outlier, a group without outliers, a group containing a NaN value, an
+    all-zero group, & a constant (zero standard deviation) group
+    """
+    isos = ['i{:02d}'.format(i) for i in range(20)]
+    groups = [[1.0] * 19 + [100.0],
+              list(np.linspace(1.0, 2.0, 20)),
+              [1.0] * 18 + [np.nan, 100.0],
+              [0.0] * 20,
+              [5.0] * 20]
+    comb_sectors = sectors.get_combustion_sectors()[:len(groups)]
+    df = pd.DataFrame({'iso'    : isos * len(groups),
+                       'sector' : np.repeat(comb_sectors, 20),
+                       'fuel'   : ['biomass'] * 20 * len(groups),
+                       'units'  : ['kt'] * 20 * len(groups),
+                       'X1970'  : np.concatenate(groups)})
+    df['X1971'] = df['X1970'] * 2
+    return df
+
+
+class TestZScoreDetector(unittest.TestCase):
+    """
+    Test the z-score detector on groups that must not produce outliers, & the
+    replacement of outliers in the EF objects
+    """
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        config.CONFIG.diagnostics['policy'] = 'off'
+        self.comb_df = make_zscore_df()
+        self.ef_obj = MockEFObj(self.comb_df)
+
+    def detect(self):
+        groups = outlier_detection.EFGroups.from_ef_obj(self.ef_obj)
+        return outlier_detection.detect(groups, 'zscore')
+
+    def test_single_outlier(self):
+        """Test that only the outlier row is flagged, & that groups with a NaN
+        value, all zeros, or a standard deviation of zero produce no outliers
+        """
+        outliers = self.detect()
+        self.assertEqual(outliers.index[outliers].tolist(), [19])
+
+    def test_skipped_groups_threshold(self):
+        """Test that groups with a NaN value, all zeros, or a standard deviation
+        of zero produce no outliers even with a threshold of zero
+        """
+        groups = outlier_detection.EFGroups.from_ef_obj(self.ef_obj)
+        outliers = outlier_detection.detect_zscore(groups, thresh=0)
+        self.assertFalse(outliers[40:].any())
+        self.assertTrue(outliers[:20].any())
+
+    def test_replace_freeze_year_only(self):
+        """Test that only the freeze year EF of an outlier row is replaced, for
+        both EF backends
+        """
+        for backend in ['dataframe', 'array']:
+            config.CONFIG.freeze_backend = backend
+            ef_obj = emission_factor_file.init_ef_obj('BC', 'H.BC_total_EFs_extended.csv',
+                                                      ef_df=self.comb_df)
+            before = ef_obj.combustion_factors.copy()
+            groups = outlier_detection.EFGroups.from_ef_obj(ef_obj)
+            outliers = outlier_detection.detect(groups, 'zscore')
+            replacements = outlier_detection.get_replacements(groups, outliers,
+                                                              'sector_fuel_median')
+            ef_obj.set_comb_values(ef_obj.freeze_year, outliers, replacements)
+            after = ef_obj.combustion_factors
+            changed = (before != after) & ~(before.isna() & after.isna())
+            self.assertEqual(changed.to_numpy().sum(), 1, backend)
+            self.assertTrue(changed.loc[19, 'X1970'], backend)
+            self.assertEqual(after.loc[19, 'X1970'], 1.0)
+            self.assertEqual(after.loc[19, 'X1971'], 200.0)
+
+
+# ------------------------------------ Main ------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Tests for the sector registry in sectors.py
+"""
+import unittest
+import sys
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, '../src')
+
+import config
+import sectors
+import utils_for_tests
+
+
+class TestSectorRegistry(unittest.TestCase):
+
+    def setUp(self):
+        config.CONFIG = config.ConfigObj('input/test-config.yml')
+        sectors.clear_registries()
+        self.registry = sectors.get_registry()
+
+    def tearDown(self):
+        sectors.clear_registries()
+
+    def test_combustion_sectors(self):
+        """Test that the combustion sectors are those of master_sector.csv
+        """
+        self.assertEqual(sorted(self.registry.combustion_sectors()),
+                         utils_for_tests.expected_sectors)
+        self.assertEqual(sectors.get_combustion_sectors(), self.registry.combustion_sectors())
+
+    def test_registry_memoized(self):
+        """Test that the master sector file is only read once
+        """
+        self.assertIs(sectors.get_registry(), self.registry)
+        self.assertEqual(self.registry.f_path,
+                         os.path.join(config.CONFIG.dirs['input'], sectors.MASTER_SECTOR_FILE))
+
+    def test_codes(self):
+        """Test that sector codes are file positions, with -1 for unknown sectors
+        """
+        all_sectors = self.registry.get_sectors()
+        codes = self.registry.get_codes([all_sectors[3], 'not-a-sector', all_sectors[0]])
+        np.testing.assert_array_equal(codes, [3, -1, 0])
+        self.assertIn(all_sectors[3], self.registry)
+        self.assertNotIn('not-a-sector', self.registry)
+
+    def test_comb_mask(self):
+        """Test the combustion mask of object & categorical sector columns
+        """
+        comb = self.registry.combustion_sectors()
+        non_comb = utils_for_tests.non_combustion_sectors
+        sector_col = pd.Series([comb[0], non_comb[0], 'not-a-sector', None, comb[-1], comb[0]])
+        expected = np.array([True, False, False, False, True, True])
+        np.testing.assert_array_equal(self.registry.comb_mask(sector_col), expected)
+        np.testing.assert_array_equal(self.registry.comb_mask(sector_col.astype('category')),
+                                      expected)
+        np.testing.assert_array_equal(self.registry.comb_mask(sector_col.tolist()), expected)
+
+    def test_custom_file(self):
+        """Test that the sector types come from the master sector file
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            f_path = os.path.join(tmp_dir, 'master_sector.csv')
+            pd.DataFrame({'sector' : ['a', 'b', 'c'],
+                          'type'   : ['comb', 'NC', 'comb']}).to_csv(f_path, index=False)
+            registry = sectors.get_registry(f_path)
+            self.assertEqual(registry.combustion_sectors(), ['a', 'c'])
+            self.assertEqual(registry.get_sectors('NC'), ['b'])
+            np.testing.assert_array_equal(registry.comb_mask(pd.Series(['c', 'b', 'a'])),
+                                          [True, False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
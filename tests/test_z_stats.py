@@ -0,0 +1,85 @@
+"""
+Tests for the functions in z_stats.py
+"""
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Insert src directory to Python path for importing
+sys.path.insert(1, '../src')
+
+import z_stats
+
+
+def make_comb_df():
+    """
+    Create a small combustion EF dataframe with two sector & fuel groups,
+    one of which contains a single large outlier
+    """
+    isos = ['i{:02d}'.format(i) for i in range(20)]
+    efs_1 = [1.0] * 19 + [100.0]
+    efs_2 = list(np.linspace(1.0, 2.0, 20))
+    df = pd.DataFrame({'iso'    : isos * 2,
+                       'sector' : ['1A4b_Residential'] * 20 + ['1A3b_Road'] * 20,
+                       'fuel'   : ['biomass'] * 40,
+                       'units'  : ['kt'] * 40,
+                       'X1970'  : efs_1 + efs_2})
+    return df
+
+
+class TestWriteStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.f_paths = {'f_out_path' : self.tmp_dir.name, 'f_out_name' : 'stats.csv'}
+        self.ef_df = make_comb_df()
+        self.ef_df['X1971'] = self.ef_df['X1970'] * 2
+        # A sector with only one fuel, so ('1A1a_Heat-production', 'hard_coal')
+        # has no rows
+        self.ef_df.loc[0, ['sector', 'fuel']] = ['1A1a_Heat-production', 'biomass']
+        self.ef_df.loc[1, 'fuel'] = 'hard_coal'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_write_stats(self):
+        """Test the statistics of every sector & fuel combination for one year
+        """
+        f_out = z_stats.write_stats(self.ef_df, 'BC', 1970, self.f_paths)
+        self.assertEqual(os.path.basename(f_out), 'BC.stats.csv')
+        stats_df = pd.read_csv(f_out)
+        self.assertEqual(stats_df.columns.tolist(), ['sector', 'fuel', 'mean', 'median', 'std',
+                                                     'sum', 'min_ef', 'max_ef'])
+        self.assertEqual(stats_df.shape[0], 6)
+        for row in stats_df.itertuples(index=False):
+            group = self.ef_df.loc[(self.ef_df['sector'] == row.sector) &
+                                   (self.ef_df['fuel'] == row.fuel), 'X1970']
+            self.assertAlmostEqual(row.sum, group.sum())
+            if (group.size == 0):
+                self.assertTrue(np.isnan(row.mean))
+                continue
+            self.assertAlmostEqual(row.mean, group.mean())
+            self.assertAlmostEqual(row.median, group.median())
+            self.assertAlmostEqual(row.min_ef, group.min())
+            self.assertAlmostEqual(row.max_ef, group.max())
+
+    def test_write_stats_years(self):
+        """Test the statistics of more than one year
+        """
+        f_out = z_stats.write_stats(self.ef_df, 'BC', ['X1970', 1971], self.f_paths)
+        stats_df = pd.read_csv(f_out)
+        self.assertEqual(stats_df.columns.tolist()[:3], ['sector', 'fuel', 'year'])
+        self.assertEqual(stats_df.shape[0], 12)
+        road = stats_df.loc[(stats_df['sector'] == '1A3b_Road') & (stats_df['fuel'] == 'biomass')]
+        self.assertEqual(road['year'].tolist(), ['X1970', 'X1971'])
+        self.assertAlmostEqual(road['sum'].iloc[1], road['sum'].iloc[0] * 2)
+        f_out = z_stats.write_stats(self.ef_df, 'BC', None, self.f_paths)
+        self.assertEqual(pd.read_csv(f_out).shape[0], 12)
+
+# ------------------------------------ Main ------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
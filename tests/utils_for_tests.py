@@ -7,6 +7,8 @@ Matt Nicholson
 import logging
 import os
 
+import sectors
+
 def nuke_logs(target, log_dir):
     """
     Remove any existing logs from the logs/ subdirectory
@@ -106,7 +108,7 @@ def subset_combust_sectors(df):
         -------
         Pandas DataFrame
         """
-        subset_df = df.loc[df['sector'].isin(expected_sectors)].copy()
+        subset_df = df.loc[sectors.get_registry().comb_mask(df['sector'])].copy()
         return subset_df
 # ------------------------------------------------------------------------------
     